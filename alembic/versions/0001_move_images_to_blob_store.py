@@ -0,0 +1,67 @@
+"""move post and avatar images into the blob store
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+Databases created before this revision hold image bytes in users.image and
+posts.image. This copies every image into the blob store, records its sha256
+key in image_key and drops the binary columns.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from services.blob_store import blob_store, read_blob
+
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("users", "posts")
+BATCH_SIZE = 100
+
+
+def _columns(table):
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _move_images(table):
+    import io
+
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        # one small batch at a time so large images never pile up in memory
+        rows = bind.execute(
+            sa.text(f"SELECT id, image FROM {table} WHERE image IS NOT NULL AND id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            key = blob_store.put_stream(io.BytesIO(bytes(row.image))).key
+            bind.execute(sa.text(f"UPDATE {table} SET image_key = :key WHERE id = :id"), {"key": key, "id": row.id})
+            last_id = row.id
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        columns = _columns(table)
+        if "image_key" not in columns:
+            op.add_column(table, sa.Column("image_key", sa.String(64), nullable=True))
+        if "image" in columns:
+            _move_images(table)
+            op.drop_column(table, "image")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    for table in TABLES:
+        op.add_column(table, sa.Column("image", sa.LargeBinary(), nullable=True))
+        rows = bind.execute(sa.text(f"SELECT id, image_key FROM {table} WHERE image_key IS NOT NULL")).all()
+        for row in rows:
+            bind.execute(sa.text(f"UPDATE {table} SET image = :image WHERE id = :id"), {"image": read_blob(row.image_key), "id": row.id})
+        op.drop_column(table, "image_key")
@@ -0,0 +1,53 @@
+"""store sniffed image content types
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+Adds image_content_type next to image_key, backfills it from the first bytes
+of each stored blob and indexes image_key for the /images/{key} lookup.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from services.blob_store import blob_store, sniff_content_type, BlobNotFound
+
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("users", "posts")
+
+
+def _sniff(key):
+    try:
+        with blob_store.get_object(key, Range="bytes=0-31")["Body"] as body:
+            return sniff_content_type(body.read(32))
+    except BlobNotFound:
+        return None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for table in TABLES:
+        # tables created by create_all on a new database already have both
+        if "image_content_type" not in {column["name"] for column in inspector.get_columns(table)}:
+            op.add_column(table, sa.Column("image_content_type", sa.String(), nullable=True))
+        if f"ix_{table}_image_key" not in {index["name"] for index in inspector.get_indexes(table)}:
+            op.create_index(f"ix_{table}_image_key", table, ["image_key"])
+        keys = bind.execute(sa.text(f"SELECT DISTINCT image_key FROM {table} WHERE image_key IS NOT NULL")).scalars().all()
+        for key in keys:
+            bind.execute(
+                sa.text(f"UPDATE {table} SET image_content_type = :content_type WHERE image_key = :key"),
+                {"content_type": _sniff(key), "key": key}
+            )
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.drop_index(f"ix_{table}_image_key", table_name=table)
+        op.drop_column(table, "image_content_type")
@@ -0,0 +1,40 @@
+"""image variants table
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+Resized copies of uploaded images. Existing images can be processed with
+`python -m services.images`.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("image_variants"):
+        return
+    op.create_table(
+        "image_variants",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("source_key", sa.String(64), nullable=False),
+        sa.Column("variant", sa.String(), nullable=False),
+        sa.Column("key", sa.String(64), nullable=False),
+        sa.Column("content_type", sa.String(), nullable=False),
+        sa.Column("width", sa.Integer()),
+        sa.Column("height", sa.Integer()),
+        sa.UniqueConstraint("source_key", "variant", name="uq_image_variants_source_variant"),
+    )
+    op.create_index("ix_image_variants_source_key", "image_variants", ["source_key"])
+    op.create_index("ix_image_variants_key", "image_variants", ["key"])
+
+
+def downgrade() -> None:
+    op.drop_table("image_variants")
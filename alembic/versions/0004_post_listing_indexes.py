@@ -0,0 +1,27 @@
+"""indexes for keyset pagination and substring filters on GET /posts/
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_posts_created_at_id ON posts (created_at, id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_posts_tag_trgm ON posts USING gin (tag gin_trgm_ops)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_users_username_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_posts_tag_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_posts_created_at_id")
@@ -0,0 +1,64 @@
+"""normalized tags with a post_tags association
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+Splits the comma-joined posts.tag strings into tags/post_tags and fills the
+post_count counters. posts.tag stays as the display copy; its trigram index
+is no longer needed.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0005"
+down_revision: Union[str, Sequence[str], None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("tags"):
+        op.create_table(
+            "tags",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("slug", sa.String(), nullable=False, unique=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("post_count", sa.Integer(), nullable=False, server_default="0"),
+        )
+        op.create_index("ix_tags_post_count", "tags", ["post_count"])
+    if not inspector.has_table("post_tags"):
+        op.create_table(
+            "post_tags",
+            sa.Column("post_id", sa.Integer(), sa.ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("tag_id", sa.Integer(), sa.ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+        )
+        op.create_index("ix_post_tags_tag_id_post_id", "post_tags", ["tag_id", "post_id"])
+
+    op.execute("""
+        INSERT INTO tags (slug, name, post_count)
+        SELECT DISTINCT ON (lower(trim(t.name))) lower(trim(t.name)), trim(t.name), 0
+        FROM posts, regexp_split_to_table(coalesce(posts.tag, 'Other'), ',') AS t(name)
+        WHERE trim(t.name) <> ''
+        ORDER BY lower(trim(t.name)), posts.id
+        ON CONFLICT (slug) DO NOTHING
+    """)
+    op.execute("""
+        INSERT INTO post_tags (post_id, tag_id)
+        SELECT DISTINCT posts.id, tags.id
+        FROM posts
+        CROSS JOIN regexp_split_to_table(coalesce(posts.tag, 'Other'), ',') AS t(name)
+        JOIN tags ON tags.slug = lower(trim(t.name))
+        ON CONFLICT DO NOTHING
+    """)
+    op.execute("UPDATE tags SET post_count = (SELECT count(*) FROM post_tags WHERE post_tags.tag_id = tags.id)")
+    op.execute("DROP INDEX IF EXISTS ix_posts_tag_trgm")
+
+
+def downgrade() -> None:
+    op.execute("CREATE INDEX IF NOT EXISTS ix_posts_tag_trgm ON posts USING gin (tag gin_trgm_ops)")
+    op.drop_table("post_tags")
+    op.drop_table("tags")
@@ -0,0 +1,34 @@
+"""full-text search vectors for posts and comments
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+Replaces the b-tree indexes on posts.content / comments.content (too large to
+be useful and unable to serve search) with generated tsvector columns and GIN
+indexes.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from models import SEARCH_VECTORS
+
+revision: str = "0006"
+down_revision: Union[str, Sequence[str], None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    for table, expression in SEARCH_VECTORS.items():
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_content")
+        op.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({expression}) STORED")
+        op.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_search_vector ON {table} USING gin (search_vector)")
+
+
+def downgrade() -> None:
+    for table in SEARCH_VECTORS:
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_search_vector")
+        op.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+        op.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_content ON {table} (content)")
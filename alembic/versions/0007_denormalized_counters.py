@@ -0,0 +1,51 @@
+"""denormalized like, comment, post and follower counters
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+
+The counters are filled from the source tables here; after that the write
+handlers keep them current and `python -m services.counters` repairs drift.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0007"
+down_revision: Union[str, Sequence[str], None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table -> counter column -> (source table, source column)
+COUNTERS = {
+    "posts": {
+        "like_count": ("likes", "post_id"),
+        "comment_count": ("comments", "post_id"),
+    },
+    "users": {
+        "post_count": ("posts", "author_id"),
+        "follower_count": ("follows", "following_id"),
+        "following_count": ("follows", "follower_id"),
+    },
+}
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table, counters in COUNTERS.items():
+        existing = {column["name"] for column in inspector.get_columns(table)}
+        for column, (source, source_column) in counters.items():
+            if column not in existing:
+                op.add_column(table, sa.Column(column, sa.Integer(), nullable=False, server_default="0"))
+            op.execute(
+                f"UPDATE {table} SET {column} = counts.n FROM "
+                f"(SELECT {source_column} AS id, count(*) AS n FROM {source} GROUP BY {source_column}) AS counts "
+                f"WHERE {table}.id = counts.id"
+            )
+
+
+def downgrade() -> None:
+    for table, counters in COUNTERS.items():
+        for column in counters:
+            op.drop_column(table, column)
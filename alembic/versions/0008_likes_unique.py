@@ -0,0 +1,40 @@
+"""one like per user and post
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+
+Removes duplicate likes, adds the (user_id, post_id) unique constraint used
+by INSERT ... ON CONFLICT DO NOTHING and a (post_id, id) index for paging
+likers, then recounts posts.like_count.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0008"
+down_revision: Union[str, Sequence[str], None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        DELETE FROM likes a USING likes b
+        WHERE a.user_id = b.user_id AND a.post_id = b.post_id AND a.id > b.id
+    """)
+    # a database built by create_all already has both
+    inspector = sa.inspect(op.get_bind())
+    if "uq_likes_user_post" not in {constraint["name"] for constraint in inspector.get_unique_constraints("likes")}:
+        op.create_unique_constraint("uq_likes_user_post", "likes", ["user_id", "post_id"])
+    if "ix_likes_post_id_id" not in {index["name"] for index in inspector.get_indexes("likes")}:
+        op.create_index("ix_likes_post_id_id", "likes", ["post_id", "id"])
+    op.execute("""
+        UPDATE posts SET like_count = (SELECT count(*) FROM likes WHERE likes.post_id = posts.id)
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_likes_post_id_id", table_name="likes")
+    op.drop_constraint("uq_likes_user_post", "likes", type_="unique")
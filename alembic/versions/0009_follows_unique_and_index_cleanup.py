@@ -0,0 +1,62 @@
+"""one follow per pair, foreign key indexes, drop b-tree indexes on free text
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+
+Removes duplicate follows and adds the (follower_id, following_id) unique
+constraint used by INSERT ... ON CONFLICT DO NOTHING, plus the reverse
+(following_id, follower_id) index for follower lists. Indexes the foreign keys
+the comment tree and author lookups filter on, and drops the single column
+indexes on password hashes and free text (users.password, posts.content,
+comments.content, chat_messages.message) that were never used by a query but
+were written on every insert. Recounts the follower counters afterwards.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0009"
+down_revision: Union[str, Sequence[str], None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TEXT_INDEXES = {
+    "ix_users_password": ("users", "password"),
+    "ix_posts_content": ("posts", "content"),
+    "ix_comments_content": ("comments", "content"),
+    "ix_chat_messages_message": ("chat_messages", "message"),
+}
+
+
+def upgrade() -> None:
+    op.execute("""
+        DELETE FROM follows a USING follows b
+        WHERE a.follower_id = b.follower_id AND a.following_id = b.following_id AND a.id > b.id
+    """)
+    # a database built by create_all already has it
+    inspector = sa.inspect(op.get_bind())
+    if "uq_follows_follower_following" not in {constraint["name"] for constraint in inspector.get_unique_constraints("follows")}:
+        op.create_unique_constraint("uq_follows_follower_following", "follows", ["follower_id", "following_id"])
+    op.execute("CREATE INDEX IF NOT EXISTS ix_follows_following_id_follower_id ON follows (following_id, follower_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_comments_post_id_parent_comment_id_id ON comments (post_id, parent_comment_id, id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_comments_parent_comment_id ON comments (parent_comment_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_posts_author_id ON posts (author_id)")
+    for name in TEXT_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.execute("""
+        UPDATE users SET
+            follower_count = (SELECT count(*) FROM follows WHERE follows.following_id = users.id),
+            following_count = (SELECT count(*) FROM follows WHERE follows.follower_id = users.id)
+    """)
+
+
+def downgrade() -> None:
+    for name, (table, column) in TEXT_INDEXES.items():
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})")
+    op.execute("DROP INDEX IF EXISTS ix_posts_author_id")
+    op.execute("DROP INDEX IF EXISTS ix_comments_parent_comment_id")
+    op.execute("DROP INDEX IF EXISTS ix_comments_post_id_parent_comment_id_id")
+    op.execute("DROP INDEX IF EXISTS ix_follows_following_id_follower_id")
+    op.drop_constraint("uq_follows_follower_following", "follows", type_="unique")
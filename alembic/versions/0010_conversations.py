@@ -0,0 +1,99 @@
+"""conversations index for chat
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+
+Adds conversations (one per user pair) and conversation_members (each
+participant's inbox row with last_message_at and unread_count), links
+chat_messages to their conversation and indexes (conversation_id, timestamp,
+id) for keyset history. Existing messages are grouped into conversations and
+the last-message and unread columns are filled from them.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0010"
+down_revision: Union[str, Sequence[str], None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("conversations"):
+        op.create_table(
+            "conversations",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_low_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("user_high_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("last_message_id", sa.Integer()),
+            sa.Column("last_message_at", sa.DateTime()),
+            sa.Column("created_at", sa.DateTime()),
+            sa.UniqueConstraint("user_low_id", "user_high_id", name="uq_conversations_pair"),
+        )
+    if not inspector.has_table("conversation_members"):
+        op.create_table(
+            "conversation_members",
+            sa.Column("conversation_id", sa.Integer(), sa.ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("other_user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("last_message_at", sa.DateTime()),
+            sa.Column("unread_count", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("last_read_message_id", sa.Integer(), nullable=False, server_default="0"),
+        )
+        op.create_index(
+            "ix_conversation_members_user_id_last_message_at",
+            "conversation_members", ["user_id", "last_message_at", "conversation_id"]
+        )
+    columns = {column["name"] for column in inspector.get_columns("chat_messages")}
+    if "conversation_id" not in columns:
+        op.add_column(
+            "chat_messages",
+            sa.Column("conversation_id", sa.Integer(), sa.ForeignKey("conversations.id", ondelete="CASCADE"))
+        )
+
+    op.execute("""
+        INSERT INTO conversations (user_low_id, user_high_id, created_at)
+        SELECT least(sender_id, receiver_id), greatest(sender_id, receiver_id), min(timestamp)
+        FROM chat_messages
+        WHERE sender_id IS NOT NULL AND receiver_id IS NOT NULL AND sender_id <> receiver_id
+        GROUP BY 1, 2
+        ON CONFLICT ON CONSTRAINT uq_conversations_pair DO NOTHING
+    """)
+    op.execute("""
+        UPDATE chat_messages m SET conversation_id = c.id
+        FROM conversations c
+        WHERE m.conversation_id IS NULL
+          AND c.user_low_id = least(m.sender_id, m.receiver_id)
+          AND c.user_high_id = greatest(m.sender_id, m.receiver_id)
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_chat_messages_conversation_id_timestamp_id ON chat_messages (conversation_id, timestamp, id)")
+    op.execute("""
+        UPDATE conversations c SET last_message_id = last.id, last_message_at = last.timestamp
+        FROM (
+            SELECT DISTINCT ON (conversation_id) conversation_id, id, timestamp
+            FROM chat_messages
+            WHERE conversation_id IS NOT NULL
+            ORDER BY conversation_id, timestamp DESC, id DESC
+        ) last
+        WHERE last.conversation_id = c.id
+    """)
+    op.execute("""
+        INSERT INTO conversation_members (conversation_id, user_id, other_user_id, last_message_at, unread_count)
+        SELECT c.id, side.user_id, side.other_user_id, c.last_message_at,
+               (SELECT count(*) FROM chat_messages m
+                WHERE m.conversation_id = c.id AND m.receiver_id = side.user_id AND coalesce(m.is_read, 0) = 0)
+        FROM conversations c
+        CROSS JOIN LATERAL (VALUES (c.user_low_id, c.user_high_id), (c.user_high_id, c.user_low_id)) AS side(user_id, other_user_id)
+        ON CONFLICT DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_chat_messages_conversation_id_timestamp_id")
+    op.drop_column("chat_messages", "conversation_id")
+    op.drop_table("conversation_members")
+    op.drop_table("conversations")
@@ -0,0 +1,29 @@
+"""access token issued with each refresh token
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-18
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0012"
+down_revision: Union[str, Sequence[str], None] = "0011"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    columns = {column["name"] for column in inspector.get_columns("refresh_tokens")}
+    if "access_jti" not in columns:
+        op.add_column("refresh_tokens", sa.Column("access_jti", sa.String(32), nullable=True))
+    if "access_expires_at" not in columns:
+        op.add_column("refresh_tokens", sa.Column("access_expires_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("refresh_tokens", "access_expires_at")
+    op.drop_column("refresh_tokens", "access_jti")
@@ -0,0 +1,120 @@
+# Multi-process delivery harness for the chat bus.
+#
+#   python -m benchmarks.chat_delivery [--workers 4] [--users 200] [--sockets 3] [--messages 500]
+#       [--backend redis] [--redis-url redis://localhost:6379/0]
+#
+# Starts --workers processes, each standing in for a uvicorn worker with its
+# own ConnectionRegistry and bus. Every user gets --sockets fake sockets spread
+# round robin over the workers, so most users are connected to several
+# processes at once. Each worker then publishes --messages messages to random
+# users. Every socket reports what it received and the harness checks that
+# each message reached every socket of its receiver exactly once, then prints
+# delivery latency percentiles. The memory backend only routes within one
+# process, so it is limited to --workers 1.
+import argparse
+import asyncio
+import multiprocessing
+import random
+import time
+from collections import Counter
+
+from services.chat_bus import ConnectionRegistry, MemoryBus, RespBus
+
+
+class FakeSocket:
+    def __init__(self, socket_id, received):
+        self.socket_id = socket_id
+        self.received = received
+
+    async def send_json(self, payload):
+        self.received.append((self.socket_id, payload["id"], time.time() - payload["sent_at"]))
+
+
+def placement(users, sockets, workers):
+    # socket_id -> (worker, user)
+    placed = {}
+    for user in range(users):
+        for n in range(sockets):
+            placed[user * sockets + n] = ((user + n) % workers, user)
+    return placed
+
+
+async def run_worker(index, args, ready, go, results):
+    registry = ConnectionRegistry()
+    bus = MemoryBus(registry) if args.backend == "memory" else RespBus(registry, args.redis_url)
+    await bus.start()
+    received = []
+    for socket_id, (worker, user) in placement(args.users, args.sockets, args.workers).items():
+        if worker == index:
+            await bus.connect(user, FakeSocket(socket_id, received))
+    ready.wait()
+    go.wait()
+    rng = random.Random(index)
+    sent = []
+    for n in range(args.messages):
+        user = rng.randrange(args.users)
+        message_id = f"{index}:{n}"
+        sent.append((message_id, user))
+        await bus.publish(user, {"id": message_id, "sent_at": time.time()})
+    # let messages from the other workers drain
+    await asyncio.sleep(args.drain)
+    await bus.close()
+    results.put((sent, received))
+
+
+def worker_main(index, args, ready, go, results):
+    asyncio.run(run_worker(index, args, ready, go, results))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--sockets", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--drain", type=float, default=2.0)
+    parser.add_argument("--backend", choices=("memory", "redis"), default="redis")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    args = parser.parse_args()
+    if args.backend == "memory":
+        args.workers = 1
+
+    ready = multiprocessing.Barrier(args.workers + 1)
+    go = multiprocessing.Barrier(args.workers + 1)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker_main, args=(index, args, ready, go, results))
+        for index in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    ready.wait()
+    start = time.perf_counter()
+    go.wait()
+    sent, received = [], []
+    for _ in processes:
+        worker_sent, worker_received = results.get()
+        sent += worker_sent
+        received += worker_received
+    for process in processes:
+        process.join()
+
+    sockets_of = Counter(user for _, user in placement(args.users, args.sockets, args.workers).values())
+    expected = {message_id: sockets_of[user] for message_id, user in sent}
+    deliveries = Counter(message_id for _, message_id, _ in received)
+    per_socket = Counter((socket_id, message_id) for socket_id, message_id, _ in received)
+    missing = sum(max(expected[m] - deliveries.get(m, 0), 0) for m in expected)
+    duplicates = sum(count - 1 for count in per_socket.values() if count > 1)
+    latencies = sorted(latency for _, _, latency in received)
+    pick = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000 if latencies else 0.0
+
+    print(f"{args.workers} workers, {args.users} users x {args.sockets} sockets, {len(sent)} messages "
+          f"in {time.perf_counter() - start - args.drain:.2f} s")
+    print(f"expected deliveries {sum(expected.values())}, delivered {len(received)}, "
+          f"missing {missing}, duplicates {duplicates}")
+    print(f"latency p50 {pick(0.5):.2f} ms  p99 {pick(0.99):.2f} ms  max {pick(1.0):.2f} ms")
+    raise SystemExit(1 if missing or duplicates else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Chat write throughput of one worker, on the database configured in .env.
+#
+#   python -m benchmarks.chat_writer [--sockets 200] [--messages 20] [--sender 1 --receiver 2]
+#
+# Simulates --sockets concurrent WebSocket senders on one event loop, each
+# sending --messages messages, first with a commit per message (the previous
+# handler) and then through services.chat_writer. Prints messages/second and
+# ack latency for both, then deletes the rows it wrote.
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import delete, select
+
+from database import AsyncSessionLocal, dispose_engines
+from models import ChatMessages, Users
+from services.chat_writer import ChatWriter
+
+
+async def per_message(sender, receiver, text):
+    async with AsyncSessionLocal() as db:
+        message = ChatMessages(sender_id=sender, receiver_id=receiver, message=text)
+        db.add(message)
+        await db.commit()
+        return message.id
+
+
+async def drive(label, send, args, sender, receiver, marker):
+    latencies = []
+
+    async def socket(n):
+        for i in range(args.messages):
+            start = time.perf_counter()
+            await send(sender, receiver, f"{marker} {n}:{i}")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[socket(n) for n in range(args.sockets)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    total = args.sockets * args.messages
+    print(f"{label:12} {total / elapsed:9.0f} msg/s   ack p50 {latencies[len(latencies) // 2] * 1000:7.2f} ms"
+          f"   p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.2f} ms")
+
+
+async def main(args):
+    marker = f"bench-{uuid.uuid4().hex[:8]}"
+    async with AsyncSessionLocal() as db:
+        if args.sender is None or args.receiver is None:
+            ids = (await db.execute(select(Users.id).order_by(Users.id).limit(2))).scalars().all()
+            if len(ids) < 2:
+                raise SystemExit("need two users, or pass --sender and --receiver")
+            args.sender, args.receiver = ids
+    try:
+        await drive("per-message", per_message, args, args.sender, args.receiver, marker)
+        writer = ChatWriter(AsyncSessionLocal, max_count=args.batch, max_age=args.age, writers=args.writers)
+        writer.start()
+
+        async def batched(sender, receiver, text):
+            return (await writer.submit(sender, receiver, text))["id"]
+
+        await drive("batched", batched, args, args.sender, args.receiver, marker)
+        await writer.stop()
+        print(f"batches {writer.stats['batches']}, avg size {writer.stats['written'] / max(writer.stats['batches'], 1):.1f}")
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(ChatMessages).where(ChatMessages.message.startswith(marker)))
+            await db.commit()
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sockets", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--age", type=float, default=0.01)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--sender", type=int)
+    parser.add_argument("--receiver", type=int)
+    asyncio.run(main(parser.parse_args()))
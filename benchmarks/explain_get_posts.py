@@ -0,0 +1,77 @@
+# Compares the query plans of the old offset/count listing of GET /posts/
+# against the keyset version, on the database configured in .env.
+#
+#   python -m benchmarks.explain_get_posts [--tag Health] [--author bob] [--page 500]
+#
+# Prints EXPLAIN (ANALYZE, BUFFERS) for each query and a summary line with the
+# execution time and whether an index was used.
+import argparse
+import re
+
+from sqlalchemy import or_, func, tuple_, select, text
+
+from database import engine
+from models import Posts, Users
+from services.tags import tag_filter
+
+
+def listing(tag=None, author=None, legacy=False):
+    query = select(
+        Posts.id, Posts.title, Posts.tag, Posts.created_at,
+        func.substr(Posts.content, 1, 71).label("content"),
+        Users.id.label("author_id"), Users.username.label("author_username")
+    ).join(Users, Posts.author_id == Users.id)
+    if tag and legacy:
+        query = query.where(or_(*[Posts.tag.ilike(f"%{t}%") for t in tag.split(",")]))
+    elif tag:
+        query = query.where(tag_filter(Posts, tag))
+    if author:
+        query = query.where(Users.username.ilike(f"%{author}%"))
+    return query
+
+
+def explain(conn, label, statement):
+    sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    plan = "\n".join(row[0] for row in conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {sql}"))
+    execution = re.search(r"Execution Time: ([\d.]+) ms", plan)
+    uses_index = bool(re.search(r"Index (Only )?Scan|Bitmap Index Scan", plan))
+    print(f"=== {label}\n{plan}\n")
+    return label, float(execution.group(1)) if execution else None, uses_index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tag")
+    parser.add_argument("--author")
+    parser.add_argument("--page", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=20)
+    args = parser.parse_args()
+
+    legacy = listing(args.tag, args.author, legacy=True)
+    base = listing(args.tag, args.author)
+    offset = (args.page - 1) * args.page_size
+    with engine.connect() as conn:
+        # a cursor taken from the row just before the requested page
+        cursor_row = conn.execute(
+            base.order_by(Posts.created_at.desc(), Posts.id.desc()).offset(max(offset - 1, 0)).limit(1)
+        ).first()
+        results = [
+            explain(conn, "old count", select(func.count()).select_from(legacy.subquery())),
+            explain(conn, "old offset page", legacy.offset(offset).limit(args.page_size)),
+        ]
+        keyset = base.order_by(Posts.created_at.desc(), Posts.id.desc())
+        if cursor_row:
+            keyset = keyset.where(tuple_(Posts.created_at, Posts.id) < tuple_(cursor_row.created_at, cursor_row.id))
+        results.append(explain(conn, "keyset page", keyset.limit(args.page_size + 1)))
+        results.append(explain(
+            conn, "estimated total",
+            select(text("reltuples::bigint")).select_from(text("pg_class")).where(text("relname = 'posts'"))
+        ))
+
+    print(f"{'query':<40}{'ms':>10}  index")
+    for label, ms, uses_index in results:
+        print(f"{label:<40}{(f'{ms:.2f}' if ms is not None else '-'):>10}  {'yes' if uses_index else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Measures the effect of the follows/likes constraints and the dropped text
+# indexes from revision 0009, on the database configured in .env.
+#
+#   python -m benchmarks.follow_indexes [--users 2000] [--edges 50000] [--lookups 2000]
+#
+# Builds two temporary copies of the follows and chat_messages tables, one with
+# the old layout (surrogate id only, b-tree on the message text) and one with
+# the new (unique pair, reverse index, no text index), then times bulk inserts,
+# the mutual follower check used by chat and follower list lookups on both.
+import argparse
+import random
+import time
+
+from sqlalchemy import text
+
+from database import engine
+
+LAYOUTS = {
+    "before": [
+        "CREATE TEMP TABLE bench_follows (id serial PRIMARY KEY, follower_id int, following_id int)",
+        "CREATE TEMP TABLE bench_messages (id serial PRIMARY KEY, sender_id int, receiver_id int, message text)",
+        "CREATE INDEX ON bench_messages (message)",
+    ],
+    "after": [
+        "CREATE TEMP TABLE bench_follows (id serial PRIMARY KEY, follower_id int, following_id int,"
+        " CONSTRAINT bench_follows_pair UNIQUE (follower_id, following_id))",
+        "CREATE INDEX ON bench_follows (following_id, follower_id)",
+        "CREATE TEMP TABLE bench_messages (id serial PRIMARY KEY, sender_id int, receiver_id int, message text)",
+    ],
+}
+
+MUTUAL = text("""
+    SELECT count(*) FROM bench_follows
+    WHERE (follower_id = :a AND following_id = :b) OR (follower_id = :b AND following_id = :a)
+""")
+FOLLOWERS = text("SELECT follower_id FROM bench_follows WHERE following_id = :a")
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def run(layout, edges, messages, pairs, users):
+    with engine.connect() as conn:
+        for statement in LAYOUTS[layout]:
+            conn.exec_driver_sql(statement)
+        results = {
+            "insert follows": timed(conn.execute, text(
+                "INSERT INTO bench_follows (follower_id, following_id) VALUES (:a, :b)"), edges),
+            "insert messages": timed(conn.execute, text(
+                "INSERT INTO bench_messages (sender_id, receiver_id, message) VALUES (:a, :b, :m)"), messages),
+        }
+        conn.exec_driver_sql("ANALYZE bench_follows")
+        results["mutual check"] = timed(lambda: [conn.execute(MUTUAL, pair).scalar() for pair in pairs])
+        results["follower lists"] = timed(lambda: [conn.execute(FOLLOWERS, {"a": a}).all() for a in users])
+        conn.rollback()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--edges", type=int, default=50000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    pairs = set()
+    while len(pairs) < args.edges:
+        a, b = rng.randrange(args.users), rng.randrange(args.users)
+        if a != b:
+            pairs.add((a, b))
+    edges = [{"a": a, "b": b} for a, b in pairs]
+    messages = [{"a": e["a"], "b": e["b"], "m": f"message {i} " * rng.randint(1, 20)} for i, e in enumerate(edges[:args.lookups * 5])]
+    lookups = [{"a": rng.randrange(args.users), "b": rng.randrange(args.users)} for _ in range(args.lookups)]
+    followed = [rng.randrange(args.users) for _ in range(args.lookups)]
+
+    before = run("before", edges, messages, lookups, followed)
+    after = run("after", edges, messages, lookups, followed)
+    print(f"{'':18}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name in before:
+        print(f"{name:18}{before[name]:12.1f}{after[name]:12.1f}{before[name] / after[name]:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Login throughput and event loop stalls under concurrent logins, no database.
+#
+#   python -m benchmarks.login_throughput [--logins 200] [--concurrency 50] [--workers 4]
+#
+# Verifies --logins passwords with --concurrency of them in flight, once by
+# calling bcrypt inline in the coroutine (the previous authenticate_user) and
+# once through services.auth_services.PasswordHasher. A ticker coroutine runs
+# alongside and records how late each 10 ms tick fires: that lag is what every
+# other request on the worker waits for. Also shows the rehash-on-login path
+# by verifying a hash made with fewer rounds.
+import argparse
+import asyncio
+import time
+
+from passlib.context import CryptContext
+
+from services.auth_services import PasswordHasher, bcrypt_context, BCRYPT_ROUNDS
+
+
+async def ticker(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - start - 0.01)
+
+
+async def run(label, verify, args, password_hash):
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def login():
+        async with semaphore:
+            await verify("correct horse", password_hash)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[login() for _ in range(args.logins)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)] * 1000 if lags else 0.0
+    worst = lags[-1] * 1000 if lags else 0.0
+    print(f"{label:8} {args.logins / elapsed:7.1f} logins/s   loop lag p99 {p99:8.1f} ms   max {worst:8.1f} ms   ticks {len(lags)}")
+
+
+async def main(args):
+    password_hash = bcrypt_context.hash("correct horse")
+
+    async def inline(password, stored):
+        return bcrypt_context.verify_and_update(password, stored)
+
+    await run("inline", inline, args, password_hash)
+    hasher = PasswordHasher(workers=args.workers, max_pending=max(args.concurrency, 1))
+    await run("pool", hasher.verify_and_update, args, password_hash)
+    print(hasher.metrics())
+
+    weaker = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=max(BCRYPT_ROUNDS - 2, 4)).hash("correct horse")
+    verified, new_hash = await hasher.verify_and_update("correct horse", weaker)
+    print(f"rehash on login: verified={verified}, upgraded={new_hash is not None} "
+          f"({weaker[:7]} -> {new_hash[:7] if new_hash else '-'})")
+    hasher.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,137 @@
+# Middleware overhead: the previous BaseHTTPMiddleware rate limiter against the
+# pure ASGI stack (request id + timing + rate limit), no server or database.
+#
+#   python -m benchmarks.middleware_stack [--requests 20000] [--concurrency 100]
+#
+# Calls each Starlette app directly through ASGI with --concurrency requests in
+# flight, on a small JSON endpoint and on a 32-chunk streaming endpoint, and
+# prints requests/second with p50/p99 latency. For the stream, "first chunk"
+# is the p99 time until the first body chunk reached the server: the old
+# stack pumps the body through a memory stream, the new one passes it through.
+import argparse
+import asyncio
+import time
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from middlewares import rate_limit
+from middlewares.rate_limit import RateLimitMiddleware, client_identity, resolve_limit, rate_limit_headers
+from middlewares.rate_limit_backends import MemoryBackend
+from middlewares.request_id import RequestIdMiddleware
+from middlewares.timing import TimingMiddleware
+
+
+# the rate limiter as it was before, for comparison
+class LegacyRateLimitMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, backend=None):
+        super().__init__(app)
+        self.backend = backend
+
+    async def dispatch(self, request, call_next):
+        identity, payload = client_identity(request.scope)
+        route, (limit, window) = resolve_limit(request.url.path, payload)
+        result = await self.backend.hit(f"{identity}:{route}", limit, window)
+        headers = rate_limit_headers(result, window)
+        if not result.allowed:
+            return JSONResponse(status_code=429, content={"detail": "Rate limit exceeded"}, headers=headers)
+        response = await call_next(request)
+        response.headers.update(headers)
+        return response
+
+
+async def small_json(request):
+    return JSONResponse({"id": 1, "title": "hello", "tags": ["a", "b"]})
+
+
+async def stream(request):
+    async def chunks():
+        for _ in range(32):
+            await asyncio.sleep(0)
+            yield b"x" * 1024
+    return StreamingResponse(chunks(), media_type="application/octet-stream")
+
+
+def build(middleware):
+    return Starlette(routes=[Route("/json", small_json), Route("/stream", stream)], middleware=middleware)
+
+
+async def call(app, path, n):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench")], "client": (f"10.0.{n // 250 % 250}.{n % 250}", 5000), "server": ("bench", 80),
+    }
+    request_sent = False
+    disconnected = asyncio.Event()
+    first_chunk = None
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal first_chunk
+        if message["type"] == "http.response.body" and message.get("body") and first_chunk is None:
+            first_chunk = time.perf_counter()
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    end = time.perf_counter()
+    disconnected.set()
+    return end - start, (first_chunk or end) - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def run(label, app, path, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def one(n):
+        async with semaphore:
+            results.append(await call(app, path, n))
+
+    # warm up and build the middleware stack
+    await asyncio.gather(*[one(n) for n in range(100)])
+    results.clear()
+    start = time.perf_counter()
+    await asyncio.gather(*[one(n) for n in range(args.requests)])
+    elapsed = time.perf_counter() - start
+    latencies = [total for total, _ in results]
+    line = (f"{label:<8} {path:<8} {args.requests / elapsed:9.0f} req/s   "
+            f"p50 {percentile(latencies, 0.5) * 1000:7.2f} ms   p99 {percentile(latencies, 0.99) * 1000:7.2f} ms")
+    if path == "/stream":
+        line += f"   first chunk p99 {percentile([first for _, first in results], 0.99) * 1000:7.2f} ms"
+    print(line)
+
+
+async def main(args):
+    # measure the middleware, not the limiter rejecting the benchmark
+    rate_limit.RATE_LIMIT = 10 ** 9
+    legacy = build([Middleware(LegacyRateLimitMiddleware, backend=MemoryBackend())])
+    current = build([
+        Middleware(RequestIdMiddleware),
+        Middleware(TimingMiddleware, slow_request_seconds=0),
+        Middleware(RateLimitMiddleware, backend=MemoryBackend()),
+    ])
+    for path in ("/json", "/stream"):
+        await run("legacy", legacy, path, args)
+        await run("asgi", current, path, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,105 @@
+# Load test for the home timeline store, no database needed.
+#
+#   python -m benchmarks.timeline_load [--users 20000] [--posts 50000] [--reads 20000] [--backend memory|redis]
+#
+# Generates a follow graph with a power-law follower distribution, then
+# replays post creation and timeline reads three ways:
+#   pull    - merge the recent posts of every followee on each read (what a
+#             Follows x Posts join does)
+#   push    - fan out every post to every follower's timeline
+#   hybrid  - fan out except for authors above FEED_FANOUT_MAX_FOLLOWERS,
+#             whose posts are merged on read (services/timeline.py)
+# and reports write cost (timeline inserts, time) and read latency percentiles.
+import argparse
+import asyncio
+import heapq
+import random
+import statistics
+import time
+from collections import defaultdict
+from itertools import islice
+
+from services.feed_store import MemoryFeedStore, RespFeedStore
+
+
+def build_graph(rng, users, mean_follows):
+    # preferential attachment: popular users keep getting more followers
+    followers = defaultdict(set)
+    following = defaultdict(set)
+    targets = list(range(users))
+    for user in range(users):
+        for _ in range(max(1, int(rng.expovariate(1 / mean_follows)))):
+            other = rng.choice(targets)
+            if other != user and other not in following[user]:
+                following[user].add(other)
+                followers[other].add(user)
+                targets.append(other)
+    return followers, following
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(int(len(samples) * q), len(samples) - 1)] * 1000
+    return f"p50 {pick(0.5):.3f} ms  p99 {pick(0.99):.3f} ms  mean {statistics.fmean(samples) * 1000:.3f} ms"
+
+
+async def run(args):
+    rng = random.Random(7)
+    followers, following = build_graph(rng, args.users, args.mean_follows)
+    authors = [rng.choice(list(followers) or [0]) for _ in range(args.posts)]
+    readers = [rng.randrange(args.users) for _ in range(args.reads)]
+    print(f"{args.users} users, {sum(map(len, following.values()))} follows, "
+          f"max followers {max(map(len, followers.values()))}, {args.posts} posts")
+    if args.fanout_max is None:
+        counts = sorted(map(len, followers.values()))
+        args.fanout_max = counts[int(len(counts) * 0.99)]
+    print(f"hybrid fan-out limit: {args.fanout_max} followers\n")
+
+    def make_store():
+        if args.backend == "redis":
+            return RespFeedStore(args.redis_url, prefix=f"feedbench:{time.time_ns()}", max_len=args.max_len)
+        return MemoryFeedStore(max_len=args.max_len, max_users=args.users)
+
+    for mode in ("pull", "push", "hybrid"):
+        threshold = {"pull": -1, "push": float("inf"), "hybrid": args.fanout_max}[mode]
+        store = make_store()
+        by_author = defaultdict(list)
+        for user in range(args.users):
+            await store.replace(user, [])
+        inserts = 0
+        start = time.perf_counter()
+        for post_id, author in enumerate(authors, 1):
+            by_author[author].append(post_id)
+            if len(followers[author]) <= threshold:
+                await store.push(followers[author], post_id, author)
+                inserts += len(followers[author])
+        write_time = time.perf_counter() - start
+
+        latencies = []
+        for user in readers:
+            start = time.perf_counter()
+            entries = [post_id for post_id, _ in await store.read(user, None, args.page_size)]
+            pulled = [reversed(by_author[author]) for author in following[user] if len(followers[author]) > threshold]
+            page = list(islice(heapq.merge(entries, *pulled, reverse=True), args.page_size))
+            latencies.append(time.perf_counter() - start)
+        await store.close()
+        print(f"{mode:7} writes {inserts:>9} inserts in {write_time:7.2f} s   reads {percentiles(latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--mean-follows", type=float, default=30)
+    parser.add_argument("--posts", type=int, default=50000)
+    parser.add_argument("--reads", type=int, default=20000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--max-len", type=int, default=500)
+    # defaults to the 99th percentile of follower counts
+    parser.add_argument("--fanout-max", type=int)
+    parser.add_argument("--backend", choices=("memory", "redis"), default="memory")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,17 @@
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+import itertools
+import threading
+import time
 import urllib.parse
+import uuid
 import os 
 from dotenv import load_dotenv
+from services.metrics import instrument_engine
+from services.query_profiler import QUERY_PROFILER, profile_engine
 
 load_dotenv()
 
@@ -12,11 +21,178 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 encoded_password = urllib.parse.quote_plus(str(DATABASE_PASSWORD))
 
 
-POSTGRES_DATABASE_URL = (
+# DATABASE_URL overrides the Supabase settings, e.g. sqlite:///./blog.db for local runs
+POSTGRES_DATABASE_URL = os.getenv("DATABASE_URL") or (
      f"postgresql+psycopg2://{DATABASE_USERNAME}:{encoded_password}"
      f"{SUPABASE_URL}:5432/postgres"
 )
-engine = create_engine(POSTGRES_DATABASE_URL)
+# comma separated read replicas; read-only sessions fall back to the primary without them
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
 
+# pool and connection settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))        # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))        # Supabase drops idle connections
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 15000))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 10))
+# PgBouncer in transaction mode: no server-side prepared statement reuse and no
+# startup parameters, the statement timeout is set per transaction instead
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+# async drivers for the request path
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def async_database_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}")
+
+
+class PoolStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.engine = None
+        self._lock = threading.Lock()
+
+    def record(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def snapshot(self) -> dict:
+        # engine.pool rather than a saved pool, dispose() swaps it out
+        pool = self.engine.pool if self.engine is not None else None
+        return {
+            "name": self.name,
+            "size": pool.size() if pool else 0,
+            "checked_out": pool.checkedout() if pool else 0,
+            "checked_in": pool.checkedin() if pool else 0,
+            "overflow": pool.overflow() if pool else 0,
+            "checkouts": self.checkouts,
+            "checkout_timeouts": self.timeouts,
+            "checkout_wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "checkout_wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+POOL_STATS: dict[str, PoolStats] = {}
+
+
+class _TimedCheckout:
+    # times how long a checkout waits on the pool queue
+    stats: PoolStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+
+def _instrumented_pool(base, name: str):
+    stats = POOL_STATS.setdefault(name, PoolStats(name))
+    # stats live on the class so pool.recreate() keeps them
+    return type(f"Instrumented{base.__name__}", (_TimedCheckout, base), {"stats": stats})
+
+
+def create_db_engine(url: str, name: str = "primary", is_async: bool = True):
+    url = async_database_url(url) if is_async else make_url(url)
+    backend = url.get_backend_name()
+    if not is_async:
+        name = f"{name}_sync"
+    kwargs = {}
+    connect_args = {}
+    if backend == "postgresql":
+        kwargs.update(
+            poolclass=_instrumented_pool(AsyncAdaptedQueuePool if is_async else QueuePool, name),
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+        if is_async:
+            connect_args["timeout"] = DB_CONNECT_TIMEOUT
+            if DB_PGBOUNCER:
+                connect_args.update(
+                    statement_cache_size=0,
+                    prepared_statement_cache_size=0,
+                    prepared_statement_name_func=lambda: f"__asyncpg_{uuid.uuid4()}__",
+                )
+            else:
+                connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        else:
+            connect_args["connect_timeout"] = DB_CONNECT_TIMEOUT
+            if not DB_PGBOUNCER:
+                connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    engine = (create_async_engine if is_async else create_engine)(url, connect_args=connect_args, **kwargs)
+    sync_engine = engine.sync_engine if is_async else engine
+    if backend == "postgresql" and DB_PGBOUNCER:
+        @event.listens_for(sync_engine, "begin")
+        def set_statement_timeout(conn):
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+    instrument_engine(sync_engine, name)
+    if QUERY_PROFILER:
+        profile_engine(sync_engine)
+    if name in POOL_STATS:
+        POOL_STATS[name].engine = sync_engine
+    return engine
+
+
+# sync engine: create_all, alembic and command line scripts
+engine = create_db_engine(POSTGRES_DATABASE_URL, is_async=False)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+
+# async engine: everything that runs inside a request or websocket
+async_engine = create_db_engine(POSTGRES_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# read replicas, used round robin by read-only sessions
+replica_engines = [create_db_engine(url, name=f"replica_{i}") for i, url in enumerate(DATABASE_REPLICA_URLS)]
+ReplicaSessionLocals = [
+    async_sessionmaker(replica, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    for replica in replica_engines
+]
+_replica_cycle = itertools.cycle(ReplicaSessionLocals or [AsyncSessionLocal])
+
+Base = declarative_base()
+
+
+# shared FastAPI dependency
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def read_session() -> AsyncSession:
+    # next replica in the rotation, or the primary without replicas
+    return next(_replica_cycle)()
+
+
+# for handlers that only read (feed, comments, likes, chat history); may lag
+# the primary by the replication delay
+async def get_read_db():
+    async with read_session() as db:
+        yield db
+
+
+def pool_stats() -> list[dict]:
+    return [stats.snapshot() for stats in POOL_STATS.values()]
+
+
+async def dispose_engines():
+    await async_engine.dispose()
+    for replica in replica_engines:
+        await replica.dispose()
@@ -1,11 +1,49 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 import models
-from database import engine
-from routers import users,posts,comments,likes, follows, chat
+from database import engine, dispose_engines, pool_stats
+from routers import users,posts,comments,likes, follows, chat, images, tags, search, feed, debug
 from fastapi.middleware.cors import CORSMiddleware
-from middlewares.rate_limit import RateLimitMiddleware
+from middlewares.rate_limit import RateLimitMiddleware, rate_limit_backend
+from middlewares.request_id import RequestIdMiddleware
+from middlewares.timing import TimingMiddleware
+from middlewares.metrics import MetricsMiddleware
+from middlewares.query_profiler import QueryProfilerMiddleware
+from middlewares.logger import log_shipper
+from services.images import shutdown_executor, stats as image_stats
+from services.timeline import feed_store, stats as timeline_stats
+from services.response_cache import response_cache
+from services.chat_bus import chat_bus, connections
+from services.chat_writer import chat_writer
+from services.auth_services import password_hasher, revocation_list, token_cache
+from services.metrics import registry, exporter
+from services.query_profiler import QUERY_PROFILER
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_shipper.start()
+    await chat_bus.start()
+    chat_writer.start()
+    revocation_list.start()
+    exporter.start()
+    yield
+    await exporter.stop()
+    await revocation_list.stop()
+    await chat_writer.stop()
+    await chat_bus.close()
+    # flush whatever is still queued before the worker exits
+    await log_shipper.stop()
+    shutdown_executor()
+    password_hasher.shutdown()
+    await feed_store.close()
+    await response_cache.close()
+    await rate_limit_backend.close()
+    await dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
 models.Base.metadata.create_all(bind=engine)
 # models.Base.metadata.drop_all(bind=engine)  # Drops all tables
 app.add_middleware(
@@ -16,11 +54,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# added last runs first: every response, 429s included, is timed and
+# carries a request id
 app.add_middleware(RateLimitMiddleware)
+app.add_middleware(TimingMiddleware)
+if QUERY_PROFILER:
+    app.add_middleware(QueryProfilerMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
 
 app.include_router(users.router)
 app.include_router(posts.router)
 app.include_router(comments.router)
 app.include_router(likes.router)
 app.include_router(follows.router)
-app.include_router(chat.router)
\ No newline at end of file
+app.include_router(chat.router)
+app.include_router(images.router)
+app.include_router(tags.router)
+app.include_router(search.router)
+app.include_router(feed.router)
+if QUERY_PROFILER:
+    app.include_router(debug.router)
+
+
+# connection pool usage and checkout waits per engine
+@app.get("/health/db", tags=["health"])
+def database_pool_health():
+    return {"pools": pool_stats()}
+
+
+# response cache hits, misses, stale serves and coalesced misses per endpoint
+@app.get("/health/cache", tags=["health"])
+def response_cache_health():
+    return response_cache.metrics()
+
+
+# password hashing pool (queue depth, waits, rejected logins) and token cache hits
+@app.get("/health/auth", tags=["health"])
+def password_pool_health():
+    return {
+        **password_hasher.metrics(),
+        "token_cache": {"hits": token_cache.hits, "misses": token_cache.misses},
+    }
+
+
+# the stats behind the /health endpoints, read at scrape time
+@registry.collector
+def service_metrics():
+    for pool in pool_stats():
+        labels = {"pool": pool["name"]}
+        yield "db_pool_checked_out", "gauge", "Connections checked out of the pool", labels, pool["checked_out"]
+        yield "db_pool_overflow", "gauge", "Overflow connections open", labels, pool["overflow"]
+        yield "db_pool_checkouts_total", "counter", "Pool checkouts", labels, pool["checkouts"]
+        yield "db_pool_checkout_timeouts_total", "counter", "Pool checkouts that timed out", labels, pool["checkout_timeouts"]
+    for name, stats in response_cache.stats.items():
+        for outcome in ("hits", "stale", "misses", "coalesced", "errors"):
+            yield "response_cache_lookups_total", "counter", "Response cache lookups by endpoint and outcome", {"endpoint": name, "outcome": outcome}, stats.get(outcome, 0)
+    yield "feed_store_errors_total", "counter", "Feed store failures served from the database or skipped", {}, timeline_stats["store_errors"]
+    for outcome in ("rendered", "undecodable", "failed"):
+        yield "image_variant_jobs_total", "counter", "Image variant renders by outcome", {"outcome": outcome}, image_stats[outcome]
+    passwords = password_hasher.metrics()
+    yield "password_hash_pending", "gauge", "Password hashes running or queued", {}, passwords["pending"]
+    for outcome in ("completed", "rejected", "rehashed"):
+        yield "password_hashes_total", "counter", "Password hash operations by outcome", {"outcome": outcome}, passwords[outcome]
+    yield "token_cache_lookups_total", "counter", "Access token cache lookups", {"outcome": "hit"}, token_cache.hits
+    yield "token_cache_lookups_total", "counter", "Access token cache lookups", {"outcome": "miss"}, token_cache.misses
+    yield "chat_sockets_connected", "gauge", "Chat WebSockets registered with the bus", {}, connections.count()
+    for outcome in ("delivered", "dropped", "publish_errors"):
+        yield "chat_bus_messages_total", "counter", "Chat bus deliveries by outcome", {"outcome": outcome}, chat_bus.stats[outcome]
+    yield "chat_writer_queue_depth", "gauge", "Chat messages waiting to be written", {}, chat_writer.queue.qsize()
+    for outcome in ("written", "failed"):
+        yield "chat_messages_written_total", "counter", "Chat messages persisted by outcome", {"outcome": outcome}, chat_writer.stats[outcome]
+    for outcome in ("sent", "dropped", "failed"):
+        yield "log_events_total", "counter", "Log events shipped by outcome", {"outcome": outcome}, log_shipper.stats[outcome]
+
+
+# Prometheus text format, summed over every worker of this host
+@app.get("/metrics", tags=["health"], response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(await exporter.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,53 +1,204 @@
-import boto3
+import asyncio
 import json
-from datetime import datetime
+import os
+import time
+from datetime import datetime, timezone
+
+from .request_id import current_request_id
 
 AWS_REGION = "us-east-1"
 LOG_GROUP = "FastAPI-App-Logs"
 LOG_STREAM = "RateLimitEvents"
 
-logs_client = boto3.client(
-    "logs",
-    region_name=AWS_REGION
-)
+LOG_SINK = os.getenv("LOG_SINK", "cloudwatch")  # cloudwatch | file | memory
+LOG_FILE = os.getenv("LOG_FILE", "app_events.log")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# CloudWatch limits a put_log_events call to 10,000 events / 1 MiB
+MAX_BATCH_COUNT = int(os.getenv("LOG_BATCH_COUNT", 500))
+MAX_BATCH_BYTES = int(os.getenv("LOG_BATCH_BYTES", 1_048_576))
+MAX_BATCH_AGE = float(os.getenv("LOG_BATCH_AGE", 2.0))
+EVENT_OVERHEAD_BYTES = 26
 
-sequence_token = None
 
-def send_log(message: dict):
-    global sequence_token
-
-    timestamp = int(datetime.utcnow().timestamp() * 1000)
-
-    log_event = {
-        "timestamp": timestamp,
-        "message": json.dumps(message)
-    }
-
-    try:
-        if sequence_token:
-            response = logs_client.put_log_events(
-                logGroupName=LOG_GROUP,
-                logStreamName=LOG_STREAM,
-                logEvents=[log_event],
-                sequenceToken=sequence_token
-            )
-        else:
+class CloudWatchSink:
+    def __init__(self, log_group: str = LOG_GROUP, log_stream: str = LOG_STREAM, region: str = AWS_REGION):
+        import boto3
+
+        self.client = boto3.client("logs", region_name=region)
+        self.log_group = log_group
+        self.log_stream = log_stream
+        self.sequence_token = None
+        self._stream_ready = False
+
+    def _ensure_stream(self):
+        if self._stream_ready:
+            return
+        try:
+            self.client.create_log_stream(logGroupName=self.log_group, logStreamName=self.log_stream)
+        except self.client.exceptions.ResourceAlreadyExistsException:
+            pass
+        self._stream_ready = True
+
+    def send(self, events: list[dict]):
+        self._ensure_stream()
+        for _ in range(2):
+            kwargs = {
+                "logGroupName": self.log_group,
+                "logStreamName": self.log_stream,
+                "logEvents": events,
+            }
+            if self.sequence_token:
+                kwargs["sequenceToken"] = self.sequence_token
+            try:
+                response = self.client.put_log_events(**kwargs)
+                self.sequence_token = response.get("nextSequenceToken")
+                return
+            except (self.client.exceptions.InvalidSequenceTokenException,
+                    self.client.exceptions.DataAlreadyAcceptedException) as e:
+                self.sequence_token = e.response.get("expectedSequenceToken")
+                if isinstance(e, self.client.exceptions.DataAlreadyAcceptedException):
+                    return
+        # still rejected with the expected token: let the shipper count the
+        # batch as failed instead of sent
+        raise RuntimeError(f"put_log_events rejected the batch for {self.log_stream} after retrying")
+
+
+class FileSink:
+    def __init__(self, path: str = LOG_FILE):
+        self.path = path
+
+    def send(self, events: list[dict]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(event["message"] + "\n")
+
+
+# keeps every batch in memory, for tests
+class MemorySink:
+    def __init__(self):
+        self.batches: list[list[dict]] = []
+
+    def send(self, events: list[dict]):
+        self.batches.append(list(events))
+
+    @property
+    def events(self):
+        return [event for batch in self.batches for event in batch]
+
+
+def create_sink(name: str):
+    if name == "cloudwatch":
+        return CloudWatchSink()
+    if name == "file":
+        return FileSink()
+    if name == "memory":
+        return MemorySink()
+    raise ValueError(f"Unknown log sink: {name}")
+
+
+# Ships log events in the background. The hot path only does a put_nowait on a
+# bounded queue; a single task batches events by count, bytes and age and hands
+# each batch to the sink in a worker thread so the event loop never blocks.
+class LogShipper:
+    def __init__(self, sink=None, queue_size: int = LOG_QUEUE_SIZE, max_count: int = MAX_BATCH_COUNT,
+                 max_bytes: int = MAX_BATCH_BYTES, max_age: float = MAX_BATCH_AGE):
+        self._sink = sink
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._task = None
+        self._pending: list[dict] = []
+        self.stats = {"enqueued": 0, "dropped": 0, "sent": 0, "failed": 0, "batches": 0}
+
+    @property
+    def sink(self):
+        if self._sink is None:
+            self._sink = create_sink(LOG_SINK)
+        return self._sink
+
+    def enqueue(self, message: dict):
+        event = {
+            "timestamp": int(time.time() * 1000),
+            "message": json.dumps(message, default=str)
+        }
+        try:
+            self.queue.put_nowait(event)
+            self.stats["enqueued"] += 1
+        except asyncio.QueueFull:
+            # backpressure: drop rather than slow down the request
+            self.stats["dropped"] += 1
+
+    async def _next_batch(self):
+        # events being assembled live in self._pending so stop() can still flush them
+        self._pending = [await self.queue.get()]
+        size = len(self._pending[0]["message"].encode()) + EVENT_OVERHEAD_BYTES
+        deadline = time.monotonic() + self.max_age
+        while len(self._pending) < self.max_count:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            event_size = len(event["message"].encode()) + EVENT_OVERHEAD_BYTES
+            if size + event_size > self.max_bytes:
+                # byte limit reached, the new event starts the next batch
+                batch, self._pending = self._pending, []
+                await self._ship(batch)
+                size = 0
+                deadline = time.monotonic() + self.max_age
+            self._pending.append(event)
+            size += event_size
+        batch, self._pending = self._pending, []
+        return batch
+
+    async def _ship(self, batch):
+        if not batch:
+            return
+        try:
+            await asyncio.to_thread(self.sink.send, batch)
+            self.stats["sent"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception:
+            self.stats["failed"] += len(batch)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._ship(batch)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def flush(self):
+        batch, self._pending = self._pending, []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+            if len(batch) >= self.max_count:
+                await self._ship(batch)
+                batch = []
+        await self._ship(batch)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
             try:
-                logs_client.create_log_stream(
-                    logGroupName=LOG_GROUP,
-                    logStreamName=LOG_STREAM
-                )
-            except logs_client.exceptions.ResourceAlreadyExistsException:
+                await self._task
+            except asyncio.CancelledError:
                 pass
+            self._task = None
+        await self.flush()
+
 
-            response = logs_client.put_log_events(
-                logGroupName=LOG_GROUP,
-                logStreamName=LOG_STREAM,
-                logEvents=[log_event]
-            )
+log_shipper = LogShipper()
 
-        sequence_token = response["nextSequenceToken"]
 
-    except logs_client.exceptions.InvalidSequenceTokenException as e:
-        sequence_token = e.response["expectedSequenceToken"]
-        send_log(message)
+def send_log(message: dict):
+    message.setdefault("logged_at", datetime.now(timezone.utc).isoformat())
+    request_id = current_request_id()
+    if request_id is not None:
+        message.setdefault("request_id", request_id)
+    log_shipper.enqueue(message)
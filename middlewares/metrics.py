@@ -0,0 +1,65 @@
+import time
+
+from services.metrics import (
+    RequestStats, request_stats, http_requests, http_request_duration, http_in_flight,
+    http_request_queries, http_request_query_seconds, websocket_sessions, websocket_open
+)
+
+
+def route_labels(scope) -> tuple[str, str]:
+    # (router, route template) once routing has run: "/posts/{post_id}" is one
+    # series however many posts there are
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if not path:
+        return "unmatched", "unmatched"
+    return path.strip("/").split("/")[0] or "root", path
+
+
+# Per-route request counts, latency and queries per request. The time covers
+# the whole response, streamed bodies included. Sits outside the rate
+# limiter so rejected requests are counted too (as route "unmatched").
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            await self._websocket(scope, receive, send)
+            return
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status_code = 500
+        http_in_flight.inc()
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_in_flight.dec()
+            request_stats.reset(token)
+            router, route = route_labels(scope)
+            http_requests.inc(router, scope["method"], route, str(status_code))
+            http_request_duration.observe(elapsed, router, scope["method"], route)
+            http_request_queries.observe(stats.queries, router, route)
+            http_request_query_seconds.inc(router, route, amount=stats.query_seconds)
+
+    async def _websocket(self, scope, receive, send):
+        # the route is only known once the app has matched it, so the open
+        # gauge is not split by route (the raw path carries user ids)
+        websocket_open.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            websocket_open.dec()
+            websocket_sessions.inc(route_labels(scope)[1])
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+
+from starlette.datastructures import MutableHeaders
+
+from .logger import send_log
+from .metrics import route_labels
+from services.query_profiler import QueryProfile, current_profile, recent_profiles
+
+
+# Development only (QUERY_PROFILER=true). Records every statement a request
+# runs, adds X-Query-Count, X-Query-Time-Ms and X-Query-Repeated to the
+# response and logs fingerprints repeated QUERY_REPEAT_THRESHOLD times or more.
+# The full profile is kept under the request id for /debug/queries; it also
+# covers queries made after the headers went out (streaming, background tasks).
+class QueryProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = QueryProfile(f"{scope['method']} {scope['path']}")
+        token = current_profile.set(profile)
+
+        async def send_with_counts(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                headers = MutableHeaders(scope=message)
+                headers["X-Query-Count"] = str(profile.count)
+                headers["X-Query-Time-Ms"] = f"{profile.seconds * 1000:.1f}"
+                headers["X-Query-Repeated"] = str(len(profile.repeated()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_counts)
+        finally:
+            current_profile.reset(token)
+            request_id = scope.get("state", {}).get("request_id")
+            if request_id:
+                recent_profiles.add(request_id, profile)
+            repeated = profile.repeated()
+            if repeated:
+                send_log({
+                    "event": "REPEATED_QUERIES",
+                    "route": route_labels(scope)[1],
+                    "path": scope["path"],
+                    "method": scope["method"],
+                    "queries": profile.count,
+                    "repeated": repeated,
+                    "timestamp": str(datetime.now(timezone.utc))
+                })
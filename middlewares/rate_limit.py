@@ -1,32 +1,110 @@
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from datetime import datetime, timedelta, timezone
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+from datetime import datetime, timezone
+import asyncio
+import math
 from .logger import send_log
+from .rate_limit_backends import create_backend
+from .settings import (
+    RATE_LIMIT, WINDOW_SECONDS, RATE_LIMIT_BACKEND, RATE_LIMIT_EXEMPT, ROUTE_LIMITS, ROLE_LIMITS, USER_LIMITS
+)
+from services import auth_services
+from services.resp_client import RespError
+from services.metrics import rate_limit_decisions
 
-RATE_LIMIT = 100
-WINDOW_SECONDS= 60 
 
-request_log = {}
+def client_identity(scope):
+    # authenticated callers are limited per user, everyone else per ip
+    for key, value in scope["headers"]:
+        if key == b"authorization":
+            authorization = value.decode("latin-1")
+            if authorization.lower().startswith("bearer "):
+                claims = auth_services.verify_token(authorization[7:])
+                if claims is not None:
+                    return f"user:{claims['id']}", claims
+            break
+    client = scope.get("client")
+    ip = client[0] if client else "unknown"
+    return f"ip:{ip}", None
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self,request:Request,call_next):
-        ip = request.client.host
-        now = datetime.now(timezone.utc)
 
-        if ip not in request_log:
-            request_log[ip] = []
-        
-        request_log[ip] = [timestamp for timestamp in request_log[ip] if now - timestamp < timedelta(seconds=WINDOW_SECONDS)]   
-        if len(request_log[ip]) >= RATE_LIMIT:
+def resolve_limit(path: str, payload: dict | None):
+    route = None
+    for prefix in ROUTE_LIMITS:
+        if path.startswith(prefix) and (route is None or len(prefix) > len(route)):
+            route = prefix
+    if route is not None:
+        return route, ROUTE_LIMITS[route]
+    if payload:
+        if payload["id"] in USER_LIMITS:
+            return "*", USER_LIMITS[payload["id"]]
+        if payload.get("role") in ROLE_LIMITS:
+            return "*", ROLE_LIMITS[payload["role"]]
+    return "*", (RATE_LIMIT, WINDOW_SECONDS)
+
+
+def rate_limit_headers(result, window: int):
+    headers = {
+        "RateLimit-Limit": str(result.limit),
+        "RateLimit-Remaining": str(result.remaining),
+        "RateLimit-Reset": str(math.ceil(result.reset_after)),
+        "RateLimit-Policy": f"{result.limit};w={window}",
+    }
+    if not result.allowed:
+        headers["Retry-After"] = str(math.ceil(result.retry_after))
+    return headers
+
+
+# Plain ASGI rather than BaseHTTPMiddleware: the request goes straight to the
+# app with the original receive/send, so there are no extra tasks or memory
+# streams per request and streaming responses are not buffered.
+class RateLimitMiddleware:
+    def __init__(self, app, backend=None, exempt: tuple[str, ...] = RATE_LIMIT_EXEMPT):
+        self.app = app
+        self.backend = backend or rate_limit_backend
+        self.exempt = exempt
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.exempt and scope["path"].startswith(self.exempt)):
+            await self.app(scope, receive, send)
+            return
+        identity, payload = client_identity(scope)
+        route, (limit, window) = resolve_limit(scope["path"], payload)
+        try:
+            result = await self.backend.hit(f"{identity}:{route}", limit, window)
+        except (ConnectionError, OSError, RespError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            # a shared backend that is down, slow or erroring must not take the API with it
+            rate_limit_decisions.inc(route, "error")
+            await self.app(scope, receive, send)
+            return
+        headers = rate_limit_headers(result, window)
+
+        if not result.allowed:
+            rate_limit_decisions.inc(route, "blocked")
             send_log({
                 "event": "RATE_LIMIT_BLOCKED",
-                "ip": ip,
-                "path": request.url.path,
-                "method": request.method,
-                "timestamp": str(now)
+                "client": identity,
+                "path": scope["path"],
+                "method": scope["method"],
+                "timestamp": str(datetime.now(timezone.utc))
             })
-            raise HTTPException(status_code=429, detail="Rate limit exceeded")
-        request_log[ip].append(now)
-        response = await call_next(request)
-        return response
+            response = JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={"detail": "Rate limit exceeded"},
+                headers=headers
+            )
+            await response(scope, receive, send)
+            return
+        rate_limit_decisions.inc(route, "allowed")
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                MutableHeaders(scope=message).update(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
 
+rate_limit_backend = create_backend(RATE_LIMIT_BACKEND)
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+from services.resp_client import RespClient
+
+try:
+    import fcntl
+except ImportError:
+    # not on POSIX; only SharedMemoryBackend needs it
+    fcntl = None
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float   # seconds until the bucket is full again
+    retry_after: float   # seconds until the next request is allowed (0 if allowed)
+
+
+def gcra(tat: float, now: float, limit: int, window: float):
+    # Generic cell rate algorithm: one float of state per key.
+    # Returns (new_tat, result); new_tat is None when the request is rejected.
+    interval = window / limit
+    tat = max(tat, now)
+    new_tat = tat + interval
+    allow_at = new_tat - window
+    if now < allow_at:
+        return None, RateLimitResult(False, limit, 0, tat - now, allow_at - now)
+    remaining = int(math.floor((window - (new_tat - now)) / interval + 1e-9))
+    return new_tat, RateLimitResult(True, limit, max(remaining, 0), new_tat - now, 0.0)
+
+
+class RateLimiterBackend:
+    # every backend takes a key plus the (limit, window) that applies to it
+    async def hit(self, key: str, limit: int, window: int) -> RateLimitResult:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+# In-process GCRA with a bounded LRU of keys, O(1) per request.
+class MemoryBackend(RateLimiterBackend):
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._tats: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def hit(self, key, limit, window):
+        now = time.monotonic()
+        with self._lock:
+            new_tat, result = gcra(self._tats.get(key, now), now, limit, window)
+            if new_tat is not None:
+                self._tats[key] = new_tat
+            if key in self._tats:
+                self._tats.move_to_end(key)
+            while len(self._tats) > self.max_keys:
+                # least recently seen keys are the ones closest to being full again
+                self._tats.popitem(last=False)
+        return result
+
+
+# GCRA state in a fixed-size shared memory table so every worker on the host
+# enforces one limit. Slots are (key hash, tat) pairs with short linear probing;
+# when a probe run is full the slot with the oldest tat is evicted.
+class SharedMemoryBackend(RateLimiterBackend):
+    SLOT = struct.Struct("<Qd")
+    PROBES = 8
+
+    def __init__(self, name: str = "blogsite_rate_limit", slots: int = 65536):
+        if fcntl is None:
+            raise RuntimeError("the shared rate limit backend needs fcntl, use memory or redis on this platform")
+        self.slots = slots
+        size = self.SLOT.size * slots
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._shm.buf[:size] = bytes(size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._lock_file = open(os.path.join("/tmp", f"{name}.lock"), "a+")
+
+    def _key_hash(self, key: str) -> int:
+        value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+        return value or 1
+
+    async def _acquire(self):
+        # the lock is only held for one table update, so rather than blocking
+        # the event loop in flock, yield to other tasks until it is free. No
+        # task of this process can hold it here: update never awaits
+        attempt = 0
+        while True:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                await asyncio.sleep(0 if attempt < 10 else 0.001)
+                attempt += 1
+
+    def _update(self, key_hash: int, now: float, limit: int, window: int) -> RateLimitResult:
+        buf = self._shm.buf
+        start = key_hash % self.slots
+        target, tat = None, now
+        oldest_index, oldest_tat = None, None
+        for probe in range(self.PROBES):
+            index = (start + probe) % self.slots
+            slot_hash, slot_tat = self.SLOT.unpack_from(buf, index * self.SLOT.size)
+            if slot_hash == key_hash:
+                target, tat = index, slot_tat
+                break
+            if slot_hash == 0 or slot_tat <= now:
+                # empty, or expired and safe to reuse
+                if target is None:
+                    target = index
+                continue
+            if oldest_tat is None or slot_tat < oldest_tat:
+                oldest_index, oldest_tat = index, slot_tat
+        if target is None:
+            target = oldest_index
+        new_tat, result = gcra(tat, now, limit, window)
+        if new_tat is not None:
+            self.SLOT.pack_into(buf, target * self.SLOT.size, key_hash, new_tat)
+        return result
+
+    async def hit(self, key, limit, window):
+        key_hash = self._key_hash(key)
+        await self._acquire()
+        try:
+            return self._update(key_hash, time.time(), limit, window)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    async def close(self):
+        self._shm.close()
+        self._lock_file.close()
+
+
+# Sliding-window counter over a Redis-protocol server. Uses only INCR, PEXPIRE
+# and GET so that Redis, KeyDB, Dragonfly or a local stand-in can all serve it.
+class RedisBackend(RateLimiterBackend):
+    def __init__(self, url: str, prefix: str = "ratelimit"):
+        self.client = RespClient(url)
+        self.prefix = prefix
+
+    async def hit(self, key, limit, window):
+        now = time.time()
+        current = int(now // window)
+        elapsed = (now % window) / window
+        current_key = f"{self.prefix}:{key}:{current}"
+        previous_key = f"{self.prefix}:{key}:{current - 1}"
+        count, _, previous = await self.client.pipeline(
+            ("INCR", current_key),
+            ("PEXPIRE", current_key, int(window * 2000)),
+            ("GET", previous_key),
+        )
+        previous = int(previous or 0)
+        weighted = previous * (1 - elapsed) + count
+        reset_after = window * (1 - elapsed)
+        if weighted > limit:
+            # the window slides forward until the previous bucket has decayed enough
+            if previous:
+                retry_after = max(((weighted - limit) / previous) * window, 0.0)
+                retry_after = min(retry_after, reset_after)
+            else:
+                retry_after = reset_after
+            return RateLimitResult(False, limit, 0, reset_after, retry_after)
+        return RateLimitResult(True, limit, int(limit - weighted), reset_after, 0.0)
+
+    async def close(self):
+        await self.client.close()
+
+
+def create_backend(name: str) -> RateLimiterBackend:
+    name = (name or "memory").lower()
+    if name == "memory":
+        return MemoryBackend(int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000)))
+    if name == "shared":
+        return SharedMemoryBackend(
+            os.getenv("RATE_LIMIT_SHM_NAME", "blogsite_rate_limit"),
+            int(os.getenv("RATE_LIMIT_SHM_SLOTS", 65536))
+        )
+    if name == "redis":
+        return RedisBackend(os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown rate limit backend: {name}")
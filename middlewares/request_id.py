@@ -0,0 +1,56 @@
+import contextvars
+import uuid
+
+from starlette.datastructures import MutableHeaders
+
+from .settings import REQUEST_ID_HEADER, TRUST_REQUEST_ID, REQUEST_ID_MAX_LENGTH
+
+# id of the request being handled, for logs written anywhere below the middleware
+request_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+
+
+def current_request_id() -> str | None:
+    return request_id_var.get()
+
+
+def _valid(value: str) -> bool:
+    return 0 < len(value) <= REQUEST_ID_MAX_LENGTH and value.isascii() and value.isprintable()
+
+
+# Gives every HTTP request and websocket an id: the incoming header when
+# trusted and sane, a new uuid otherwise. It is echoed on the response, kept in
+# request.state.request_id and in request_id_var.
+class RequestIdMiddleware:
+    def __init__(self, app, header: str = REQUEST_ID_HEADER, trust_incoming: bool = TRUST_REQUEST_ID):
+        self.app = app
+        self.header = header
+        self.header_key = header.lower().encode("latin-1")
+        self.trust_incoming = trust_incoming
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        if self.trust_incoming:
+            for key, value in scope["headers"]:
+                if key == self.header_key:
+                    candidate = value.decode("latin-1")
+                    if _valid(candidate):
+                        request_id = candidate
+                    break
+        if request_id is None:
+            request_id = uuid.uuid4().hex
+        scope.setdefault("state", {})["request_id"] = request_id
+        token = request_id_var.set(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                MutableHeaders(scope=message)[self.header] = request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id if scope["type"] == "http" else send)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,43 @@
+import os
+
+# Configuration shared by the ASGI middlewares in this package. Every value
+# can be set from the environment; the middleware constructors take the same
+# names as keyword overrides.
+
+
+def _paths(value: str) -> tuple[str, ...]:
+    return tuple(path.strip() for path in value.split(",") if path.strip())
+
+
+# rate limiting
+RATE_LIMIT = int(os.getenv("RATE_LIMIT", 100))
+WINDOW_SECONDS = int(os.getenv("RATE_LIMIT_WINDOW", 60))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory | shared | redis
+# path prefixes never rate limited, e.g. "/health" for load balancer probes
+RATE_LIMIT_EXEMPT = _paths(os.getenv("RATE_LIMIT_EXEMPT", ""))
+
+# per-route limits as (limit, window_seconds); the longest matching prefix wins
+# and every route rule gets its own bucket
+ROUTE_LIMITS = {
+    "/users/login": (10, 60),
+    "/users/signup": (5, 60),
+}
+
+# per-user limits by role, applied to authenticated requests
+ROLE_LIMITS = {
+    "admin": (1000, 60),
+}
+
+# per-user overrides by user id
+USER_LIMITS: dict[int, tuple[int, int]] = {}
+
+# request ids
+REQUEST_ID_HEADER = os.getenv("REQUEST_ID_HEADER", "X-Request-ID")
+# reuse an id sent by the client or a proxy in front of us instead of minting one
+TRUST_REQUEST_ID = os.getenv("TRUST_REQUEST_ID", "true").lower() == "true"
+REQUEST_ID_MAX_LENGTH = 128
+
+# timing
+TIMING_HEADER = os.getenv("TIMING_HEADER", "Server-Timing")
+# requests slower than this end to end are logged, 0 disables
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", 1.0))
@@ -0,0 +1,46 @@
+import time
+from datetime import datetime, timezone
+
+from starlette.datastructures import MutableHeaders
+
+from .logger import send_log
+from .settings import TIMING_HEADER, SLOW_REQUEST_SECONDS
+
+
+# Adds "Server-Timing: app;dur=<ms>" (time until the response headers were
+# sent) and logs requests whose whole response, body included, took longer
+# than SLOW_REQUEST_SECONDS. Streaming bodies pass through untouched.
+class TimingMiddleware:
+    def __init__(self, app, header: str = TIMING_HEADER, slow_request_seconds: float = SLOW_REQUEST_SECONDS):
+        self.app = app
+        self.header = header
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = None
+
+        async def send_timed(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                MutableHeaders(scope=message).append(self.header, f"app;dur={(time.perf_counter() - start) * 1000:.1f}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.slow_request_seconds and elapsed >= self.slow_request_seconds:
+                send_log({
+                    "event": "SLOW_REQUEST",
+                    "path": scope["path"],
+                    "method": scope["method"],
+                    "status": status_code,
+                    "duration_ms": round(elapsed * 1000, 1),
+                    "timestamp": str(datetime.now(timezone.utc))
+                })
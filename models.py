@@ -1,52 +1,113 @@
 from database import Base
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, UniqueConstraint, Index, DDL, event
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.mutable import MutableList
 from datetime import datetime, timezone
 from enum import Enum
 
 
+# timestamps are stored as naive UTC (the columns are "timestamp without time zone")
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# trigram indexes below need pg_trgm
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+
+
 class Users(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # substring search on usernames (ilike '%...%') in GET /posts/
+        Index("ix_users_username_trgm", "username", postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}),
+    )
 
     id = Column(Integer,primary_key=True, index=True)
     fullname = Column(String,index=True)
     username = Column(String,unique=True,index=True)
     email = Column(String,unique=True,index=True)
-    password = Column(String,index=True)
+    password = Column(String)
     role = Column(String,index=True)
     bio = Column(String, nullable=True)
-    created_at = Column(DateTime,index=True,default=datetime.now(timezone.utc))
-    image = Column(LargeBinary, nullable=True)   
+    created_at = Column(DateTime,index=True,default=utcnow)
+    image_key = Column(String(64), nullable=True, index=True)  # sha256 of the avatar in the blob store
+    image_content_type = Column(String, nullable=True)
     about_me = Column(Text, nullable=True)
+    # counters maintained on write, see services/counters.py
+    post_count = Column(Integer, nullable=False, default=0, server_default="0")
+    follower_count = Column(Integer, nullable=False, default=0, server_default="0")
+    following_count = Column(Integer, nullable=False, default=0, server_default="0")
 
 # Model for posts
 class Posts(Base):
     __tablename__ = "posts"
+    __table_args__ = (
+        # keyset pagination of the feed, newest first
+        Index("ix_posts_created_at_id", "created_at", "id"),
+    )
 
     id = Column(Integer,primary_key=True, index=True)
     title = Column(String,index=True)
-    image = Column(LargeBinary,nullable=True) # Storing image as binary data
-    content = Column(Text,index=True)
-    tag = Column(String, default="Other") # to-do make it string of values
-    created_at = Column(DateTime,index=True,default=datetime.now(timezone.utc))
-    updated_at = Column(DateTime,index=True,default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
-    author_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"))
+    image_key = Column(String(64),nullable=True,index=True) # sha256 of the image in the blob store
+    image_content_type = Column(String,nullable=True) # sniffed from the upload
+    content = Column(Text)
+    tag = Column(String, default="Other") # display copy of the post's tags, filtering goes through post_tags
+    created_at = Column(DateTime,index=True,default=utcnow)
+    updated_at = Column(DateTime,index=True,default=utcnow, onupdate=utcnow)
+    author_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"), index=True)
+    # counters maintained on write, see services/counters.py
+    like_count = Column(Integer, nullable=False, default=0, server_default="0")
+    comment_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+# Model for tags, slug is the lowercased name used for lookups
+class Tags(Base):
+    __tablename__ = "tags"
+
+    id = Column(Integer,primary_key=True)
+    slug = Column(String,unique=True,nullable=False)
+    name = Column(String,nullable=False)
+    post_count = Column(Integer,nullable=False,default=0,server_default="0",index=True) # maintained on write, see services/tags.py
+
+# association between posts and tags
+class PostTags(Base):
+    __tablename__ = "post_tags"
+    __table_args__ = (
+        # filtering posts by tag
+        Index("ix_post_tags_tag_id_post_id", "tag_id", "post_id"),
+    )
+
+    post_id = Column(Integer, ForeignKey("posts.id",ondelete="CASCADE"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id",ondelete="CASCADE"), primary_key=True)
 
 
 # Model for comments
 class Comments(Base):
     __tablename__ = "comments"
+    __table_args__ = (
+        # top-level comments of a post and the recursive reply walk
+        Index("ix_comments_post_id_parent_comment_id_id", "post_id", "parent_comment_id", "id"),
+        Index("ix_comments_parent_comment_id", "parent_comment_id"),
+    )
 
     id = Column(Integer,primary_key=True,index=True)
-    content = Column(Text,index=True)
-    created_at = Column(DateTime,index=True,default=datetime.now(timezone.utc))
+    content = Column(Text)
+    created_at = Column(DateTime,index=True,default=utcnow)
     post_id = Column(Integer, ForeignKey("posts.id",ondelete="CASCADE"))
     author_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"))
     parent_comment_id = Column(Integer, ForeignKey("comments.id",ondelete="CASCADE"), nullable=True) 
 # model for likes
 class Likes(Base):
     __tablename__ = "likes"
+    __table_args__ = (
+        # one like per user and post, also serves "did I like these posts"
+        UniqueConstraint("user_id", "post_id", name="uq_likes_user_post"),
+        # likers of a post, newest first
+        Index("ix_likes_post_id_id", "post_id", "id"),
+    )
 
     id = Column(Integer,primary_key=True,index=True)
     user_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"))
@@ -55,19 +116,120 @@ class Likes(Base):
 # model for follows
 class Follows(Base):
     __tablename__ = "follows"
+    __table_args__ = (
+        # one follow per pair; also serves "who does X follow" and the mutual check
+        UniqueConstraint("follower_id", "following_id", name="uq_follows_follower_following"),
+        # "who follows X"
+        Index("ix_follows_following_id_follower_id", "following_id", "follower_id"),
+    )
 
     id = Column(Integer,primary_key=True,index=True)
     follower_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"))
     following_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"))
 
+# one row per pair of users who have exchanged messages, user_low_id < user_high_id
+class Conversations(Base):
+    __tablename__ = "conversations"
+    __table_args__ = (UniqueConstraint("user_low_id", "user_high_id", name="uq_conversations_pair"),)
+
+    id = Column(Integer,primary_key=True)
+    user_low_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"), nullable=False)
+    user_high_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"), nullable=False)
+    last_message_id = Column(Integer)
+    last_message_at = Column(DateTime)
+    created_at = Column(DateTime, default=utcnow)
+
+
+# each participant's view of a conversation, the inbox index
+class ConversationMembers(Base):
+    __tablename__ = "conversation_members"
+    __table_args__ = (
+        # inbox: a user's conversations by recency
+        Index("ix_conversation_members_user_id_last_message_at", "user_id", "last_message_at", "conversation_id"),
+    )
+
+    conversation_id = Column(Integer, ForeignKey("conversations.id",ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"), primary_key=True)
+    other_user_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"), nullable=False)
+    last_message_at = Column(DateTime)
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_read_message_id = Column(Integer, nullable=False, default=0, server_default="0")
+
+
 # model for chat messages
 class ChatMessages(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # history of one conversation, keyset on (timestamp, id)
+        Index("ix_chat_messages_conversation_id_timestamp_id", "conversation_id", "timestamp", "id"),
+    )
 
     id = Column(Integer,primary_key=True,index=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id",ondelete="CASCADE"))
     sender_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"))
     receiver_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"))
-    message = Column(Text,index=True)
-    timestamp = Column(DateTime,index=True,default=datetime.now(timezone.utc))
+    message = Column(Text)
+    timestamp = Column(DateTime,index=True,default=utcnow)
     is_read = Column(Integer, default=0)  # 0 for unread,
 
+
+# refresh tokens, stored as a sha256 of the token; each refresh replaces the
+# token with a new one in the same family, and presenting a replaced token
+# again revokes the whole family along with the access tokens issued with it
+class RefreshTokens(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer,primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False, unique=True)
+    family_id = Column(String(32), nullable=False, index=True)
+    created_at = Column(DateTime, default=utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime)
+    # the access token handed out together with this refresh token
+    access_jti = Column(String(32), nullable=True)
+    access_expires_at = Column(DateTime, nullable=True)
+
+
+# access tokens revoked before they expire (logout, refresh token reuse);
+# every worker mirrors the unexpired rows in memory
+class RevokedTokens(Base):
+    __tablename__ = "revoked_tokens"
+
+    jti = Column(String(32), primary_key=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, default=utcnow, index=True)
+
+
+# resized / re-encoded copies of an uploaded image, each stored as its own blob
+class ImageVariants(Base):
+    __tablename__ = "image_variants"
+    __table_args__ = (UniqueConstraint("source_key", "variant", name="uq_image_variants_source_variant"),)
+
+    id = Column(Integer,primary_key=True)
+    source_key = Column(String(64), nullable=False, index=True)
+    variant = Column(String, nullable=False)
+    key = Column(String(64), nullable=False, index=True)
+    content_type = Column(String, nullable=False)
+    width = Column(Integer)
+    height = Column(Integer)
+
+
+# Full-text search: on Postgres posts and comments get a generated tsvector
+# column with a GIN index (see services/search.py). Other databases use the
+# in-process index instead, so the column is not part of the models.
+SEARCH_VECTORS = {
+    "posts": "setweight(to_tsvector('english', coalesce(title, '')), 'A') || setweight(to_tsvector('english', coalesce(content, '')), 'B')",
+    "comments": "to_tsvector('english', coalesce(content, ''))",
+}
+for _table, _expression in SEARCH_VECTORS.items():
+    event.listen(
+        Base.metadata.tables[_table],
+        "after_create",
+        DDL(f"ALTER TABLE {_table} ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({_expression}) STORED").execute_if(dialect="postgresql")
+    )
+    event.listen(
+        Base.metadata.tables[_table],
+        "after_create",
+        DDL(f"CREATE INDEX IF NOT EXISTS ix_{_table}_search_vector ON {_table} USING gin (search_vector)").execute_if(dialect="postgresql")
+    )
@@ -1,20 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends, status, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
-from models import Users,ChatMessages,Follows
-from database import SessionLocal
-from typing import Annotated
+from fastapi import APIRouter, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Users,ChatMessages
+from database import get_db, get_read_db, AsyncSessionLocal
+from typing import Annotated, Optional
 from services import auth_services
+from services.follow_graph import follow_graph
+from services.chat_bus import chat_bus
+from services.chat_writer import chat_writer
+from services.conversations import conversation_id, history, inbox, mark_read
+from services.images import variant_urls
 from schemas import ChatRequest
  
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
 user_dependency = Annotated[dict, Depends(auth_services.get_current_user)]
 bcrypt_context = auth_services.bcrypt_context
 authenticate_user = auth_services.authenticate_user
@@ -27,111 +26,171 @@ router = APIRouter(
 )
 
 # Helper 
-def are_mutual_followers(db:Session,user_id:int,user_2:int):
-    follow_1 = db.query(Follows).filter(
-        Follows.follower_id == user_id,
-        Follows.following_id == user_2
-    ).first()
-    follow_2 = db.query(Follows).filter(
-        Follows.follower_id == user_2,
-        Follows.following_id == user_id
-    ).first()
-    return follow_1 is not None and follow_2 is not None
+async def are_mutual_followers(db:AsyncSession,user_id:int,user_2:int):
+    # served from the follow graph cache, db only on a miss
+    return await follow_graph.is_mutual(db,user_id,user_2)
 
 # REST API to send a message
 
 @router.post("/send",status_code=status.HTTP_201_CREATED)
-def send_message(chat_request: ChatRequest,current_user: user_dependency,db: db_dependency):
+async def send_message(chat_request: ChatRequest,current_user: user_dependency,db: db_dependency):
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
     try:
-        if are_mutual_followers(db,current_user["id"],chat_request.receiver_id) is False:
+        if await are_mutual_followers(db,current_user["id"],chat_request.receiver_id) is False:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You can only message users who follow you back.")
         if chat_request.receiver_id == current_user["id"]:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You cannot send message to yourself.")
-        new_message = ChatMessages(
-            sender_id=current_user["id"],
-            receiver_id=chat_request.receiver_id,
-            message=chat_request.message
-        )
-        db.add(new_message)
-        db.commit()
-        db.refresh(new_message)
-        return {"sender_id": new_message.sender_id, "receiver_id":new_message.receiver_id}
+        new_message = await chat_writer.submit(current_user["id"], chat_request.receiver_id, chat_request.message)
+        # live delivery to any open sockets of the receiver; the message is
+        # stored either way, so a bus failure does not fail the request
+        await chat_bus.notify(chat_request.receiver_id, {
+            "id": new_message["id"],
+            "conversation_id": new_message["conversation_id"],
+            "sender_id": new_message["sender_id"],
+            "message": new_message["message"],
+            "receiver_id": str(new_message["receiver_id"]),
+            "timestamp": new_message["timestamp"].isoformat()
+        })
+        return {"id": new_message["id"], "sender_id": new_message["sender_id"], "receiver_id":new_message["receiver_id"]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 # REST API to get chat history with a specific user
+# newest page first (messages oldest first within the page); pass nextCursor
+# back as cursor for older messages
 @router.get("/history/{with_user_id}",status_code=status.HTTP_200_OK)
-def get_chat_history(with_user_id:int,current_user: user_dependency,db: db_dependency):
+async def get_chat_history(
+    with_user_id:int,
+    current_user: user_dependency,
+    db: read_db_dependency,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200)
+):
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
     try:
-        if are_mutual_followers(db,current_user["id"],with_user_id) is False:
+        if await are_mutual_followers(db,current_user["id"],with_user_id) is False:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You can only view messages of users who follow you back.")
-        messages = db.query(ChatMessages).filter(
-            ((ChatMessages.sender_id == current_user["id"]) & (ChatMessages.receiver_id == with_user_id)) |
-            ((ChatMessages.sender_id == with_user_id) & (ChatMessages.receiver_id == current_user["id"]))
-        ).order_by(ChatMessages.timestamp).all()
-        return {"messages": messages}
+        conversation = await conversation_id(db, current_user["id"], with_user_id)
+        if conversation is None:
+            return {"conversation_id": None, "messages": [], "nextCursor": None}
+        messages, next_cursor = await history(db, conversation, cursor, limit)
+        return {"conversation_id": conversation, "messages": messages, "nextCursor": next_cursor}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+# conversations of the current user, most recent first, with unread counts
+@router.get("/inbox",status_code=status.HTTP_200_OK)
+async def get_inbox(
+    current_user: user_dependency,
+    db: read_db_dependency,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100)
+):
+    if not current_user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    try:
+        rows, next_cursor = await inbox(db, current_user["id"], cursor, limit)
+        avatars = await variant_urls(db, [row.image_key for row in rows], "avatar")
+        conversations = [{
+            "conversation_id": row.conversation_id,
+            "user": {
+                "id": row.other_user_id,
+                "username": row.username,
+                "fullname": row.fullname,
+                "image": avatars.get(row.image_key, {}).get("avatar_64") if row.image_key else None
+            },
+            "last_message": {
+                "id": row.last_message_id,
+                "sender_id": row.last_sender_id,
+                "message": row.last_message,
+                "timestamp": row.last_message_at
+            },
+            "unread_count": row.unread_count
+        } for row in rows]
+        return {"conversations": conversations, "nextCursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
 # api to mark messages as read
+# marks this message and every earlier message the current user received in
+# the same conversation, so a client only reports the newest one it has shown
 @router.post("/mark_read/{message_id}",status_code=status.HTTP_200_OK)
-def mark_message_as_read(message_id:int,current_user: user_dependency,db: db_dependency):
+async def mark_message_as_read(message_id:int,current_user: user_dependency,db: db_dependency):
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
     try:
-        message = db.query(ChatMessages).filter(ChatMessages.id == message_id, ChatMessages.receiver_id == current_user["id"]).first()
-        if not message:
+        conversation = await db.scalar(select(ChatMessages.conversation_id).where(ChatMessages.id == message_id, ChatMessages.receiver_id == current_user["id"]))
+        if conversation is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found.")
-        message.is_read = 1  # Mark as read
-        db.commit()
-        return {"message": "Message marked as read."}
+        marked = await mark_read(db, current_user["id"], conversation, message_id)
+        await db.commit()
+        return {"message": "Messages marked as read.", "marked": marked}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
-# web-socket for real time chat 
-active_connections : dict[str,WebSocket] = {}
-
+# web-socket for real time chat
+# a user may hold several sockets (tabs, devices) on any worker; messages are
+# routed to all of them through services.chat_bus
 @router.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket,user_id:str,db: db_dependency):
+async def websocket_endpoint(websocket: WebSocket,user_id:str):
     await websocket.accept()
-    active_connections[user_id] = websocket
+    sender_id = int(user_id)
     try:
+        # inside the try: a half-done connect is still undone by disconnect
+        await chat_bus.connect(sender_id, websocket)
         while True:
             data = await websocket.receive_json()
             receiver_id = str(data.get("receiver_id"))
             message_text = data.get("message")
-            sender_id = int(user_id)
-            if not are_mutual_followers(db,sender_id,int(receiver_id)):
+            # the session only checks out a connection if the graph cache misses
+            async with AsyncSessionLocal() as db:
+                mutual = await are_mutual_followers(db,sender_id,int(receiver_id))
+            if not mutual:
                 await websocket.send_json({"error": "You can only message users who follow you back."})
                 continue
             if receiver_id == user_id:
                 await websocket.send_json({"error": "You cannot send message to yourself."})
                 continue
-            new_message = ChatMessages(
-                sender_id=sender_id,
-                receiver_id=int(receiver_id),
-                message=message_text
-            )
-            db.add(new_message)
-            db.commit()
-            db.refresh(new_message)
-            if receiver_id in active_connections:
-                await active_connections[receiver_id].send_json({
-                    "sender_id": sender_id,
-                    "message": message_text,
-                    "receiver_id":receiver_id,
-                    "timestamp": new_message.timestamp.isoformat()
-                })
+            # queued for the batched writer; resolves with the id once committed
+            try:
+                new_message = await chat_writer.submit(sender_id, int(receiver_id), message_text)
+            except Exception:
+                await websocket.send_json({"error": "Message could not be saved.", "client_id": data.get("client_id")})
+                continue
+            timestamp = new_message["timestamp"].isoformat()
+            # never raises: the message is stored, so the ack below must go out
+            await chat_bus.notify(int(receiver_id), {
+                "id": new_message["id"],
+                "conversation_id": new_message["conversation_id"],
+                "sender_id": sender_id,
+                "message": message_text,
+                "receiver_id":receiver_id,
+                "timestamp": timestamp
+            })
+            # ack: client_id lets the sender match it to the message it sent
             await websocket.send_json({
+                "id": new_message["id"],
+                "conversation_id": new_message["conversation_id"],
+                "client_id": data.get("client_id"),
                 "message": message_text,
                 "sender_id":sender_id,
                 "receiver_id":receiver_id,
-            })                                          
+                "timestamp": timestamp
+            })
     except WebSocketDisconnect:
-        active_connections.pop(user_id, None)
+        pass
+    finally:
+        await chat_bus.disconnect(sender_id, websocket)
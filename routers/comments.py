@@ -1,65 +1,114 @@
-from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Query
 from fastapi.responses import JSONResponse, Response
-from sqlalchemy.orm import Session
+from sqlalchemy import select, literal
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import Users, Posts, Comments
-from database import SessionLocal
-from typing import Annotated
+from database import get_db, get_read_db
+from typing import Annotated, Optional
+from collections import defaultdict
 from services import auth_services
+from services.counters import bump
+from services.images import variant_urls
+from services.search import index_document
+from services.response_cache import response_cache
 from schemas import CommentBase
 from sqlalchemy.exc import IntegrityError
-import base64
 
 router = APIRouter(
     prefix="/comments",
     tags=["comments"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db 
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session,Depends(get_db)]
-user_dependency = Annotated[Session,Depends(auth_services.get_current_user)]
+db_dependency = Annotated[AsyncSession,Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession,Depends(get_read_db)]
+user_dependency = Annotated[dict,Depends(auth_services.get_current_user)]
 
 # to get all comments for a Particular post
+# top-level comments can be paged with limit/cursor (next cursor is sent back in
+# the X-Next-Cursor header) and max_depth trims how deep replies are expanded
 @router.get("/{post_id}",status_code=status.HTTP_200_OK)
-def get_comment_for_post(post_id:int,db:db_dependency):
+async def get_comment_for_post(
+    post_id:int,
+    db:read_db_dependency,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    cursor: Optional[int] = Query(None),
+    max_depth: Optional[int] = Query(None, ge=0)
+):
+    async def load(db: AsyncSession):
+        # top-level comments for this page
+        roots_query = select(Comments.id).where(Comments.post_id == post_id, Comments.parent_comment_id.is_(None))
+        if cursor is not None:
+            roots_query = roots_query.where(Comments.id > cursor)
+        roots_query = roots_query.order_by(Comments.id)
+        if limit is not None:
+            roots_query = roots_query.limit(limit + 1)
+        root_ids = list((await db.execute(roots_query)).scalars())
+        next_cursor = None
+        if limit is not None and len(root_ids) > limit:
+            root_ids = root_ids[:limit]
+            next_cursor = str(root_ids[-1])
+        if not root_ids:
+            return {"comments": [], "next_cursor": None}
+
+        # whole reply tree under those roots in one recursive query
+        tree = select(
+            Comments.id,
+            literal(0).label("depth")
+        ).where(Comments.id.in_(root_ids)).cte("comment_tree", recursive=True)
+        replies = aliased(Comments)
+        child_query = select(replies.id, (tree.c.depth + 1).label("depth")).where(replies.parent_comment_id == tree.c.id)
+        if max_depth is not None:
+            child_query = child_query.where(tree.c.depth < max_depth)
+        tree = tree.union_all(child_query)
+        comment_model = (await db.execute(select(Comments).join(tree, Comments.id == tree.c.id).order_by(Comments.id))).scalars().all()
+
+        # all authors in one query
+        author_ids = {comment.author_id for comment in comment_model}
+        authors = {
+            author.id: author
+            for author in await db.execute(select(Users.id, Users.fullname, Users.image_key).where(Users.id.in_(author_ids)))
+        }
+
+        avatars = await variant_urls(db, [author.image_key for author in authors.values()], "avatar")
+
+        children = defaultdict(list)
+        for comment in comment_model:
+            children[comment.parent_comment_id].append(comment)
+
+        def build_comment_tree(comment):
+            author = authors.get(comment.author_id)
+            image = avatars.get(author.image_key, {}).get("avatar_64", "") if author else ""
+            return {
+                "id": comment.id,
+                "content": comment.content,
+                "author_name": author.fullname if author else "Unknown",
+                "created_at": comment.created_at,
+                "children": [build_comment_tree(child) for child in children.get(comment.id, [])],
+                "image": image
+            }
+        roots = {comment.id: comment for comment in children.get(None, [])}
+        comment_tree = [build_comment_tree(roots[root_id]) for root_id in root_ids if root_id in roots]
+        return {"comments": comment_tree, "next_cursor": next_cursor}
+
     try:
-        comment_model = db.query(Comments).filter(Comments.post_id==post_id).all()
-        if not comment_model:
-            return []
-        def build_comment_tree(comments, parent_id=None):
-            tree = []
-            for comment in comments:
-                if comment.parent_comment_id == parent_id:
-                    author = db.query(Users).filter(Users.id == comment.author_id).first()
-                    image  = author.image if author else ""
-                    if(image):image = base64.b64encode(image).decode('utf-8')
-                    comment_dict = {
-                        "id": comment.id,
-                        "content": comment.content,
-                        "author_name": author.fullname if author else "Unknown",
-                        "created_at": comment.created_at,
-                        "children": build_comment_tree(comments, comment.id),
-                        "image": image
-                    }
-                    tree.append(comment_dict)
-            return tree
-        comment_tree = build_comment_tree(comment_model)
-        return comment_tree
+        page = await response_cache.cached(
+            "comments", f"{post_id}:{limit}:{cursor}:{max_depth}", [f"comments:{post_id}"], load, db
+        )
+        if page["next_cursor"]:
+            response.headers["X-Next-Cursor"] = page["next_cursor"]
+        return page["comments"]
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail=str(e))
 
 # To make a comment for a post
 @router.post("/{post_id}",status_code=status.HTTP_201_CREATED)
-def post_comment(post_id:int,comment:CommentBase,user:user_dependency,db:db_dependency):
+async def post_comment(post_id:int,comment:CommentBase,user:user_dependency,db:db_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="You are not logged in. Please log in to continue.")
     try:
-        post_exists = db.query(Posts).filter(Posts.id == post_id).first()
+        post_exists = (await db.execute(select(Posts.id).where(Posts.id == post_id))).first()
         if not post_exists:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
         user_id = user.get("id")
@@ -69,19 +118,21 @@ def post_comment(post_id:int,comment:CommentBase,user:user_dependency,db:db_depe
             author_id = user_id
         )
         db.add(comment_model)
-        db.commit()
-        db.refresh(comment_model)
+        await bump(db, Posts.comment_count, post_id)
+        await db.commit()
+        index_document(db, "comments", comment_model)
+        await response_cache.invalidate(f"comments:{post_id}", f"post:{post_id}")
         return {"message":"Comment added successfully.", "comment": {"id": comment_model.id, "author_name": user.get("username")}}
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail=str(e))
 
 # To make a nested comment
 @router.post("/reply/{comment_id}",status_code=status.HTTP_201_CREATED)
-def post_nested_comment(comment_id:int,user:user_dependency,db:db_dependency,comment:CommentBase):
+async def post_nested_comment(comment_id:int,user:user_dependency,db:db_dependency,comment:CommentBase):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="You are not logged in. Please log in to continue.")
     try:
-        parent_comment = db.query(Comments).filter(Comments.id == comment_id).first()
+        parent_comment = await db.get(Comments, comment_id)
         if not parent_comment:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Parent comment not found")
         user_id = user.get("id")
@@ -92,8 +143,10 @@ def post_nested_comment(comment_id:int,user:user_dependency,db:db_dependency,com
             parent_comment_id = comment_id
         )
         db.add(nested_comment)
-        db.commit()
-        db.refresh(nested_comment)
+        await bump(db, Posts.comment_count, parent_comment.post_id)
+        await db.commit()
+        index_document(db, "comments", nested_comment)
+        await response_cache.invalidate(f"comments:{parent_comment.post_id}", f"post:{parent_comment.post_id}")
         return {"message":"Reply added successfully.", "comment": {"id": nested_comment.id, "author_name": user.get("username")}}
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail=str(e))
\ No newline at end of file
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, HTTPException, status, Query
+
+from services.query_profiler import recent_profiles
+
+# development only, included by main.py when QUERY_PROFILER is on
+router = APIRouter(
+    prefix="/debug",
+    tags=["debug"]
+)
+
+
+# most recent profiled requests, newest first; repeated_only keeps the ones
+# with a likely N+1
+@router.get("/queries", status_code=status.HTTP_200_OK)
+async def recent_queries(limit: int = Query(50, ge=1, le=500), repeated_only: bool = Query(False)):
+    entries = []
+    for request_id, profile in reversed(recent_profiles.items()):
+        repeated = profile.repeated()
+        if repeated_only and not repeated:
+            continue
+        entries.append({
+            "request_id": request_id,
+            "label": profile.label,
+            "count": profile.count,
+            "total_ms": round(profile.seconds * 1000, 3),
+            "repeated": repeated
+        })
+        if len(entries) >= limit:
+            break
+    return entries
+
+
+# every statement of one request, with fingerprints; the id is the response's X-Request-ID
+@router.get("/queries/{request_id}", status_code=status.HTTP_200_OK)
+async def request_queries(request_id: str):
+    profile = recent_profiles.get(request_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No profile for this request")
+    return profile.to_dict()
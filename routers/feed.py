@@ -0,0 +1,63 @@
+from fastapi import APIRouter, HTTPException, Depends, status, Query
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Users, Posts
+from database import get_read_db
+from typing import Annotated, Optional
+from services import auth_services, timeline
+from utils import encode_cursor, decode_cursor
+
+router = APIRouter(
+    prefix="/feed",
+    tags=["feed"]
+)
+
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
+user_dependency = Annotated[dict, Depends(auth_services.get_current_user)]
+
+# home timeline: posts from the people the current user follows, newest first,
+# in the same shape as GET /posts/. Pass nextCursor back as cursor for the next page
+@router.get("/", status_code=status.HTTP_200_OK)
+async def get_feed(
+    db: read_db_dependency,
+    user: user_dependency,
+    cursor: Optional[str] = Query(None),
+    page_size: int = Query(20, ge=1, le=100)
+):
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    before = decode_cursor(cursor, int)[0] if cursor else None
+    try:
+        post_ids = await timeline.read(db, user["id"], before, page_size)
+        rows = {}
+        if post_ids:
+            rows = {row.id: row for row in await db.execute(select(
+                Posts.id,
+                Posts.title,
+                Posts.tag,
+                func.substr(Posts.content, 1, 71).label("content"),
+                Posts.created_at,
+                Users.id.label("author_id"),
+                Users.username.label("author_username")
+            ).join(Users, Posts.author_id == Users.id).where(Posts.id.in_(post_ids)))}
+        result = []
+        for post_id in post_ids:
+            post = rows.get(post_id)
+            if post is None:
+                continue
+            content = post.content[:70] + "..." if len(post.content) > 70 else post.content
+            result.append({
+                "id": post.id,
+                "title": post.title,
+                "content": content,
+                "tag": post.tag,
+                "created_at": post.created_at,
+                "author": {
+                    "id": post.author_id,
+                    "username": post.author_username
+                }
+            })
+        next_cursor = encode_cursor(post_ids[-1]) if len(post_ids) == page_size else None
+        return {"result": result, "nextCursor": next_cursor}
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
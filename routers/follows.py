@@ -1,10 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Query, BackgroundTasks
 from fastapi.responses import JSONResponse, Response
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import Users, Follows
-from database import SessionLocal
-from typing import Annotated
+from database import get_db, get_read_db
+from typing import Annotated, Optional
 from services import auth_services
+from services.counters import bump
+from services.follow_graph import follow_graph
+from services import timeline
+from services.images import variant_urls
 from sqlalchemy.exc import IntegrityError
 
 
@@ -13,42 +19,45 @@ router = APIRouter(
     tags=["follows"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
 user_dependency = Annotated[dict, Depends(auth_services.get_current_user)]
 
 # api to follow a user
 @router.post("/follow/{user_id}", status_code=status.HTTP_200_OK)
-def follow_user(user_id:int, user: user_dependency, db: db_dependency):
+async def follow_user(user_id:int, user: user_dependency, db: db_dependency, background_tasks: BackgroundTasks):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
     try:
         follow_id = user["id"]
         if follow_id == user_id:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You cannot follow yourself.")
-        user_to_follow = db.query(Users).filter(Users.id == user_id).first()
+        user_to_follow = await db.get(Users, user_id)
         if not user_to_follow:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User to follow not found.")
-        new_follow  = Follows(follower_id=follow_id, following_id=user_id)
-        db.add(new_follow)
-        db.commit()
-        db.refresh(new_follow)
-        return {"message": "Followed successfully", "follow": new_follow}
-    except IntegrityError:
-        db.rollback()
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You are already following this user.")
+        new_follow = (await db.execute(
+            insert(Follows)
+            .values(follower_id=follow_id, following_id=user_id)
+            .on_conflict_do_nothing(constraint="uq_follows_follower_following")
+            .returning(Follows.id, Follows.follower_id, Follows.following_id)
+        )).first()
+        if new_follow is None:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You are already following this user.")
+        await bump(db, Users.following_count, follow_id)
+        await bump(db, Users.follower_count, user_id)
+        await db.commit()
+        follow_graph.followed(follow_id, user_id)
+        background_tasks.add_task(timeline.followed_task, follow_id, user_id)
+        return {"message": "Followed successfully", "follow": dict(new_follow._mapping)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 # unfollow a user
 @router.delete("/unfollow/{user_id}", status_code=status.HTTP_200_OK)
-def unfollow_user(user_id:int,db:db_dependency,user:user_dependency):
+async def unfollow_user(user_id:int,db:db_dependency,user:user_dependency,background_tasks: BackgroundTasks):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
     try:
@@ -56,35 +65,70 @@ def unfollow_user(user_id:int,db:db_dependency,user:user_dependency):
         if unfollow_ud == user_id:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You cannot unfollow yourself.")
         # Check if the user to be unfollowed exists
-        user_to_infollow = db.query(Users).filter(Users.id == user_id).first()
+        user_to_infollow = await db.get(Users, user_id)
         if not user_to_infollow:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User to unfollow not found.")
-        # Check if the follow relationship exists
-        follow_relationship  = db.query(Follows).filter(Follows.follower_id == unfollow_ud, Follows.following_id == user_id).first()
-        if not follow_relationship:
+        # delete the follow relationship if it exists
+        follow_relationship = await db.scalar(
+            delete(Follows).where(Follows.follower_id == unfollow_ud, Follows.following_id == user_id).returning(Follows.id)
+        )
+        if follow_relationship is None:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You are not following this user.")
-        db.delete(follow_relationship)
-        db.commit()
+        await bump(db, Users.following_count, unfollow_ud, -1)
+        await bump(db, Users.follower_count, user_id, -1)
+        await db.commit()
+        follow_graph.unfollowed(unfollow_ud, user_id)
+        background_tasks.add_task(timeline.unfollowed_task, unfollow_ud, user_id)
         return {"message": "Unfollowed successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
+def user_entries(rows, avatars):
+    return [{
+        "id": row.id,
+        "username": row.username,
+        "fullname": row.fullname,
+        "image": avatars.get(row.image_key, {}).get("avatar_64") if row.image_key else None
+    } for row in rows]
+
 # api to get followers of current user
 @router.get("/followers", status_code=status.HTTP_200_OK)
-def get_followers(db:db_dependency,user:user_dependency):
+async def get_followers(
+    db: read_db_dependency,
+    user: user_dependency,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100)
+):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
-    try:
-        user_id = user["id"]
-        followers = db.query(Follows).filter(Follows.follower_id == user_id).all()
-        followers_username = []
-        for follower in followers:
-            user_model = db.query(Users).filter(Users.id == follower.following_id).first()
-            if user_model:
-                followers_username.append({
-                    "id": user_model.id,
-                    "username": user_model.username
-                })
-        return {"followers": followers_username}
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
\ No newline at end of file
+    rows, next_cursor = await follow_graph.page(db, "followers", user["id"], cursor, limit)
+    avatars = await variant_urls(db, [row.image_key for row in rows], "avatar")
+    return {"followers": user_entries(rows, avatars), "nextCursor": next_cursor}
+
+# api to get the users the current user follows
+@router.get("/following", status_code=status.HTTP_200_OK)
+async def get_following(
+    db: read_db_dependency,
+    user: user_dependency,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100)
+):
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    rows, next_cursor = await follow_graph.page(db, "following", user["id"], cursor, limit)
+    avatars = await variant_urls(db, [row.image_key for row in rows], "avatar")
+    return {"following": user_entries(rows, avatars), "nextCursor": next_cursor}
+
+# people followed by the people the current user follows
+@router.get("/suggestions", status_code=status.HTTP_200_OK)
+async def get_suggestions(db: read_db_dependency, user: user_dependency, limit: int = Query(10, ge=1, le=50)):
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    rows = await follow_graph.suggestions(db, user["id"], limit)
+    avatars = await variant_urls(db, [row.image_key for row in rows], "avatar")
+    suggestions = user_entries(rows, avatars)
+    for entry, row in zip(suggestions, rows):
+        entry["mutuals"] = row.mutuals
+    return {"suggestions": suggestions}
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, HTTPException, Depends, status, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Users, Posts, ImageVariants
+from database import get_db
+from typing import Annotated
+from utils import blob_response, IMMUTABLE_CACHE
+
+router = APIRouter(
+    prefix="/images",
+    tags=["images"]
+)
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+# content-addressed image urls, safe to cache forever
+@router.api_route("/{key}", methods=["GET", "HEAD"])
+async def get_image(key: str, request: Request, db: db_dependency):
+    content_type = await db.scalar(select(ImageVariants.content_type).where(ImageVariants.key == key).limit(1))
+    if content_type is None:
+        content_type = await db.scalar(select(Posts.image_content_type).where(Posts.image_key == key).limit(1))
+    if content_type is None:
+        content_type = await db.scalar(select(Users.image_content_type).where(Users.image_key == key).limit(1))
+    if content_type is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    return await blob_response(request, key, content_type, IMMUTABLE_CACHE)
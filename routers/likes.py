@@ -1,10 +1,15 @@
-from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Query
 from fastapi.responses import JSONResponse, Response
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, func, tuple_, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import Users, Posts, Likes
-from database import SessionLocal
-from typing import Annotated
+from database import get_db, get_read_db
+from typing import Annotated, Optional
 from services import auth_services
+from services.counters import bump
+from services.response_cache import response_cache
+from utils import encode_cursor, decode_cursor
 from datetime import datetime, timezone
 from sqlalchemy.exc import IntegrityError
 
@@ -13,56 +18,125 @@ router = APIRouter(
     tags=["likes"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
 user_dependency = Annotated[dict, Depends(auth_services.get_current_user)]
 
-# get api to all likes for a particular post
+MAX_BATCH_POSTS = 100
+
+# which of these posts has the current user liked, for rendering a feed page
+# e.g. /likes/me?post_ids=1&post_ids=2
+@router.get("/me",status_code=status.HTTP_200_OK)
+async def get_my_likes(user: user_dependency, db: read_db_dependency, post_ids: list[int] = Query(..., max_length=MAX_BATCH_POSTS)):
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication required")
+    try:
+        liked = (await db.execute(
+            select(Likes.post_id).where(Likes.user_id == user["id"], Likes.post_id.in_(set(post_ids)))
+        )).scalars().all()
+        return {"liked": sorted(liked)}
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+# get api for the likes of a particular post
+# likes_count comes from the counter on the post; likers are newest first and
+# paginated with cursor/nextCursor, count_only=true skips them entirely
 @router.get("/{post_id}",status_code=status.HTTP_200_OK)
-async def get_likes_for_post(post_id:int,db: db_dependency):
+async def get_likes_for_post(
+    post_id:int,
+    db: read_db_dependency,
+    count_only: bool = Query(False),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None)
+):
+    after = decode_cursor(cursor) if cursor else None
+
+    async def load(db: AsyncSession):
+        likes_count = await db.scalar(select(Posts.like_count).where(Posts.id == post_id))
+        if likes_count is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+        if count_only:
+            return {"post_id": post_id, "likes_count": likes_count}
+        query = (
+            select(Likes.id, Likes.user_id, Users.username)
+            .join(Users, Users.id == Likes.user_id)
+            .where(Likes.post_id == post_id)
+            .order_by(Likes.id.desc())
+            .limit(limit + 1)
+        )
+        if after:
+            query = query.where(Likes.id < after[0])
+        likes = (await db.execute(query)).all()
+        next_cursor = None
+        if len(likes) > limit:
+            likes = likes[:limit]
+            next_cursor = encode_cursor(likes[-1].id)
+        return {
+            "post_id": post_id,
+            "likes_count": likes_count,
+            "likes": [{"id": like.id, "user_id": like.user_id, "username": like.username} for like in likes],
+            "nextCursor": next_cursor
+        }
+
     try:
-        likes = db.query(Likes).filter(Likes.post_id == post_id).all()
-        return {"post_id": post_id, "likes_count": len(likes), "likes": [{"id": like.id, "user_id": like.user_id} for like in likes]}
+        return await response_cache.cached(
+            "likes", encode_cursor(post_id, count_only, limit, cursor), [f"likes:{post_id}"], load, db
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 # post id to like a post
+# idempotent: liking twice leaves one like and the counter untouched
 @router.post("/{post_id}",status_code=status.HTTP_201_CREATED)
 async def like_post(post_id:int,user:user_dependency,db: db_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication required")
     try:
-        new_like = Likes(user_id=user["id"], post_id=post_id)
-        db.add(new_like)
-        db.commit()
-        db.refresh(new_like)
-        return {"message": "Post liked successfully", "like": {"id": new_like.id, "user_id": new_like.user_id, "post_id": new_like.post_id}}
+        # inserting from the post row inserts nothing for a missing post, on
+        # every backend, whether or not it enforces the foreign key
+        like_id = await db.scalar(
+            insert(Likes)
+            .from_select(["user_id", "post_id"], select(literal(user["id"]), Posts.id).where(Posts.id == post_id))
+            .on_conflict_do_nothing(index_elements=["user_id", "post_id"])
+            .returning(Likes.id)
+        )
+        if like_id is None and await db.scalar(select(Posts.id).where(Posts.id == post_id)) is None:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+        if like_id is not None:
+            await bump(db, Posts.like_count, post_id)
+        await db.commit()
+        if like_id is not None:
+            await response_cache.invalidate(f"likes:{post_id}", f"post:{post_id}")
+        return {"message": "Post liked successfully", "created": like_id is not None, "like": {"id": like_id, "user_id": user["id"], "post_id": post_id}}
+    except HTTPException:
+        raise
     except IntegrityError:
-        db.rollback()
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You have already liked this post")
+        # foreign key: the post was deleted meanwhile
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 # delete api to unlike a post
+# idempotent: unliking a post that is not liked is a no-op
 @router.delete("/{post_id}",status_code=status.HTTP_200_OK)
 async def unlike_post(post_id:int,user:user_dependency,db: db_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication required")
     try:
-        like = db.query(Likes).filter(Likes.post_id == post_id, Likes.user_id == user["id"]).first()
-        if not like:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Like not found")
-        db.delete(like)
-        db.commit()
-        return {"message": "Post unliked successfully"}
+        like_id = await db.scalar(
+            delete(Likes).where(Likes.post_id == post_id, Likes.user_id == user["id"]).returning(Likes.id)
+        )
+        if like_id is not None:
+            await bump(db, Posts.like_count, post_id, -1)
+        await db.commit()
+        if like_id is not None:
+            await response_cache.invalidate(f"likes:{post_id}", f"post:{post_id}")
+        return {"message": "Post unliked successfully", "deleted": like_id is not None}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
-  
@@ -1,59 +1,104 @@
-from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Query
-from sqlalchemy import or_
+from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Query, Request, BackgroundTasks
+from sqlalchemy import func, text, tuple_, select
 from fastapi.responses import JSONResponse, Response
-from sqlalchemy.orm import Session
-from models import Users, Posts, Likes 
-from database import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Users, Posts, utcnow
+from database import get_db, get_read_db
 from typing import Annotated, Optional
 from services import auth_services
+from services.blob_store import save_upload
+from services.images import process_image, variant_urls
+from services.tags import attach_tags, tag_filter
+from services.search import index_document
+from services.counters import bump
+from services.timeline import fan_out_task
+from services.response_cache import response_cache
+from utils import blob_response, REVALIDATE_CACHE, encode_cursor, decode_cursor
 from schemas import PostBase, Postupdate
-from datetime import datetime, timezone
 from sqlalchemy.exc import IntegrityError
 from fastapi import Form, File, UploadFile
+import time
 
 router = APIRouter(
     prefix="/posts",
     tags=["posts"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
 user_dependency = Annotated[dict, Depends(auth_services.get_current_user)]
 
+# cached totals for filtered listings: (tag, author) -> (expires_at, count)
+COUNT_CACHE_TTL = 60
+COUNT_CACHE_SIZE = 1024
+_count_cache: dict[tuple, tuple[float, int]] = {}
+
+
+async def count_posts(db: AsyncSession, query, tag: Optional[str], author: Optional[str]) -> int:
+    if not tag and not author:
+        # planner estimate for the whole table, exact count only before the first ANALYZE
+        if db.bind.dialect.name == "postgresql":
+            estimate = await db.scalar(text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'posts'"))
+            if estimate is not None and estimate >= 0:
+                return estimate
+    key = (tag, author)
+    now = time.monotonic()
+    cached = _count_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    total = await db.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+    if len(_count_cache) >= COUNT_CACHE_SIZE:
+        _count_cache.clear()
+    _count_cache[key] = (now + COUNT_CACHE_TTL, total)
+    return total
+
+
 # Get api for all posts along with its authorname and userid
-# with pagination
+# newest first, paginated by an opaque (created_at, id) cursor: pass the
+# nextCursor of one page as cursor to get the next. totalPosts is approximate
+# (planner estimate or a cached count) and can be skipped with include_total=false
 @router.get("/", status_code=status.HTTP_200_OK)
-def get_posts(
-    db: db_dependency,
+async def get_posts(
+    db: read_db_dependency,
     author: Optional[str] = Query(None),
     tag: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None),
     page_number: int = Query(1, ge=1),
-    page_size: int = Query(2, ge=1)
+    page_size: int = Query(2, ge=1, le=100),
+    include_total: bool = Query(True)
 ):
-    try:
-        query = db.query(Posts).join(Users, Posts.author_id == Users.id).with_entities(
+    after = decode_cursor(cursor) if cursor else None
+    if not tag or tag.lower() == "all":
+        tag = None
+
+    async def load(db: AsyncSession):
+        query = select(
             Posts.id,
             Posts.title,
             Posts.tag,
-            Posts.content,
+            func.substr(Posts.content, 1, 71).label("content"),
             Posts.created_at,
             Users.id.label("author_id"),
             Users.username.label("author_username")
-        )
-        if tag and tag.lower() != "all":
-            tag_list = [t.strip() for t in tag.split(",") if t.strip()]
-            tag_filters = [Posts.tag.ilike(f"%{t}%") for t in tag_list]
-            query = query.filter(or_(*tag_filters))
+        ).join(Users, Posts.author_id == Users.id)
+        # exact tag match through post_tags, author via the trigram index on users.username
+        if tag:
+            query = query.where(tag_filter(Posts, tag))
         if author:
-            query = query.filter(Users.username.ilike(f"%{author}%"))
-        total_posts = query.count()
-        posts = query.offset((page_number - 1) * page_size).limit(page_size).all()
+            query = query.where(Users.username.ilike(f"%{author}%"))
+        total_posts = await count_posts(db, query, tag, author) if include_total else None
+
+        query = query.order_by(Posts.created_at.desc(), Posts.id.desc())
+        if after:
+            query = query.where(tuple_(Posts.created_at, Posts.id) < tuple_(*after))
+        elif page_number > 1:
+            # legacy page numbers, prefer cursors for deep pages
+            query = query.offset((page_number - 1) * page_size)
+        posts = (await db.execute(query.limit(page_size + 1))).all()
+        next_cursor = None
+        if len(posts) > page_size:
+            posts = posts[:page_size]
+            next_cursor = encode_cursor(posts[-1].created_at, posts[-1].id)
         result = []
         for post in posts:
             content = post.content[:70] + "..." if len(post.content) > 70 else post.content
@@ -68,31 +113,37 @@ def get_posts(
                     "username": post.author_username
                 }
             })
-        return {"result": result, "totalPosts": total_posts}
+        return {"result": result, "totalPosts": total_posts, "nextCursor": next_cursor}
+
+    try:
+        return await response_cache.cached(
+            "posts", encode_cursor(author, tag, cursor, page_number, page_size, include_total), ["posts"], load, db
+        )
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 # get api to all info for a particular post
 @router.get("/{post_id}",status_code=status.HTTP_200_OK)
-def get_post_detail(post_id:int,db: db_dependency):
-    try:
-        post_model = db.query(Posts).filter(Posts.id == post_id).first()
+async def get_post_detail(post_id:int,db: db_dependency):
+    async def load(db: AsyncSession):
+        post_model = await db.get(Posts, post_id)
         author_id = post_model.author_id if post_model else None
-        like_count = db.query(Likes).filter(Likes.post_id == post_id).count()
-
-        author_username = db.query(Users.username).filter(Users.id == author_id).first() if author_id else None
+        author_username = (await db.execute(select(Users.username).where(Users.id == author_id))).first() if author_id else None
         if not post_model:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+        image_urls = (await variant_urls(db, [post_model.image_key], "post")).get(post_model.image_key)
         res = []
         res.append({
             "id": post_model.id,
             "title": post_model.title,
             "content": post_model.content,
             "tags": post_model.tag,
-            "image": f"/posts/{post_id}/image" if post_model.image else None,
+            "image": image_urls["full"] if image_urls else None,
+            "image_variants": image_urls,
             "created_at": post_model.created_at,
             "updated_at": post_model.updated_at,
-            "like_count": like_count,
+            "like_count": post_model.like_count,
+            "comment_count": post_model.comment_count,
             "author": {
                 "id": post_model.author_id,
                 "username": author_username[0] if author_username else None
@@ -100,23 +151,31 @@ def get_post_detail(post_id:int,db: db_dependency):
         })
         # return as object
         return res[0] if res else None
+
+    try:
+        return await response_cache.cached("post_detail", str(post_id), [f"post:{post_id}"], load, db)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
 # get api for image 
-@router.get("/{post_id}/image")
-async def get_post_image(post_id: int,user:user_dependency,db: db_dependency):
-    post = db.query(Posts).filter(Posts.id == post_id).first()
-    if not post or not post.image:
+# supports If-None-Match (304) and Range requests, see utils.blob_response
+@router.api_route("/{post_id}/image", methods=["GET", "HEAD"])
+async def get_post_image(post_id: int,request: Request,user:user_dependency,db: db_dependency):
+    image = (await db.execute(select(Posts.image_key, Posts.image_content_type).where(Posts.id == post_id))).first()
+    if not image or not image.image_key:
         raise HTTPException(status_code=404, detail="Image not found")
-    return Response(content=post.image, media_type="image/jpeg")
+    # the post can get a new image, so clients revalidate against the ETag
+    return await blob_response(request, image.image_key, image.image_content_type, REVALIDATE_CACHE)
 
 # post api for creating a post
 @router.post("/create_posts", status_code=status.HTTP_201_CREATED)
 async def create_posts(
     user: user_dependency,
     db: db_dependency,
+    background_tasks: BackgroundTasks,
     title: str = Form(...),
     content: str = Form(...),
     tag: str = Form(...),  # comma-separated string, e.g. "Health,Culture"
@@ -126,19 +185,25 @@ async def create_posts(
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
     user_id = user.get("id")
-    image_data = await image.read() if image else None
+    image_blob = await save_upload(image)
+    await process_image(db, image_blob.key if image_blob else None, "post")
 
     post_model = Posts(
         title=title,
         content=content,
-        tag=",".join(tag.split(",")),  # store as simple string
-        image=image_data,
+        image_key=image_blob.key if image_blob else None,
+        image_content_type=image_blob.content_type if image_blob else None,
         author_id=user_id
     )
 
     db.add(post_model)
-    db.commit()
-    db.refresh(post_model)
+    await db.flush()
+    post_model.tag = await attach_tags(db, post_model.id, tag)
+    await bump(db, Users.post_count, user_id)
+    await db.commit()
+    index_document(db, "posts", post_model)
+    await response_cache.invalidate("posts")
+    background_tasks.add_task(fan_out_task, user_id, post_model.id)
     return {"message": "Post created successfully"}
 
 # put api for updating a post
@@ -153,7 +218,7 @@ async def updated_post(
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
     try:
-        post_model = db.query(Posts).filter(Posts.id == post_id).first()
+        post_model = await db.get(Posts, post_id)
         if not post_model:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="Post not found")
         if post_model.author_id != user.get("id"):
@@ -162,13 +227,19 @@ async def updated_post(
             post_model.title = posts.title
         if posts.content is not None:
             post_model.content = posts.content
-        post_model.updated_at = datetime.now(timezone.utc)
+        post_model.updated_at = utcnow()
         if image is not None:
-            image_data = await image.read()
-            post_model.image = image_data
-        db.commit()
-        db.refresh(post_model)
+            image_blob = await save_upload(image)
+            if image_blob:
+                await process_image(db, image_blob.key, "post")
+                post_model.image_key = image_blob.key
+                post_model.image_content_type = image_blob.content_type
+        await db.commit()
+        index_document(db, "posts", post_model)
+        await response_cache.invalidate("posts", f"post:{post_id}")
         return {"message": "Post updated successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     
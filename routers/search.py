@@ -0,0 +1,28 @@
+from fastapi import APIRouter, HTTPException, Depends, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from typing import Annotated, Literal
+from services.search import search
+
+router = APIRouter(
+    prefix="/search",
+    tags=["search"]
+)
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+# ranked full-text search over posts (title and content) or comments,
+# snippets are HTML-escaped with the matched words wrapped in <b>
+@router.get("/", status_code=status.HTTP_200_OK)
+async def search_content(
+    db: db_dependency,
+    q: str = Query(..., min_length=1, max_length=200),
+    type: Literal["posts", "comments"] = Query("posts"),
+    page_number: int = Query(1, ge=1, le=50),
+    page_size: int = Query(10, ge=1, le=50)
+):
+    try:
+        results = await search(db, type, q, limit=page_size, offset=(page_number - 1) * page_size)
+        return {"query": q, "type": type, "results": results}
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
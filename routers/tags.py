@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException, Depends, status, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Tags
+from database import get_db
+from typing import Annotated, Optional
+
+router = APIRouter(
+    prefix="/tags",
+    tags=["tags"]
+)
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+# most used tags first, optionally only those starting with q
+@router.get("/", status_code=status.HTTP_200_OK)
+async def get_tags(
+    db: db_dependency,
+    q: Optional[str] = Query(None, max_length=50),
+    limit: int = Query(20, ge=1, le=100)
+):
+    try:
+        query = select(Tags.name, Tags.slug, Tags.post_count).where(Tags.post_count > 0)
+        if q:
+            query = query.where(Tags.slug.startswith(q.strip().lower(), autoescape=True))
+        tags = (await db.execute(query.order_by(Tags.post_count.desc(), Tags.slug).limit(limit))).all()
+        return {"tags": [{"name": tag.name, "slug": tag.slug, "post_count": tag.post_count} for tag in tags]}
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
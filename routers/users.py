@@ -1,15 +1,17 @@
 from fastapi import APIRouter, HTTPException, Depends, status,File, UploadFile, Form
 from typing import Optional
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from models import Users, Posts,Follows
-from database import SessionLocal
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Users, RefreshTokens
+from database import get_db
 from typing import Annotated
 from services import auth_services
-from schemas import  Token, UserResponse, UpdateUserForm
+from services.blob_store import save_upload
+from services.images import process_image, variant_urls
+from schemas import  Token, UserResponse, UpdateUserForm, RefreshRequest
 from datetime import timedelta
 from sqlalchemy.exc import IntegrityError
-import base64
 
 
 router = APIRouter(
@@ -17,16 +19,9 @@ router = APIRouter(
     tags=["users"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 bycrpt_context = auth_services.bcrypt_context
+password_hasher = auth_services.password_hasher
 authenticate_user = auth_services.authenticate_user
 
 # signup
@@ -39,34 +34,35 @@ async def create_user(
     role: str = Form(...),
     about_me: Optional[str] = Form(None),
     image: UploadFile = File(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    existing_user = db.query(Users).filter(
+    existing_user = (await db.execute(select(Users.id).where(
         (Users.username == username) | (Users.email == email)
-    ).first()
+    ))).first()
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username or Email already registered."
         )
 
-    image_bytes = await image.read() if image else None
+    image_blob = await save_upload(image)
+    await process_image(db, image_blob.key if image_blob else None, "avatar")
     user_model = Users(
         fullname=fullname,
         username=username,
         email=email,
-        password=bycrpt_context.hash(password),
+        password=await password_hasher.hash(password),
         role=role,
         about_me=about_me,
-        image=image_bytes
+        image_key=image_blob.key if image_blob else None,
+        image_content_type=image_blob.content_type if image_blob else None
     )
 
     try:
         db.add(user_model)
-        db.commit()
-        db.refresh(user_model)
+        await db.commit()
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Database error occurred."
@@ -81,16 +77,51 @@ async def create_user(
 # login
 @router.post("/login",response_model=Token)
 async def login_for_access_token(db:db_dependency,form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
-    user = authenticate_user(form_data.username,form_data.password,db)
+    user = await authenticate_user(form_data.username,form_data.password,db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Incorrect username or password")
     access_token = auth_services.create_access_token(
         user.username,
         user.id,
         user.role,
-        timedelta(minutes=30)
+        timedelta(minutes=auth_services.ACCESS_TOKEN_MINUTES)
     )
-    return {"access_token": access_token, "token_type": "bearer", "user_id": user.id}
+    refresh_token = await auth_services.issue_refresh_token(db, user.id, access_token=access_token)
+    await db.commit()
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user_id": user.id,
+        "refresh_token": refresh_token,
+        "expires_in": auth_services.ACCESS_TOKEN_MINUTES * 60
+    }
+
+# new access token for a refresh token; the refresh token is single use and
+# comes back replaced, so clients never go through the password again
+@router.post("/refresh",response_model=Token)
+async def refresh_access_token(body: RefreshRequest, db: db_dependency):
+    user, access_token, refresh_token = await auth_services.rotate_refresh_token(db, body.refresh_token)
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user_id": user.id,
+        "refresh_token": refresh_token,
+        "expires_in": auth_services.ACCESS_TOKEN_MINUTES * 60
+    }
+
+# revokes the current access token and, when given, the refresh token's session
+@router.post("/logout",status_code=status.HTTP_200_OK)
+async def logout(current_user: Annotated[dict, Depends(auth_services.get_current_user)], db: db_dependency, body: Optional[RefreshRequest] = None):
+    if body is not None:
+        family_id = await db.scalar(select(RefreshTokens.family_id).where(
+            RefreshTokens.token_hash == auth_services.token_digest(body.refresh_token),
+            RefreshTokens.user_id == current_user["id"]
+        ))
+        if family_id:
+            await auth_services.revoke_refresh_family(db, family_id)
+    await auth_services.revoke_access_token(db, current_user.get("jti"), current_user.get("exp"))
+    await db.commit()
+    return {"message": "Logged out."}
 
 # api to get current user info
 # username,email,role, id, followers, following, total_posts
@@ -99,15 +130,10 @@ async def read_users_me(current_user: Annotated[dict, Depends(auth_services.get_
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
     try:
-        user_model = db.query(Users).filter(Users.id == current_user.get("id")).first()
+        user_model = await db.get(Users, current_user.get("id"))
         if not user_model:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-        total_posts = db.query(Posts).filter(Posts.author_id == current_user.get("id")).count()
-        followers = db.query(Follows).filter(Follows.following_id == current_user.get("id")).count()
-        following = db.query(Follows).filter(Follows.follower_id == current_user.get("id")).count()
-        image_str = None
-        if user_model.image:
-            image_str = base64.b64encode(user_model.image).decode('utf-8')
+        image_urls = (await variant_urls(db, [user_model.image_key], "avatar")).get(user_model.image_key)
         user = {
             "id": user_model.id,
             "username": user_model.username,
@@ -116,10 +142,11 @@ async def read_users_me(current_user: Annotated[dict, Depends(auth_services.get_
             "about_me": user_model.about_me,
             "role": user_model.role,
             "bio": user_model.bio,
-            "total_posts": total_posts,
-            "followers": followers,
-            "following": following,
-            "image": image_str
+            "total_posts": user_model.post_count,
+            "followers": user_model.follower_count,
+            "following": user_model.following_count,
+            "image": image_urls["avatar_256"] if image_urls else None,
+            "image_variants": image_urls
         }
         return user
     except Exception as e:
@@ -141,7 +168,7 @@ async def update_user_info(
 
     try:
         current_user_id = current_user.get("id")
-        user_model = db.query(Users).filter(Users.id == current_user_id).first()
+        user_model = await db.get(Users, current_user_id)
         if not user_model:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, 
@@ -151,7 +178,7 @@ async def update_user_info(
         if form_data.fullname is not None and form_data.fullname != "string":
             user_model.fullname = form_data.fullname
         if form_data.password is not None and form_data.password != "string":
-            user_model.password = bycrpt_context.hash(form_data.password)
+            user_model.password = await password_hasher.hash(form_data.password)
         if form_data.about_me is not None and form_data.about_me != "string":
             user_model.about_me = form_data.about_me
         if form_data.username is not None and form_data.username != "string":
@@ -159,16 +186,20 @@ async def update_user_info(
         if form_data.bio is not None and form_data.bio != "string":
             user_model.bio = form_data.bio
         if form_data.image:
-            image_bytes = await form_data.image.read()
-            user_model.image = image_bytes
+            image_blob = await save_upload(form_data.image)
+            if image_blob:
+                await process_image(db, image_blob.key, "avatar")
+                user_model.image_key = image_blob.key
+                user_model.image_content_type = image_blob.content_type
 
-        db.commit()
-        db.refresh(user_model)
+        await db.commit()
 
         return {"message": "User information updated successfully."}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
             detail=str(e)
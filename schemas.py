@@ -7,6 +7,11 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     user_id: int
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class UserResponse(BaseModel):
     message: str
@@ -1,12 +1,22 @@
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from database import SessionLocal
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
 from typing import Annotated
-from models import Users
+from models import Users, RefreshTokens, RevokedTokens, utcnow
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from datetime import timedelta, datetime, timezone
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from jose import jwt, JWTError
+import asyncio
+import hashlib
+import secrets
+import threading
+import time
+import uuid
 import os 
 from dotenv import load_dotenv
 
@@ -16,46 +26,337 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = 'HS256'
 
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# short-lived access tokens, renewed with a rotating refresh token
+ACCESS_TOKEN_MINUTES = int(os.getenv("ACCESS_TOKEN_MINUTES", 15))
+REFRESH_TOKEN_DAYS = int(os.getenv("REFRESH_TOKEN_DAYS", 30))
+# verified access tokens kept per worker
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10_000))
+# how often each worker picks up revocations made by the others
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", 5))
+
+# raising BCRYPT_ROUNDS makes older hashes "need update"; they are rehashed
+# the next time their user logs in
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# bcrypt releases the GIL, so threads give real parallelism
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", os.cpu_count() or 2))
+# hashes running or waiting for a worker; beyond this logins fail fast with 503
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", 64))
+
+bcrypt_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS
+)
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="/users/login")
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+
+class PasswordHasher:
+    # runs bcrypt on a bounded thread pool so a login burst never blocks the
+    # event loop; excess work is rejected instead of queueing without limit
+    def __init__(self, workers: int = PASSWORD_WORKERS, max_pending: int = PASSWORD_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.stats = {"completed": 0, "rejected": 0, "rehashed": 0, "wait_total": 0.0, "wait_max": 0.0, "run_total": 0.0}
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _timed(self, queued_at: float, fn, *args):
+        # runs on a worker thread
+        started = time.perf_counter()
+        with self._lock:
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            wait = started - queued_at
+            with self._lock:
+                self.running -= 1
+                self.stats["wait_total"] += wait
+                self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+                self.stats["run_total"] += time.perf_counter() - started
+
+    async def _submit(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many logins in progress, try again shortly.",
+                headers={"Retry-After": "1"}
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self._timed, time.perf_counter(), fn, *args)
+        finally:
+            self.pending -= 1
+            self.stats["completed"] += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(bcrypt_context.hash, password)
+
+    async def verify_and_update(self, password: str, password_hash: str) -> tuple[bool, str | None]:
+        # (matches, new hash when the stored one uses outdated parameters)
+        return await self._submit(bcrypt_context.verify_and_update, password, password_hash)
+
+    def metrics(self) -> dict:
+        completed = self.stats["completed"] or 1
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "running": self.running,
+            "queued": max(self.pending - self.running, 0),
+            "completed": self.stats["completed"],
+            "rejected": self.stats["rejected"],
+            "rehashed": self.stats["rehashed"],
+            "wait_avg_ms": round(self.stats["wait_total"] / completed * 1000, 3),
+            "wait_max_ms": round(self.stats["wait_max"] * 1000, 3),
+            "run_avg_ms": round(self.stats["run_total"] / completed * 1000, 3),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
 
-db_dependency = Annotated[Session, Depends(get_db)]
 
-def authenticate_user(username:str,password:str,db:db_dependency):
-    user_model = db.query(Users).filter(Users.username==username).first()
+password_hasher = PasswordHasher()
+
+
+async def authenticate_user(username:str,password:str,db:db_dependency):
+    user_model = (await db.execute(select(Users).where(Users.username==username))).scalars().first()
     if not user_model:
+        # unknown user: no hash to check, so no bcrypt work is queued
         return False
-    if not bcrypt_context.verify(password,user_model.password):
+    verified, new_hash = await password_hasher.verify_and_update(password, user_model.password)
+    if not verified:
         return False
+    if new_hash:
+        # cost parameters changed since this hash was made
+        user_model.password = new_hash
+        await db.commit()
+        password_hasher.stats["rehashed"] += 1
     return user_model 
 
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    # LRU of sha256(token) -> (exp, claims) for tokens whose signature was
+    # already checked; an entry is only served until the token's own exp
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str, now: float) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, digest: str, exp: float, claims: dict):
+        with self._lock:
+            self._entries[digest] = (exp, claims)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class RevocationList:
+    # revoked access token ids -> exp; lookups are a dict hit. The
+    # revoked_tokens table is the shared copy, polled by every worker.
+    def __init__(self, sync_seconds: float = REVOCATION_SYNC_SECONDS):
+        self.sync_seconds = sync_seconds
+        self._revoked: dict[str, float] = {}
+        self._synced_at = None
+        self._task = None
+
+    def is_revoked(self, jti: str) -> bool:
+        return jti in self._revoked
+
+    def add(self, jti: str, exp: float):
+        self._revoked[jti] = exp
+
+    def purge(self, now: float):
+        for jti in [jti for jti, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[jti]
+
+    async def sync(self, db: AsyncSession):
+        started = utcnow()
+        query = select(RevokedTokens.jti, RevokedTokens.expires_at).where(RevokedTokens.expires_at > started)
+        if self._synced_at is not None:
+            # overlap by one interval so rows committed late are not missed
+            query = query.where(RevokedTokens.revoked_at >= self._synced_at - timedelta(seconds=self.sync_seconds))
+        for row in await db.execute(query):
+            self.add(row.jti, row.expires_at.replace(tzinfo=timezone.utc).timestamp())
+        self._synced_at = started
+        self.purge(time.time())
+
+    async def _run(self):
+        from database import AsyncSessionLocal
+
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self.sync(db)
+            except Exception:
+                # keep serving the last known list; retried next interval
+                pass
+            await asyncio.sleep(self.sync_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+token_cache = TokenCache()
+revocation_list = RevocationList()
+
+
 # create access token 
-def create_access_token(username:str,user_id:int,role:str,expires_delta:timedelta):
-    encode = {"sub":username,"id":user_id,"role":role}
+def create_access_token(username:str,user_id:int,role:str,expires_delta:timedelta = timedelta(minutes=ACCESS_TOKEN_MINUTES)):
+    encode = {"sub":username,"id":user_id,"role":role,"jti":uuid.uuid4().hex}
     expire = datetime.now(timezone.utc) + expires_delta
     encode.update({"exp":expire.timestamp()})  
     return jwt.encode(encode,SECRET_KEY,algorithm=ALGORITHM)
 
 # get current user
+# the signature is checked once per token, later requests with the same token
+# are served from token_cache until it expires
+def verify_token(token: str) -> dict | None:
+    # claims {username, id, role, jti, exp} of a validly signed, unexpired
+    # access token, None otherwise; revocation is checked by the caller
+    digest = token_digest(token)
+    claims = token_cache.get(digest, time.time())
+    if claims is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+        if payload.get("sub") is None or payload.get("id") is None:
+            return None
+        claims = {"username": payload["sub"], "id": payload["id"], "role": payload.get("role"), "jti": payload.get("jti"), "exp": payload.get("exp")}
+        if claims["exp"] is not None:
+            token_cache.put(digest, float(claims["exp"]), claims)
+    return claims
+
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        user_id: int = payload.get("id")
-        role: str = payload.get("role")
-        # print(payload)
-        if username is None or user_id is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Could not validate credentials")
-        return {"username": username, "id": user_id, "role": role}
-    except JWTError:
+    claims = verify_token(token)
+    if claims is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Could not validate credentials")
+    if claims["jti"] and revocation_list.is_revoked(claims["jti"]):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Token has been revoked")
+    return dict(claims)
+
+
+async def issue_refresh_token(db: AsyncSession, user_id: int, family_id: str | None = None, access_token: str | None = None) -> str:
+    # the caller commits; only the hash is stored, along with the jti of the
+    # access token issued with it so revoking the family revokes that too
+    token = secrets.token_urlsafe(32)
+    claims = verify_token(access_token) if access_token else None
+    db.add(RefreshTokens(
+        user_id=user_id,
+        token_hash=token_digest(token),
+        family_id=family_id or uuid.uuid4().hex,
+        expires_at=utcnow() + timedelta(days=REFRESH_TOKEN_DAYS),
+        access_jti=claims["jti"] if claims else None,
+        access_expires_at=datetime.fromtimestamp(float(claims["exp"]), timezone.utc).replace(tzinfo=None) if claims else None
+    ))
+    return token
+
+
+async def revoke_refresh_family(db: AsyncSession, family_id: str):
+    # ends a session: its refresh tokens and every access token issued from
+    # them that has not expired yet
+    now = utcnow()
+    await db.execute(
+        update(RefreshTokens)
+        .where(RefreshTokens.family_id == family_id, RefreshTokens.revoked_at.is_(None))
+        .values(revoked_at=now)
+    )
+    issued = (await db.execute(
+        select(RefreshTokens.access_jti, RefreshTokens.access_expires_at)
+        .where(RefreshTokens.family_id == family_id, RefreshTokens.access_jti.is_not(None), RefreshTokens.access_expires_at > now)
+    )).all()
+    await revoke_access_tokens(db, [(row.access_jti, row.access_expires_at) for row in issued])
+
+
+async def rotate_refresh_token(db: AsyncSession, token: str):
+    # (user, new access token, new refresh token); the presented token is
+    # spent atomically, so two concurrent refreshes with it cannot both succeed
+    digest = token_digest(token)
+    now = utcnow()
+    claimed = (await db.execute(
+        update(RefreshTokens)
+        .where(RefreshTokens.token_hash == digest, RefreshTokens.revoked_at.is_(None), RefreshTokens.expires_at > now)
+        .values(revoked_at=now)
+        .returning(RefreshTokens.user_id, RefreshTokens.family_id)
+    )).first()
+    if claimed is None:
+        # an already spent token coming back means it leaked: end the session
+        family_id = await db.scalar(
+            select(RefreshTokens.family_id).where(RefreshTokens.token_hash == digest, RefreshTokens.revoked_at.is_not(None))
+        )
+        if family_id:
+            await revoke_refresh_family(db, family_id)
+            await db.commit()
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Invalid refresh token")
+    user_model = await db.get(Users, claimed.user_id)
+    if not user_model:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Invalid refresh token")
+    access_token = create_access_token(user_model.username, user_model.id, user_model.role)
+    new_token = await issue_refresh_token(db, claimed.user_id, claimed.family_id, access_token)
+    await db.commit()
+    return user_model, access_token, new_token
+
+
+async def revoke_access_tokens(db: AsyncSession, tokens: list[tuple[str, datetime]]):
+    # (jti, naive UTC expiry) pairs; the caller commits. This worker stops
+    # accepting them immediately, the others on their next sync
+    if not tokens:
+        return
+    await db.execute(
+        insert(RevokedTokens)
+        .values([{"jti": jti, "expires_at": expires_at} for jti, expires_at in tokens])
+        .on_conflict_do_nothing(index_elements=["jti"])
+    )
+    for jti, expires_at in tokens:
+        revocation_list.add(jti, expires_at.replace(tzinfo=timezone.utc).timestamp())
 
 
+async def revoke_access_token(db: AsyncSession, jti: str | None, exp: float | None):
+    if not jti or exp is None:
+        return
+    await revoke_access_tokens(db, [(jti, datetime.fromtimestamp(float(exp), timezone.utc).replace(tzinfo=None))])
@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import NamedTuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BLOB_BACKEND = os.getenv("BLOB_BACKEND", "local")  # local | s3
+BLOB_ROOT = os.getenv("BLOB_ROOT", "blobs")
+BLOB_BUCKET = os.getenv("BLOB_BUCKET")
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobNotFound(KeyError):
+    pass
+
+
+class StoredBlob(NamedTuple):
+    key: str
+    size: int
+    content_type: str
+
+
+# magic numbers of the image formats we accept
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def sniff_content_type(head: bytes) -> str:
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis"):
+        return "image/avif"
+    return "application/octet-stream"
+
+
+def _copy_hashing(source, target):
+    # stream source into target chunk by chunk, returning (sha256 hex, size, first bytes)
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if size == 0:
+            head = chunk[:32]
+        digest.update(chunk)
+        target.write(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size, head
+
+
+# Content-addressed blobs on the local filesystem. The method names and return
+# shapes follow the S3 client (put_object/get_object/head_object/delete_object)
+# so the two backends are interchangeable.
+class LocalBlobStore:
+    def __init__(self, root: str = BLOB_ROOT):
+        self.root = root
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put_object(self, Key: str, Body, ContentType: str | None = None):
+        path = self.path(Key)
+        if os.path.exists(path):
+            return {"Key": Key}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.join(self.root, "tmp"), delete=False) as tmp:
+            if isinstance(Body, (bytes, bytearray)):
+                tmp.write(Body)
+            else:
+                shutil.copyfileobj(Body, tmp, CHUNK_SIZE)
+        os.replace(tmp.name, path)
+        return {"Key": Key}
+
+    def get_object(self, Key: str, Range: str | None = None):
+        head = self.head_object(Key)
+        body = open(self.path(Key), "rb")
+        if Range:
+            start, end = Range.removeprefix("bytes=").split("-")
+            body.seek(int(start))
+            head["ContentLength"] = int(end) - int(start) + 1
+        head["Body"] = body
+        return head
+
+    def head_object(self, Key: str):
+        try:
+            stat = os.stat(self.path(Key))
+        except FileNotFoundError:
+            raise BlobNotFound(Key)
+        return {"Key": Key, "ContentLength": stat.st_size, "LastModified": stat.st_mtime}
+
+    def delete_object(self, Key: str):
+        try:
+            os.remove(self.path(Key))
+        except FileNotFoundError:
+            pass
+
+    def put_stream(self, source) -> StoredBlob:
+        # hash while streaming to a temp file, then move it into place unless an
+        # identical blob already exists
+        with tempfile.NamedTemporaryFile(dir=os.path.join(self.root, "tmp"), delete=False) as tmp:
+            key, size, head = _copy_hashing(source, tmp)
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(tmp.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp.name, path)
+        return StoredBlob(key, size, sniff_content_type(head))
+
+
+class S3BlobStore:
+    def __init__(self, bucket: str = BLOB_BUCKET, client=None):
+        import boto3
+
+        self.bucket = bucket
+        self.client = client or boto3.client("s3")
+
+    def put_object(self, Key: str, Body, ContentType: str | None = None):
+        kwargs = {"Bucket": self.bucket, "Key": Key, "Body": Body}
+        if ContentType:
+            kwargs["ContentType"] = ContentType
+        return self.client.put_object(**kwargs)
+
+    def get_object(self, Key: str, Range: str | None = None):
+        kwargs = {"Bucket": self.bucket, "Key": Key}
+        if Range:
+            kwargs["Range"] = Range
+        try:
+            return self.client.get_object(**kwargs)
+        except self.client.exceptions.NoSuchKey:
+            raise BlobNotFound(Key)
+
+    def head_object(self, Key: str):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=Key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise BlobNotFound(Key)
+            raise
+
+    def delete_object(self, Key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=Key)
+
+    def put_stream(self, source) -> StoredBlob:
+        with tempfile.TemporaryFile() as tmp:
+            key, size, head = _copy_hashing(source, tmp)
+            blob = StoredBlob(key, size, sniff_content_type(head))
+            try:
+                self.head_object(key)
+                return blob
+            except BlobNotFound:
+                pass
+            tmp.seek(0)
+            self.client.upload_fileobj(tmp, self.bucket, key, ExtraArgs={"ContentType": blob.content_type})
+        return blob
+
+
+def create_blob_store(name: str = BLOB_BACKEND):
+    if name == "local":
+        return LocalBlobStore()
+    if name == "s3":
+        return S3BlobStore()
+    raise ValueError(f"Unknown blob backend: {name}")
+
+
+blob_store = create_blob_store()
+
+
+def read_blob(key: str | None) -> bytes | None:
+    if not key:
+        return None
+    try:
+        with blob_store.get_object(key)["Body"] as body:
+            return body.read()
+    except BlobNotFound:
+        return None
+
+
+async def save_upload(upload) -> StoredBlob | None:
+    # stream an UploadFile into the blob store off the event loop
+    if upload is None or upload.size == 0:
+        return None
+    await upload.seek(0)
+    return await asyncio.to_thread(blob_store.put_stream, upload.file)
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from middlewares.logger import send_log
+from services.resp_client import RespClient, RespError, encode_command, read_reply
+
+CHAT_BUS = os.getenv("CHAT_BUS", "memory")  # memory | redis
+CHAT_REDIS_URL = os.getenv("CHAT_REDIS_URL", "redis://localhost:6379/0")
+CHANNEL_PREFIX = "chat:user:"
+# messages waiting for one user's sockets before further ones are dropped
+CHAT_DELIVERY_QUEUE = int(os.getenv("CHAT_DELIVERY_QUEUE", 100))
+# seconds one socket may take to accept a message before it is skipped
+CHAT_SEND_TIMEOUT = float(os.getenv("CHAT_SEND_TIMEOUT", 5.0))
+
+
+# Sockets connected to this process, several per user (tabs, devices).
+class ConnectionRegistry:
+    def __init__(self, send_timeout: float = CHAT_SEND_TIMEOUT):
+        self.send_timeout = send_timeout
+        self._sockets: dict[int, set] = defaultdict(set)
+
+    def add(self, user_id: int, websocket) -> bool:
+        # True when this is the user's first socket in this process
+        first = user_id not in self._sockets
+        self._sockets[user_id].add(websocket)
+        return first
+
+    def remove(self, user_id: int, websocket) -> bool:
+        # True when the user has no sockets left in this process
+        sockets = self._sockets.get(user_id)
+        if sockets is None:
+            return False
+        sockets.discard(websocket)
+        if sockets:
+            return False
+        del self._sockets[user_id]
+        return True
+
+    def users(self):
+        return list(self._sockets)
+
+    def count(self) -> int:
+        return sum(len(sockets) for sockets in self._sockets.values())
+
+    async def send(self, user_id: int, payload: dict) -> int:
+        # deliver to every local socket of the user; a socket that failed is
+        # removed by its own endpoint when the disconnect surfaces there, a
+        # stalled one only holds up the user's other sockets for send_timeout
+        delivered = 0
+        for websocket in list(self._sockets.get(user_id, ())):
+            try:
+                await asyncio.wait_for(websocket.send_json(payload), self.send_timeout)
+                delivered += 1
+            except Exception:
+                pass
+        return delivered
+
+
+# Routes a payload to a user wherever their sockets are connected. Local
+# delivery never runs on the publisher's task: each user's messages go to a
+# bounded queue drained in order by that user's own task, so a slow socket
+# only delays its own user.
+class ChatBus:
+    def __init__(self, registry: ConnectionRegistry, delivery_queue: int = CHAT_DELIVERY_QUEUE):
+        self.registry = registry
+        self.delivery_queue = delivery_queue
+        # user_id -> messages waiting for that user's sockets, drained by one task
+        self._deliveries: dict[int, asyncio.Queue] = {}
+        self._delivery_tasks: set[asyncio.Task] = set()
+        self.stats = {"delivered": 0, "dropped": 0, "publish_errors": 0}
+
+    async def start(self):
+        pass
+
+    async def connect(self, user_id: int, websocket):
+        self.registry.add(user_id, websocket)
+
+    async def disconnect(self, user_id: int, websocket):
+        self.registry.remove(user_id, websocket)
+
+    async def publish(self, user_id: int, payload: dict):
+        raise NotImplementedError
+
+    async def notify(self, user_id: int, payload: dict) -> bool:
+        # publish for a message that is already stored: a bus failure is
+        # counted and logged, never raised, so the sender still gets its ack
+        # and does not resend; the receiver finds the message in history
+        try:
+            await self.publish(user_id, payload)
+            return True
+        except (ConnectionError, OSError, RespError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            self.stats["publish_errors"] += 1
+            self._log_error("CHAT_BUS_PUBLISH_ERROR", e)
+            return False
+
+    def _dispatch(self, user_id: int, payload: dict):
+        queue = self._deliveries.get(user_id)
+        if queue is None:
+            queue = self._deliveries[user_id] = asyncio.Queue(maxsize=self.delivery_queue)
+            task = asyncio.create_task(self._deliver(user_id, queue))
+            self._delivery_tasks.add(task)
+            task.add_done_callback(self._delivery_tasks.discard)
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # the user's sockets are not keeping up
+            self.stats["dropped"] += 1
+
+    async def _deliver(self, user_id: int, queue: asyncio.Queue):
+        try:
+            while not queue.empty():
+                await self.registry.send(user_id, queue.get_nowait())
+                self.stats["delivered"] += 1
+        finally:
+            # no await between the empty check and this, so nothing is missed
+            self._deliveries.pop(user_id, None)
+
+    def _log_error(self, event: str, error: Exception):
+        send_log({
+            "event": event,
+            "error": repr(error),
+            "timestamp": str(datetime.now(timezone.utc))
+        })
+
+    async def close(self):
+        for task in list(self._delivery_tasks):
+            task.cancel()
+
+
+# Single worker: publishing is a local dispatch.
+class MemoryBus(ChatBus):
+    async def publish(self, user_id, payload):
+        self._dispatch(user_id, payload)
+
+
+# Any number of workers: one channel per user, each worker subscribes to the
+# channels of the users connected to it, so a message only reaches the
+# processes that hold one of the receiver's sockets.
+class RespBus(ChatBus):
+    def __init__(self, registry: ConnectionRegistry, url: str = CHAT_REDIS_URL, reconnect_delay: float = 1.0,
+                 delivery_queue: int = CHAT_DELIVERY_QUEUE):
+        super().__init__(registry, delivery_queue)
+        self.url = url
+        self.publisher = RespClient(url)
+        self.reconnect_delay = reconnect_delay
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._listener = None
+        self._connected = asyncio.Event()
+        self.stats.update({"bad_messages": 0, "listener_errors": 0})
+
+    def _channel(self, user_id: int) -> str:
+        return f"{CHANNEL_PREFIX}{user_id}"
+
+    async def start(self, timeout: float = 5.0):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+            try:
+                await asyncio.wait_for(self._connected.wait(), timeout)
+            except asyncio.TimeoutError:
+                # keeps retrying in the background; local delivery needs the
+                # subscription, so messages are only lost until it connects
+                pass
+
+    async def _subscription(self, *args):
+        if self._writer is None:
+            # the listener resubscribes every local user once it reconnects
+            return
+        async with self._write_lock:
+            self._writer.write(encode_command(*args))
+            await self._writer.drain()
+
+    async def connect(self, user_id, websocket):
+        if self.registry.add(user_id, websocket):
+            await self._subscription("SUBSCRIBE", self._channel(user_id))
+
+    async def disconnect(self, user_id, websocket):
+        if self.registry.remove(user_id, websocket):
+            await self._subscription("UNSUBSCRIBE", self._channel(user_id))
+
+    async def publish(self, user_id, payload):
+        await self.publisher.execute("PUBLISH", self._channel(user_id), json.dumps(payload, default=str))
+
+    async def _listen(self):
+        client = RespClient(self.url)
+        while True:
+            writer = None
+            try:
+                reader, writer = await asyncio.open_connection(client.host, client.port)
+                if client.password:
+                    writer.write(encode_command("AUTH", client.password))
+                    await writer.drain()
+                    await read_reply(reader)
+                # a placeholder channel keeps the connection in subscribe mode
+                # while no user is connected; no await between reading the
+                # registry and publishing the writer, so no connect is missed
+                channels = [f"{CHANNEL_PREFIX}-"] + [self._channel(user_id) for user_id in self.registry.users()]
+                writer.write(encode_command("SUBSCRIBE", *channels))
+                self._writer = writer
+                await writer.drain()
+                self._connected.set()
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        try:
+                            user_id = int(reply[1].decode()[len(CHANNEL_PREFIX):])
+                            payload = json.loads(reply[2])
+                        except ValueError as e:
+                            # one malformed publish must not stop delivery for everyone
+                            self.stats["bad_messages"] += 1
+                            self._log_error("CHAT_BUS_BAD_MESSAGE", e)
+                            continue
+                        self._dispatch(user_id, payload)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                # failed AUTH, error replies, dropped connections: log and
+                # reconnect, the listener must never end on its own
+                self.stats["listener_errors"] += 1
+                self._log_error("CHAT_BUS_LISTENER_ERROR", e)
+            finally:
+                self._writer = None
+                if writer is not None:
+                    writer.close()
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        await super().close()
+        await self.publisher.close()
+
+
+def create_bus(registry: ConnectionRegistry, name: str = CHAT_BUS) -> ChatBus:
+    name = (name or "memory").lower()
+    if name == "memory":
+        return MemoryBus(registry)
+    if name == "redis":
+        return RespBus(registry)
+    raise ValueError(f"Unknown chat bus: {name}")
+
+
+connections = ConnectionRegistry()
+chat_bus = create_bus(connections)
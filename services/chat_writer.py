@@ -0,0 +1,143 @@
+import asyncio
+import os
+import time
+
+from sqlalchemy import insert
+
+from models import ChatMessages, utcnow
+from services.conversations import pair, conversation_ids, record_messages, remember
+
+CHAT_QUEUE_SIZE = int(os.getenv("CHAT_QUEUE_SIZE", 10000))
+CHAT_BATCH_COUNT = int(os.getenv("CHAT_BATCH_COUNT", 200))
+# longest a message waits for its batch to fill before it is written anyway
+CHAT_BATCH_AGE = float(os.getenv("CHAT_BATCH_AGE", 0.01))
+# batches written concurrently, each on its own pooled connection
+CHAT_WRITERS = int(os.getenv("CHAT_WRITERS", 2))
+
+
+# Chat messages are queued by the sockets and written by a few background
+# tasks as multi-row INSERT ... RETURNING batches. submit() resolves once the
+# row is committed, with its id, so the sender's ack can carry it. Unlike the
+# log shipper nothing is dropped: a full queue makes senders wait.
+class ChatWriter:
+    def __init__(self, session_factory=None, queue_size: int = CHAT_QUEUE_SIZE, max_count: int = CHAT_BATCH_COUNT,
+                 max_age: float = CHAT_BATCH_AGE, writers: int = CHAT_WRITERS):
+        self._session_factory = session_factory
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.max_count = max_count
+        self.max_age = max_age
+        self.writers = writers
+        self._tasks: list[asyncio.Task] = []
+        self._busy = 0
+        self.stats = {"submitted": 0, "written": 0, "failed": 0, "batches": 0, "retried_batches": 0}
+
+    @property
+    def session_factory(self):
+        if self._session_factory is None:
+            from database import AsyncSessionLocal
+            self._session_factory = AsyncSessionLocal
+        return self._session_factory
+
+    async def submit(self, sender_id: int, receiver_id: int, message: str) -> dict:
+        # {"id", "conversation_id", "sender_id", "receiver_id", "message", "timestamp"} once committed
+        row = {"sender_id": sender_id, "receiver_id": receiver_id, "message": message, "timestamp": utcnow(), "is_read": 0}
+        future = asyncio.get_running_loop().create_future()
+        self.stats["submitted"] += 1
+        if self._tasks:
+            await self.queue.put((row, future))
+        else:
+            # no writer running (scripts, shutdown): write this one inline
+            await self._write([(row, future)])
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_age
+        while len(batch) < self.max_count:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _insert(self, rows: list[dict]) -> list[int]:
+        async with self.session_factory() as db:
+            conversations = await conversation_ids(db, {pair(row["sender_id"], row["receiver_id"]) for row in rows})
+            for row in rows:
+                row["conversation_id"] = conversations[pair(row["sender_id"], row["receiver_id"])]
+            # insertmanyvalues keeps RETURNING in parameter order
+            result = await db.execute(
+                insert(ChatMessages).returning(ChatMessages.id, sort_by_parameter_order=True), rows
+            )
+            ids = result.scalars().all()
+            await record_messages(db, [{"id": message_id, **row} for row, message_id in zip(rows, ids)])
+            await db.commit()
+        remember(conversations)
+        return ids
+
+    async def _write(self, batch):
+        self._busy += 1
+        try:
+            ids = await self._insert([row for row, _ in batch])
+        except BaseException as e:
+            if isinstance(e, Exception) and len(batch) > 1:
+                # one bad row (say a receiver deleted a moment ago) must not
+                # fail the whole batch: retry one by one, only the rows that
+                # fail again fail their senders
+                self.stats["retried_batches"] += 1
+                for item in batch:
+                    await self._write([item])
+                return
+            self.stats["failed"] += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e if isinstance(e, Exception) else ConnectionError("chat writer stopped"))
+            if not isinstance(e, Exception):
+                raise
+            return
+        finally:
+            self._busy -= 1
+        self.stats["written"] += len(batch)
+        self.stats["batches"] += 1
+        for (row, future), message_id in zip(batch, ids):
+            if not future.done():
+                future.set_result({"id": message_id, **row})
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._write(batch)
+
+    def start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._run()) for _ in range(self.writers)]
+
+    async def stop(self, timeout: float = 10.0):
+        # let the writers drain the queue and finish in-flight batches first
+        deadline = time.monotonic() + timeout
+        while (not self.queue.empty() or self._busy) and time.monotonic() < deadline:
+            await asyncio.sleep(self.max_age)
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # anything still queued after the timeout is written inline
+        while not self.queue.empty():
+            batch = [self.queue.get_nowait() for _ in range(min(self.queue.qsize(), self.max_count))]
+            await self._write(batch)
+
+
+chat_writer = ChatWriter()
@@ -0,0 +1,194 @@
+from collections import Counter
+
+from sqlalchemy import select, update, func, tuple_, case, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Users, Conversations, ConversationMembers, ChatMessages
+from utils import encode_cursor, decode_cursor
+
+# (user_low_id, user_high_id) -> conversation id; conversations are never
+# renumbered, so entries never go stale
+CONVERSATION_CACHE_SIZE = 100_000
+_conversation_ids: dict[tuple[int, int], int] = {}
+
+
+def pair(user_id: int, other_id: int) -> tuple[int, int]:
+    return (user_id, other_id) if user_id < other_id else (other_id, user_id)
+
+
+async def conversation_ids(db: AsyncSession, pairs) -> dict[tuple[int, int], int]:
+    # ids for many user pairs, creating conversations (and their two member
+    # rows) for pairs that have never talked; pass the result to remember()
+    # once the transaction has committed
+    pairs = set(pairs)
+    found = {p: _conversation_ids[p] for p in pairs if p in _conversation_ids}
+    missing = pairs - found.keys()
+    if missing:
+        await db.execute(
+            insert(Conversations)
+            .values([{"user_low_id": low, "user_high_id": high} for low, high in missing])
+            .on_conflict_do_nothing(constraint="uq_conversations_pair")
+        )
+        rows = await db.execute(
+            select(Conversations.id, Conversations.user_low_id, Conversations.user_high_id)
+            .where(tuple_(Conversations.user_low_id, Conversations.user_high_id).in_(list(missing)))
+        )
+        created = {(row.user_low_id, row.user_high_id): row.id for row in rows}
+        await db.execute(
+            insert(ConversationMembers)
+            .values([
+                {"conversation_id": conversation_id, "user_id": user_id, "other_user_id": other_id}
+                for (low, high), conversation_id in created.items()
+                for user_id, other_id in ((low, high), (high, low))
+            ])
+            .on_conflict_do_nothing(index_elements=["conversation_id", "user_id"])
+        )
+        found.update(created)
+    return found
+
+
+def remember(conversations: dict[tuple[int, int], int]):
+    if len(_conversation_ids) + len(conversations) > CONVERSATION_CACHE_SIZE:
+        _conversation_ids.clear()
+    _conversation_ids.update(conversations)
+
+
+async def conversation_id(db: AsyncSession, user_id: int, other_id: int) -> int | None:
+    # existing conversation between two users, None if they never talked
+    key = pair(user_id, other_id)
+    if key in _conversation_ids:
+        return _conversation_ids[key]
+    found = await db.scalar(select(Conversations.id).where(
+        Conversations.user_low_id == key[0], Conversations.user_high_id == key[1]
+    ))
+    if found is not None:
+        remember({key: found})
+    return found
+
+
+async def record_messages(db: AsyncSession, messages: list[dict]):
+    # after inserting a batch of messages (dicts with id, conversation_id,
+    # receiver_id, timestamp): move each conversation's last message forward
+    # and add to the receivers' unread counts, in the caller's transaction
+    latest = {}
+    unread = Counter()
+    for message in messages:
+        conversation = message["conversation_id"]
+        newest = latest.setdefault(conversation, [message["id"], message["timestamp"]])
+        newest[0] = max(newest[0], message["id"])
+        newest[1] = max(newest[1], message["timestamp"])
+        unread[(conversation, message["receiver_id"])] += 1
+    # case() rather than greatest(), which SQLite lacks; another batch may
+    # have moved the conversation further already
+    for conversation, (message_id, timestamp) in latest.items():
+        await db.execute(
+            update(Conversations)
+            .where(Conversations.id == conversation)
+            .values(
+                last_message_id=case(
+                    (or_(Conversations.last_message_id.is_(None), Conversations.last_message_id < message_id), message_id),
+                    else_=Conversations.last_message_id
+                ),
+                last_message_at=case(
+                    (or_(Conversations.last_message_at.is_(None), Conversations.last_message_at < timestamp), timestamp),
+                    else_=Conversations.last_message_at
+                )
+            )
+        )
+        await db.execute(
+            update(ConversationMembers)
+            .where(ConversationMembers.conversation_id == conversation)
+            .values(last_message_at=case(
+                (or_(ConversationMembers.last_message_at.is_(None), ConversationMembers.last_message_at < timestamp), timestamp),
+                else_=ConversationMembers.last_message_at
+            ))
+        )
+    for (conversation, receiver_id), count in unread.items():
+        await db.execute(
+            update(ConversationMembers)
+            .where(ConversationMembers.conversation_id == conversation, ConversationMembers.user_id == receiver_id)
+            .values(unread_count=ConversationMembers.unread_count + count)
+        )
+
+
+async def history(db: AsyncSession, conversation: int, cursor: str | None, limit: int):
+    # one page of a conversation, oldest first within the page; nextCursor
+    # points at older messages
+    query = select(ChatMessages).where(ChatMessages.conversation_id == conversation)
+    if cursor:
+        query = query.where(tuple_(ChatMessages.timestamp, ChatMessages.id) < tuple_(*decode_cursor(cursor)))
+    rows = (await db.execute(
+        query.order_by(ChatMessages.timestamp.desc(), ChatMessages.id.desc()).limit(limit + 1)
+    )).scalars().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return list(reversed(rows)), next_cursor
+
+
+async def mark_read(db: AsyncSession, user_id: int, conversation: int, up_to_message_id: int) -> int:
+    # marks every message the user received in the conversation up to and
+    # including up_to_message_id as read; returns how many changed
+    result = await db.execute(
+        update(ChatMessages)
+        .where(
+            ChatMessages.conversation_id == conversation,
+            ChatMessages.receiver_id == user_id,
+            ChatMessages.id <= up_to_message_id,
+            ChatMessages.is_read == 0
+        )
+        .values(is_read=1)
+    )
+    marked = result.rowcount
+    await db.execute(
+        update(ConversationMembers)
+        .where(ConversationMembers.conversation_id == conversation, ConversationMembers.user_id == user_id)
+        .values(
+            unread_count=case(
+                (ConversationMembers.unread_count > marked, ConversationMembers.unread_count - marked),
+                else_=0
+            ),
+            last_read_message_id=case(
+                (or_(ConversationMembers.last_read_message_id.is_(None), ConversationMembers.last_read_message_id < up_to_message_id), up_to_message_id),
+                else_=ConversationMembers.last_read_message_id
+            )
+        )
+    )
+    return marked
+
+
+async def inbox(db: AsyncSession, user_id: int, cursor: str | None, limit: int):
+    # the user's conversations, most recent first, with the other user and
+    # the last message, straight off ix_conversation_members_user_id_last_message_at
+    query = (
+        select(
+            ConversationMembers.conversation_id,
+            ConversationMembers.last_message_at,
+            ConversationMembers.unread_count,
+            Users.id.label("other_user_id"),
+            Users.username,
+            Users.fullname,
+            Users.image_key,
+            ChatMessages.id.label("last_message_id"),
+            ChatMessages.sender_id.label("last_sender_id"),
+            func.substr(ChatMessages.message, 1, 100).label("last_message")
+        )
+        .join(Users, Users.id == ConversationMembers.other_user_id)
+        .join(Conversations, Conversations.id == ConversationMembers.conversation_id)
+        .outerjoin(ChatMessages, ChatMessages.id == Conversations.last_message_id)
+        .where(ConversationMembers.user_id == user_id, ConversationMembers.last_message_at.is_not(None))
+        .order_by(ConversationMembers.last_message_at.desc(), ConversationMembers.conversation_id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(
+            tuple_(ConversationMembers.last_message_at, ConversationMembers.conversation_id) < tuple_(*decode_cursor(cursor))
+        )
+    rows = (await db.execute(query)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].last_message_at, rows[-1].conversation_id)
+    return rows, next_cursor
@@ -0,0 +1,55 @@
+import asyncio
+
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Users, Posts, Likes, Comments, Follows
+from services.tags import reconcile_tag_counts
+
+# counter column -> (model, source table, source column pointing at the row)
+COUNTERS = {
+    "posts.like_count": (Posts, Posts.like_count, Likes, Likes.post_id),
+    "posts.comment_count": (Posts, Posts.comment_count, Comments, Comments.post_id),
+    "users.post_count": (Users, Users.post_count, Posts, Posts.author_id),
+    "users.follower_count": (Users, Users.follower_count, Follows, Follows.following_id),
+    "users.following_count": (Users, Users.following_count, Follows, Follows.follower_id),
+}
+
+
+async def bump(db: AsyncSession, column, row_id: int, delta: int = 1):
+    # relative UPDATE in the caller's transaction, so concurrent writers never
+    # overwrite each other and the counter commits or rolls back with the row
+    model = column.class_
+    await db.execute(update(model).where(model.id == row_id).values({column.key: column + delta}))
+
+
+async def reconcile_counters(db: AsyncSession) -> dict[str, int]:
+    # recount every counter from its source table and fix the rows that drifted
+    # (cascading deletes, manual edits); returns rows corrected per counter
+    repaired = {}
+    for name, (model, column, source, source_column) in COUNTERS.items():
+        actual = (
+            select(func.count())
+            .select_from(source)
+            .where(source_column == model.id)
+            .scalar_subquery()
+        )
+        result = await db.execute(update(model).where(column != actual).values({column.key: actual}))
+        repaired[name] = result.rowcount
+    await db.commit()
+    repaired["tags.post_count"] = await reconcile_tag_counts(db)
+    return repaired
+
+
+async def main():
+    from database import AsyncSessionLocal, dispose_engines
+
+    async with AsyncSessionLocal() as db:
+        for name, count in (await reconcile_counters(db)).items():
+            print(f"{name}: {count} rows repaired")
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    # python -m services.counters, e.g. from a nightly cron
+    asyncio.run(main())
@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from bisect import insort
+from collections import OrderedDict
+
+from services.resp_client import RespClient
+
+# newest entries kept per home timeline
+FEED_MAX_LEN = int(os.getenv("FEED_MAX_LEN", 500))
+# materialized timelines kept by the in-memory store
+FEED_MAX_USERS = int(os.getenv("FEED_MAX_USERS", 50_000))
+# idle timelines expire from Redis and are rebuilt on the next read
+FEED_TTL = int(os.getenv("FEED_TTL", 7 * 24 * 3600))
+# seconds an in-memory timeline is served before it is rebuilt, read or not;
+# bounds how long posts fanned out by other workers stay invisible
+FEED_MEMORY_TTL = float(os.getenv("FEED_MEMORY_TTL", 60))
+
+
+# A timeline is a list of (post_id, author_id) ordered by post id, newest
+# first. Post ids are serial so they double as the sort key and the cursor.
+# A timeline that was never built (or was evicted) reads as None, which tells
+# the caller to rebuild it from the database.
+class FeedStore:
+    async def push(self, user_ids, post_id: int, author_id: int):
+        # add a post to many timelines; timelines that are not built are skipped
+        raise NotImplementedError
+
+    async def replace(self, user_id: int, entries: list[tuple[int, int]]):
+        # store a freshly built timeline
+        raise NotImplementedError
+
+    async def extend(self, user_id: int, entries: list[tuple[int, int]]):
+        # merge older or newer entries into a built timeline
+        raise NotImplementedError
+
+    async def read(self, user_id: int, before: int | None, limit: int) -> list[tuple[int, int]] | None:
+        raise NotImplementedError
+
+    async def remove_author(self, user_id: int, author_id: int):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+# Single process only. Fan-out reaches the timelines held by the worker that
+# handled the post, so with several workers a timeline built elsewhere misses
+# new posts until it is rebuilt, at most ttl seconds after it was built. Use
+# FEED_BACKEND=redis for multi-worker deployments.
+class MemoryFeedStore(FeedStore):
+    def __init__(self, max_len: int = FEED_MAX_LEN, max_users: int = FEED_MAX_USERS, ttl: float = FEED_MEMORY_TTL):
+        self.max_len = max_len
+        self.max_users = max_users
+        self.ttl = ttl
+        # user_id -> ascending list of (post_id, author_id)
+        self._feeds: OrderedDict[int, list[tuple[int, int]]] = OrderedDict()
+        # user_id -> time.monotonic() when the timeline was built
+        self._built_at: dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, user_id: int):
+        # the timeline if it is built and not past its ttl; call with the lock held
+        feed = self._feeds.get(user_id)
+        if feed is not None and time.monotonic() - self._built_at[user_id] > self.ttl:
+            del self._feeds[user_id]
+            del self._built_at[user_id]
+            return None
+        return feed
+
+    def _trim(self, feed: list):
+        if len(feed) > self.max_len:
+            del feed[:len(feed) - self.max_len]
+
+    async def push(self, user_ids, post_id, author_id):
+        with self._lock:
+            for user_id in user_ids:
+                feed = self._get(user_id)
+                if feed is None:
+                    continue
+                insort(feed, (post_id, author_id))
+                self._trim(feed)
+
+    async def replace(self, user_id, entries):
+        with self._lock:
+            self._feeds[user_id] = sorted(set(entries))[-self.max_len:]
+            self._built_at[user_id] = time.monotonic()
+            self._feeds.move_to_end(user_id)
+            while len(self._feeds) > self.max_users:
+                evicted, _ = self._feeds.popitem(last=False)
+                del self._built_at[evicted]
+
+    async def extend(self, user_id, entries):
+        with self._lock:
+            feed = self._get(user_id)
+            if feed is None:
+                return
+            feed[:] = sorted(set(feed).union(entries))
+            self._trim(feed)
+
+    async def read(self, user_id, before, limit):
+        with self._lock:
+            feed = self._get(user_id)
+            if feed is None:
+                return None
+            self._feeds.move_to_end(user_id)
+            result = []
+            for entry in reversed(feed):
+                if before is not None and entry[0] >= before:
+                    continue
+                result.append(entry)
+                if len(result) == limit:
+                    break
+            return result
+
+    async def remove_author(self, user_id, author_id):
+        with self._lock:
+            feed = self._get(user_id)
+            if feed is not None:
+                feed[:] = [entry for entry in feed if entry[1] != author_id]
+
+
+# Sorted set per user, score = post id, member = "post_id:author_id". A
+# "0:0" member with score 0 marks the timeline as built, so an empty
+# timeline is still distinguishable from a missing one.
+class RespFeedStore(FeedStore):
+    BUILT = "0:0"
+
+    def __init__(self, url: str, prefix: str = "feed", max_len: int = FEED_MAX_LEN, ttl: int = FEED_TTL):
+        self.client = RespClient(url)
+        self.prefix = prefix
+        self.max_len = max_len
+        self.ttl = ttl
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    def _add(self, key, entries):
+        # ZADD, then trim everything but the marker and the newest max_len
+        args = ["ZADD", key]
+        for post_id, author_id in entries:
+            args += [post_id, f"{post_id}:{author_id}"]
+        return [tuple(args), ("ZREMRANGEBYRANK", key, 1, -(self.max_len + 1))]
+
+    async def push(self, user_ids, post_id, author_id):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        # only timelines with the marker are updated; one round trip each way
+        built = await self.client.pipeline(*[("ZSCORE", self._key(user_id), self.BUILT) for user_id in user_ids])
+        commands = []
+        for user_id, marker in zip(user_ids, built):
+            if marker is not None:
+                commands += self._add(self._key(user_id), [(post_id, author_id)])
+        if commands:
+            await self.client.pipeline(*commands)
+
+    async def replace(self, user_id, entries):
+        key = self._key(user_id)
+        commands = [("DEL", key), ("ZADD", key, 0, self.BUILT)]
+        if entries:
+            commands += self._add(key, entries)
+        commands.append(("EXPIRE", key, self.ttl))
+        await self.client.pipeline(*commands)
+
+    async def extend(self, user_id, entries):
+        key = self._key(user_id)
+        if entries and await self.client.execute("ZSCORE", key, self.BUILT) is not None:
+            await self.client.pipeline(*self._add(key, entries))
+
+    async def read(self, user_id, before, limit):
+        key = self._key(user_id)
+        marker, members, _ = await self.client.pipeline(
+            ("ZSCORE", key, self.BUILT),
+            ("ZREVRANGEBYSCORE", key, f"({before}" if before is not None else "+inf", "(0", "LIMIT", 0, limit),
+            ("EXPIRE", key, self.ttl),
+        )
+        if marker is None:
+            return None
+        return [tuple(int(part) for part in member.split(b":")) for member in members]
+
+    async def remove_author(self, user_id, author_id):
+        key = self._key(user_id)
+        suffix = f":{author_id}".encode()
+        members = await self.client.execute("ZRANGE", key, 1, -1)
+        stale = [member for member in members or [] if member.endswith(suffix)]
+        if stale:
+            await self.client.execute("ZREM", key, *stale)
+
+    async def close(self):
+        await self.client.close()
+
+
+def create_feed_store(name: str | None = None) -> FeedStore:
+    # memory is for a single worker (and tests); redis for anything more
+    name = (name or os.getenv("FEED_BACKEND", "memory")).lower()
+    if name == "memory":
+        return MemoryFeedStore()
+    if name == "redis":
+        return RespFeedStore(os.getenv("FEED_REDIS_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown feed backend: {name}")
@@ -0,0 +1,186 @@
+import os
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select, func, and_
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Users, Follows
+from utils import encode_cursor, decode_cursor
+
+# total follow ids kept across all cached adjacency sets (~30 bytes each)
+FOLLOW_CACHE_MAX_IDS = int(os.getenv("FOLLOW_CACHE_MAX_IDS", 2_000_000))
+# users with more edges than this are never cached, membership goes to the db
+FOLLOW_CACHE_MAX_SET = int(os.getenv("FOLLOW_CACHE_MAX_SET", 50_000))
+# other workers only see a follow through their own cache expiring
+FOLLOW_CACHE_TTL = float(os.getenv("FOLLOW_CACHE_TTL", 60))
+
+# direction -> (column matching the user, column holding the other side)
+DIRECTIONS = {
+    "following": (Follows.follower_id, Follows.following_id),
+    "followers": (Follows.following_id, Follows.follower_id),
+}
+
+
+class AdjacencyCache:
+    # LRU of (direction, user_id) -> (expires_at, set of ids), bounded by the
+    # total number of ids held rather than the number of users
+    def __init__(self, max_ids: int = FOLLOW_CACHE_MAX_IDS, ttl: float = FOLLOW_CACHE_TTL):
+        self.max_ids = max_ids
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # bumped by every write so loads that raced a write are not stored
+        self.generation = 0
+        self._entries: OrderedDict[tuple[str, int], tuple[float, set[int]]] = OrderedDict()
+
+    def get(self, key: tuple[str, int]) -> set[int] | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: tuple[str, int], ids: set[int], generation: int):
+        if generation != self.generation or len(ids) > FOLLOW_CACHE_MAX_SET:
+            return
+        self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, ids)
+        self.size += len(ids)
+        while self.size > self.max_ids and self._entries:
+            self._drop(next(iter(self._entries)))
+
+    def add(self, key: tuple[str, int], other: int):
+        self.generation += 1
+        entry = self._entries.get(key)
+        if entry is not None and other not in entry[1]:
+            entry[1].add(other)
+            self.size += 1
+
+    def discard(self, key: tuple[str, int], other: int):
+        self.generation += 1
+        entry = self._entries.get(key)
+        if entry is not None and other in entry[1]:
+            entry[1].discard(other)
+            self.size -= 1
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self.size = 0
+
+    def _drop(self, key: tuple[str, int]):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def stats(self) -> dict:
+        return {"users": len(self._entries), "ids": self.size, "hits": self.hits, "misses": self.misses}
+
+
+class FollowGraph:
+    def __init__(self, cache: AdjacencyCache | None = None):
+        self.cache = cache or AdjacencyCache()
+
+    async def adjacency(self, db: AsyncSession, direction: str, user_id: int) -> set[int] | None:
+        # ids on the other side of user_id's follows, None when the user is too
+        # big to cache and callers should ask the db directly
+        key = (direction, user_id)
+        ids = self.cache.get(key)
+        if ids is not None:
+            return ids
+        generation = self.cache.generation
+        match, other = DIRECTIONS[direction]
+        rows = await db.execute(select(other).where(match == user_id).limit(FOLLOW_CACHE_MAX_SET + 1))
+        ids = set(rows.scalars())
+        if len(ids) > FOLLOW_CACHE_MAX_SET:
+            return None
+        self.cache.put(key, ids, generation)
+        return ids
+
+    async def follows(self, db: AsyncSession, follower_id: int, following_id: int) -> bool:
+        following = await self.adjacency(db, "following", follower_id)
+        if following is not None:
+            return following_id in following
+        return await db.scalar(select(Follows.id).where(
+            Follows.follower_id == follower_id, Follows.following_id == following_id
+        )) is not None
+
+    async def is_mutual(self, db: AsyncSession, user_id: int, other_id: int) -> bool:
+        # both directions answered from user_id's own sets, so a chat sender's
+        # warm cache covers every receiver; the session only connects on a miss
+        following = await self.adjacency(db, "following", user_id)
+        followers = await self.adjacency(db, "followers", user_id)
+        if following is not None and followers is not None:
+            return other_id in following and other_id in followers
+        return (
+            await self.follows(db, user_id, other_id)
+            and await self.follows(db, other_id, user_id)
+        )
+
+    def followed(self, follower_id: int, following_id: int):
+        # call after the follow row is committed
+        self.cache.add(("following", follower_id), following_id)
+        self.cache.add(("followers", following_id), follower_id)
+
+    def unfollowed(self, follower_id: int, following_id: int):
+        self.cache.discard(("following", follower_id), following_id)
+        self.cache.discard(("followers", following_id), follower_id)
+
+    async def page(self, db: AsyncSession, direction: str, user_id: int, cursor: str | None = None, limit: int = 20):
+        # followers or followees newest first, joined with their user rows in one
+        # query and paged by an opaque cursor on follows.id
+        match, other = DIRECTIONS[direction]
+        query = (
+            select(Follows.id.label("follow_id"), Users.id, Users.username, Users.fullname, Users.image_key)
+            .join(Users, Users.id == other)
+            .where(match == user_id)
+            .order_by(Follows.id.desc())
+            .limit(limit + 1)
+        )
+        if cursor:
+            (after,) = decode_cursor(cursor, int)
+            query = query.where(Follows.id < after)
+        rows = (await db.execute(query)).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].follow_id)
+        return rows, next_cursor
+
+    async def suggestions(self, db: AsyncSession, user_id: int, limit: int = 10):
+        # followees of the people user_id follows, ranked by how many of them
+        # follow each candidate, minus user_id and everyone already followed
+        mine = aliased(Follows)
+        theirs = aliased(Follows)
+        already = aliased(Follows)
+        mutuals = func.count().label("mutuals")
+        candidates = (
+            select(theirs.following_id.label("user_id"), mutuals)
+            .join(mine, and_(mine.following_id == theirs.follower_id, mine.follower_id == user_id))
+            .where(
+                theirs.following_id != user_id,
+                ~select(already.id).where(
+                    already.follower_id == user_id, already.following_id == theirs.following_id
+                ).exists()
+            )
+            .group_by(theirs.following_id)
+            .order_by(mutuals.desc(), theirs.following_id)
+            .limit(limit)
+            .subquery()
+        )
+        query = (
+            select(Users.id, Users.username, Users.fullname, Users.image_key, candidates.c.mutuals)
+            .join(candidates, candidates.c.user_id == Users.id)
+            .order_by(candidates.c.mutuals.desc(), Users.id)
+        )
+        return (await db.execute(query)).all()
+
+
+follow_graph = FollowGraph()
@@ -0,0 +1,190 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from middlewares.logger import send_log
+from models import ImageVariants
+from services.blob_store import blob_store, StoredBlob
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 80))
+# largest source image we are willing to decode
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 50_000_000))
+
+# variant name -> (max width, max height, crop to fill)
+VARIANTS = {
+    "avatar": {
+        "avatar_64": (64, 64, True),
+        "avatar_256": (256, 256, True),
+    },
+    "post": {
+        "card": (800, 450, True),
+        "full": (2048, 2048, False),
+    },
+}
+# variant handed out when a caller just wants "the" image
+DEFAULT_VARIANT = {"avatar": "avatar_256", "post": "full"}
+
+_executor = None
+stats = {"rendered": 0, "undecodable": 0, "failed": 0}
+
+
+def render_variants(source_key: str, kind: str):
+    # Runs in a worker process: decode the original once, write each variant as
+    # WebP without EXIF/ICC metadata and return (variant, blob, width, height).
+    # None when the upload is not an image Pillow can decode; storage and
+    # encoder errors are raised.
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    with blob_store.get_object(source_key)["Body"] as body:
+        data = body.read()
+    try:
+        # the bytes are in memory, so anything raised here is about the image
+        original = Image.open(io.BytesIO(data))
+        original.seek(0)  # first frame of animated images
+        original.load()
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ("RGB", "RGBA"):
+            original = original.convert("RGBA" if "transparency" in original.info or original.mode in ("LA", "PA") else "RGB")
+    except (OSError, ValueError, SyntaxError, EOFError, Image.DecompressionBombError):
+        # UnidentifiedImageError and truncated files are OSErrors
+        return None
+
+    results = []
+    for variant, (width, height, crop) in VARIANTS[kind].items():
+        if crop:
+            image = ImageOps.fit(original, (width, height), Image.LANCZOS)
+        else:
+            image = original.copy()
+            image.thumbnail((width, height), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format="WEBP", quality=IMAGE_QUALITY, method=4)
+        out.seek(0)
+        blob = blob_store.put_stream(out)
+        results.append((variant, StoredBlob(blob.key, blob.size, "image/webp"), image.width, image.height))
+    return results
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+async def process_image(db: AsyncSession, source_key: str | None, kind: str):
+    # build any missing variants for an uploaded image in the worker pool.
+    # Variants are written and committed in their own session: they only
+    # describe blobs already stored, and the caller's half-done edits must not
+    # be committed along with them
+    if not source_key:
+        return
+    existing = set((await db.execute(
+        select(ImageVariants.variant).where(ImageVariants.source_key == source_key)
+    )).scalars())
+    if existing >= set(VARIANTS[kind]):
+        # same bytes were uploaded before
+        return
+    try:
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(get_executor(), render_variants, source_key, kind)
+    except ImportError:
+        # Pillow is not installed, callers fall back to the original
+        return
+    except Exception as e:
+        # a broken worker pool, the blob store or the encoder: callers fall
+        # back to the original, but this must not go unnoticed
+        stats["failed"] += 1
+        send_log({
+            "event": "IMAGE_VARIANTS_FAILED",
+            "source_key": source_key,
+            "kind": kind,
+            "error": repr(e),
+            "timestamp": str(datetime.now(timezone.utc))
+        })
+        return
+    if results is None:
+        # not a decodable image; keep the original only
+        stats["undecodable"] += 1
+        return
+    stats["rendered"] += 1
+    rows = [
+        {"source_key": source_key, "variant": variant, "key": blob.key,
+         "content_type": blob.content_type, "width": width, "height": height}
+        for variant, blob, width, height in results
+        if variant not in existing
+    ]
+    if not rows:
+        return
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as variants_db:
+        # the same bytes uploaded twice at once: the first insert wins
+        await variants_db.execute(
+            insert(ImageVariants).values(rows)
+            .on_conflict_do_nothing(index_elements=["source_key", "variant"])
+        )
+        await variants_db.commit()
+
+
+def image_url(key: str) -> str:
+    return f"/images/{key}"
+
+
+async def variant_urls(db: AsyncSession, source_keys, kind: str) -> dict[str, dict[str, str]]:
+    # {source_key: {variant: url}} for many images in one query; variants that
+    # have not been rendered fall back to the original
+    source_keys = {key for key in source_keys if key}
+    if not source_keys:
+        return {}
+    urls = {key: {variant: image_url(key) for variant in VARIANTS[kind]} for key in source_keys}
+    rows = await db.execute(
+        select(ImageVariants.source_key, ImageVariants.variant, ImageVariants.key).where(
+            ImageVariants.source_key.in_(source_keys),
+            ImageVariants.variant.in_(VARIANTS[kind])
+        )
+    )
+    for row in rows:
+        urls[row.source_key][row.variant] = image_url(row.key)
+    return urls
+
+
+async def backfill_variants(kind: str, source_keys):
+    from database import AsyncSessionLocal
+
+    try:
+        async with AsyncSessionLocal() as db:
+            for source_key in source_keys:
+                await process_image(db, source_key, kind)
+    finally:
+        shutdown_executor()
+
+
+async def backfill_all():
+    from database import AsyncSessionLocal
+    from models import Users, Posts
+
+    async with AsyncSessionLocal() as db:
+        avatar_keys = (await db.execute(select(Users.image_key).where(Users.image_key.isnot(None)).distinct())).scalars().all()
+        post_keys = (await db.execute(select(Posts.image_key).where(Posts.image_key.isnot(None)).distinct())).scalars().all()
+    await backfill_variants("avatar", avatar_keys)
+    await backfill_variants("post", post_keys)
+
+
+if __name__ == "__main__":
+    # python -m services.images : render variants for every stored image
+    asyncio.run(backfill_all())
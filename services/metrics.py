@@ -0,0 +1,318 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# every worker writes its snapshot here; /metrics on any worker sums them all
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "blogsite_metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+# snapshots older than this belong to workers that are gone
+METRICS_STALE_SECONDS = float(os.getenv("METRICS_STALE_SECONDS", 30))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+# Label values are positional, in the order the metric declared its labels.
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def describe(self) -> dict:
+        return {"kind": self.kind, "help": self.help, "labels": list(self.labels)}
+
+    def samples(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+# Per label set: one count per bucket plus +Inf, then sum and count.
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def describe(self):
+        return {**super().describe(), "buckets": list(self.buckets)}
+
+    def observe(self, value: float, *labels):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0] * (len(self.buckets) + 3)
+            values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), list(values)] for key, values in self._values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        # callables yielding (name, kind, help, labels dict, value), read at
+        # scrape time for stats other modules already keep
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def collector(self, collect):
+        self._collectors.append(collect)
+        return collect
+
+    def snapshot(self) -> dict:
+        # JSON-ready; call on the event loop, collectors read loop-owned state
+        snapshot = {name: {**metric.describe(), "samples": metric.samples()} for name, metric in self._metrics.items()}
+        for collect in self._collectors:
+            for name, kind, help, labels, value in collect():
+                entry = snapshot.setdefault(name, {"kind": kind, "help": help, "labels": list(labels), "samples": []})
+                entry["samples"].append([[str(labels[label]) for label in entry["labels"]], value])
+        return snapshot
+
+
+def merge(snapshots: list[dict]) -> dict:
+    # sums samples with the same labels across workers: counters and
+    # histograms add up, and so do the gauges (in flight, open sockets, ...)
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target["samples"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target["samples"][key] = current + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(merged: dict) -> str:
+    # Prometheus text exposition format 0.0.4
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for labels, value in sorted(metric["samples"].items()):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_labels(metric['labels'], labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + ["+Inf"], value):
+                cumulative += count
+                le = "+Inf" if bound == "+Inf" else _number(bound)
+                bucket_labels = _labels(metric["labels"], labels, 'le="' + le + '"')
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric['labels'], labels)} {_number(value[-2])}")
+            lines.append(f"{name}_count{_labels(metric['labels'], labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+# Writes this worker's snapshot to METRICS_DIR/<pid>.json every
+# METRICS_FLUSH_SECONDS and removes it at shutdown. A worker that stops leaves
+# the totals with it (a crashed one once its file goes stale), which
+# Prometheus sees as a counter reset.
+class MetricsExporter:
+    def __init__(self, registry: Registry, directory: str = METRICS_DIR, interval: float = METRICS_FLUSH_SECONDS,
+                 stale_after: float = METRICS_STALE_SECONDS):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.stale_after = stale_after
+        self._task = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    def _write(self, snapshot: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(temporary, self.path)
+
+    def _read_others(self) -> list[dict]:
+        snapshots = []
+        own = os.path.basename(self.path)
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return snapshots
+        now = time.time()
+        for name in names:
+            if name == own or not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.stale_after:
+                    os.remove(path)
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # removed or being replaced by its worker right now
+                continue
+        return snapshots
+
+    async def flush(self):
+        snapshot = self.registry.snapshot()
+        await asyncio.to_thread(self._write, snapshot)
+
+    async def render(self) -> str:
+        # this worker live, the others as of their last flush
+        snapshot = self.registry.snapshot()
+        others = await asyncio.to_thread(self._read_others)
+        return render(merge([snapshot] + others))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.flush()
+            except OSError:
+                pass
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# queries run on behalf of the current request, see MetricsMiddleware
+class RequestStats:
+    __slots__ = ("queries", "query_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+registry = Registry()
+exporter = MetricsExporter(registry)
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route and status", ("router", "method", "route", "status"))
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency, body included", ("router", "method", "route"))
+http_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests being handled")
+http_request_queries = registry.histogram(
+    "http_request_db_queries", "Database queries per HTTP request", ("router", "route"), QUERY_COUNT_BUCKETS)
+http_request_query_seconds = registry.counter(
+    "http_request_db_seconds_total", "Time HTTP requests spent waiting on queries", ("router", "route"))
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "Database query latency by engine", ("engine",), QUERY_DURATION_BUCKETS)
+db_query_errors = registry.counter("db_query_errors_total", "Failed database queries by engine", ("engine",))
+websocket_sessions = registry.counter("websocket_sessions_total", "WebSocket sessions by route", ("route",))
+websocket_open = registry.gauge("websocket_sessions_open", "WebSocket sessions currently open")
+rate_limit_decisions = registry.counter(
+    "rate_limit_decisions_total", "Rate limiter outcomes by rule", ("rule", "outcome"))
+
+
+def instrument_engine(sync_engine, name: str):
+    # start times are a stack in conn.info, a failed query pops its own
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def query_started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def query_finished(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_query_duration.observe(elapsed, name)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def query_failed(context):
+        db_query_errors.inc(name)
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
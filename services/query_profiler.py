@@ -0,0 +1,159 @@
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# development only: records every statement of every request
+QUERY_PROFILER = os.getenv("QUERY_PROFILER", "false").lower() == "true"
+# a fingerprint run this many times in one request is flagged as a likely N+1
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", 5))
+# profiles kept for /debug/queries
+QUERY_PROFILES_KEPT = int(os.getenv("QUERY_PROFILES_KEPT", 200))
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    # psycopg2 %(name)s, asyncpg $1, sqlite ? and :name
+    (re.compile(r"%\(\w+\)s|%s|\$\d+|(?<!:):\w+"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def fingerprint(statement: str) -> str:
+    # the statement with literals and bind parameters replaced, so the same
+    # query run for different ids (or IN lists of any length) compares equal
+    for pattern, replacement in _LITERALS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+class QueryProfile:
+    def __init__(self, label: str = "", repeat_threshold: int = QUERY_REPEAT_THRESHOLD):
+        self.label = label
+        self.repeat_threshold = repeat_threshold
+        # (fingerprint, statement, seconds) in execution order
+        self.queries: list[tuple[str, str, float]] = []
+
+    def record(self, statement: str, seconds: float):
+        self.queries.append((fingerprint(statement), statement, seconds))
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def seconds(self) -> float:
+        return sum(seconds for _, _, seconds in self.queries)
+
+    def repeated(self) -> dict[str, int]:
+        # fingerprints run at least repeat_threshold times, most frequent first
+        counts = Counter(fp for fp, _, _ in self.queries)
+        return {fp: n for fp, n in counts.most_common() if n >= self.repeat_threshold}
+
+    def to_dict(self) -> dict:
+        counts = Counter(fp for fp, _, _ in self.queries)
+        return {
+            "label": self.label,
+            "count": self.count,
+            "total_ms": round(self.seconds * 1000, 3),
+            "repeated": self.repeated(),
+            "fingerprints": [
+                {"fingerprint": fp, "count": n, "total_ms": round(sum(s for f, _, s in self.queries if f == fp) * 1000, 3)}
+                for fp, n in counts.most_common()
+            ],
+            "queries": [{"statement": statement, "ms": round(seconds * 1000, 3)} for _, statement, seconds in self.queries],
+        }
+
+    def summary(self) -> str:
+        lines = [f"{self.count} queries in {self.seconds * 1000:.1f} ms{' for ' + self.label if self.label else ''}"]
+        for fp, n in Counter(fp for fp, _, _ in self.queries).most_common():
+            flag = "  <- repeated" if n >= self.repeat_threshold else ""
+            lines.append(f"  {n:>4} x {fp[:200]}{flag}")
+        return "\n".join(lines)
+
+
+current_profile: ContextVar[QueryProfile | None] = ContextVar("query_profile", default=None)
+
+
+# finished request profiles by request id, newest last
+class RecentProfiles:
+    def __init__(self, max_size: int = QUERY_PROFILES_KEPT):
+        self.max_size = max_size
+        self._profiles: OrderedDict[str, QueryProfile] = OrderedDict()
+
+    def add(self, request_id: str, profile: QueryProfile):
+        self._profiles[request_id] = profile
+        while len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
+
+    def get(self, request_id: str | None) -> QueryProfile | None:
+        return self._profiles.get(request_id) if request_id else None
+
+    def items(self):
+        return list(self._profiles.items())
+
+
+recent_profiles = RecentProfiles()
+
+
+def profile_engine(sync_engine):
+    # only attached with QUERY_PROFILER on; the statement is what the driver
+    # receives, after IN lists are expanded
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def profiled_query_started(conn, cursor, statement, parameters, context, executemany):
+        if current_profile.get() is not None:
+            conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def profiled_query_finished(conn, cursor, statement, parameters, context, executemany):
+        profile = current_profile.get()
+        started = conn.info.get("profile_started")
+        if profile is not None and started:
+            profile.record(statement, time.perf_counter() - started.pop())
+
+    @event.listens_for(sync_engine, "handle_error")
+    def profiled_query_failed(context):
+        if context.connection is not None and context.connection.info.get("profile_started"):
+            context.connection.info["profile_started"].pop()
+
+
+@contextmanager
+def profile_queries(label: str = ""):
+    # profiles whatever runs inside the block on this task (service calls,
+    # scripts); requests are profiled by QueryProfilerMiddleware
+    profile = QueryProfile(label)
+    token = current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_profile.reset(token)
+
+
+@contextmanager
+def max_queries(limit: int, label: str = ""):
+    #   with max_queries(3):
+    #       await get_feed(...)
+    with profile_queries(label) as profile:
+        yield profile
+    if profile.count > limit:
+        raise AssertionError(f"expected at most {limit} queries, got {profile.summary()}")
+
+
+def assert_max_queries(response, limit: int):
+    # for tests calling the app (TestClient, httpx) with QUERY_PROFILER=true;
+    # the profile comes from the X-Query-Count header and the request id
+    from middlewares.settings import REQUEST_ID_HEADER
+
+    if "X-Query-Count" not in response.headers:
+        raise AssertionError("no X-Query-Count header: run the app with QUERY_PROFILER=true")
+    count = int(response.headers["X-Query-Count"])
+    if count > limit:
+        profile = recent_profiles.get(response.headers.get(REQUEST_ID_HEADER))
+        detail = profile.summary() if profile is not None else f"{count} queries"
+        raise AssertionError(f"expected at most {limit} queries, got {detail}")
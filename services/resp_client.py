@@ -0,0 +1,130 @@
+import asyncio
+import os
+from urllib.parse import urlparse
+
+# seconds a command (connecting and waiting for the lock included) may take
+# before the caller gets a TimeoutError
+RESP_TIMEOUT = float(os.getenv("RESP_TIMEOUT", 1.0))
+
+
+# Minimal async client for the Redis wire protocol (RESP2). It only relies on
+# plain commands so any Redis-compatible server or local stand-in can serve it.
+class RespError(Exception):
+    pass
+
+
+def encode_command(*args) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        else:
+            data = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode()
+    if prefix == b"-":
+        raise RespError(body.decode())
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length == -1:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if prefix == b"*":
+        length = int(body)
+        if length == -1:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    # out of sync with the server, the connection has to go
+    raise ConnectionError(f"Unknown reply type: {line!r}")
+
+
+class RespClient:
+    def __init__(self, url: str = "redis://localhost:6379/0", timeout: float = RESP_TIMEOUT):
+        parsed = urlparse(url)
+        self.timeout = timeout
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._send([("AUTH", self.password)])
+        if self.db:
+            await self._send([("SELECT", self.db)])
+
+    async def _send(self, commands):
+        self._writer.write(b"".join(encode_command(*command) for command in commands))
+        await self._writer.drain()
+        replies = []
+        error = None
+        for _ in commands:
+            try:
+                replies.append(await read_reply(self._reader))
+            except RespError as e:
+                # keep reading so the connection stays in sync
+                error = error or e
+                replies.append(None)
+        if error:
+            raise error
+        return replies
+
+    async def pipeline(self, *commands):
+        # send several commands in one round trip and return all replies
+        return await asyncio.wait_for(self._pipeline(commands), self.timeout)
+
+    async def _pipeline(self, commands):
+        async with self._lock:
+            if self._writer is None:
+                try:
+                    await self._connect()
+                except BaseException:
+                    # a failed AUTH or SELECT must not leave a half set up connection
+                    self._reset()
+                    raise
+            try:
+                return await self._send(commands)
+            except RespError:
+                # error replies are read in full, the connection is still in sync
+                raise
+            except BaseException:
+                # anything else (timeout, cancellation, broken socket) may
+                # leave replies unread: never reuse this connection
+                self._reset()
+                raise
+
+    async def execute(self, *args):
+        replies = await self.pipeline(args)
+        return replies[0]
+
+    def _reset(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self._reader = None
+        self._writer = None
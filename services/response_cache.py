@@ -0,0 +1,259 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import NamedTuple
+
+from fastapi.encoders import jsonable_encoder
+
+from services.resp_client import RespClient, RespError
+
+# seconds a cached response is served as fresh
+CACHE_TTL = float(os.getenv("CACHE_TTL", 30))
+# extra seconds it may be served stale while one request refreshes it
+CACHE_STALE_TTL = float(os.getenv("CACHE_STALE_TTL", 60))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10_000))
+# tag versions kept by the memory backend
+CACHE_MAX_TAGS = int(os.getenv("CACHE_MAX_TAGS", 100_000))
+# seconds after an invalidation during which a tag's entries are recomputed on
+# the primary, so a lagging replica cannot put the pre-write result back
+CACHE_REPLICA_LAG = float(os.getenv("CACHE_REPLICA_LAG", 5))
+# a backend failing with any of these is bypassed, never turned into a 500:
+# unreachable, timed out, or answering with an error reply (OOM, READONLY, ...)
+BACKEND_ERRORS = (ConnectionError, OSError, RespError, asyncio.TimeoutError, asyncio.IncompleteReadError)
+
+
+class CacheEntry(NamedTuple):
+    fresh_until: float
+    stale_until: float
+    # tag versions the value was computed against
+    versions: list[int]
+    value: object
+
+
+# Entries are invalidated by tag ("post:12", "comments:12", "posts"): a write
+# bumps the tag's version and every entry computed against an older version
+# is treated as missing, in every process sharing the backend.
+class CacheBackend:
+    async def get(self, key: str, tags: list[str]) -> tuple[CacheEntry | None, list[int], bool]:
+        # the entry (if any), the current versions of its tags and whether one
+        # of them was invalidated within the last CACHE_REPLICA_LAG seconds
+        raise NotImplementedError
+
+    async def set(self, key: str, entry: CacheEntry):
+        raise NotImplementedError
+
+    async def invalidate(self, tags: list[str]):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+# Tag versions are an LRU bounded by max_tags. Every bump takes the next value
+# of one counter, and a tag that is not tracked reads as the highest version
+# evicted so far: an entry computed against an evicted tag still matches only
+# if nothing was written since, and a forgotten tag never repeats a version.
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_tags: int = CACHE_MAX_TAGS,
+                 replica_lag: float = CACHE_REPLICA_LAG):
+        self.max_entries = max_entries
+        self.max_tags = max_tags
+        self.replica_lag = replica_lag
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        # tag -> (version, invalidated at)
+        self._versions: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._clock = 0
+        self._evicted = 0
+        self._lock = threading.Lock()
+
+    async def get(self, key, tags):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            versions, recent = [], False
+            for tag in tags:
+                version, invalidated_at = self._versions.get(tag, (self._evicted, 0.0))
+                if tag in self._versions:
+                    self._versions.move_to_end(tag)
+                versions.append(version)
+                recent = recent or now - invalidated_at < self.replica_lag
+            return entry, versions, recent
+
+    async def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def invalidate(self, tags):
+        now = time.time()
+        with self._lock:
+            for tag in tags:
+                self._clock += 1
+                self._versions[tag] = (self._clock, now)
+                self._versions.move_to_end(tag)
+            while len(self._versions) > self.max_tags:
+                _, (version, _) = self._versions.popitem(last=False)
+                self._evicted = max(self._evicted, version)
+
+
+# Values are JSON under "<prefix>:v:<key>" with a PX expiry at stale_until,
+# tag versions are plain counters under "<prefix>:t:<tag>", and a freshly
+# invalidated tag has "<prefix>:r:<tag>" set for replica_lag seconds.
+class RespCacheBackend(CacheBackend):
+    def __init__(self, url: str, prefix: str = "cache", replica_lag: float = CACHE_REPLICA_LAG):
+        self.client = RespClient(url)
+        self.prefix = prefix
+        self.replica_lag = replica_lag
+
+    async def get(self, key, tags):
+        replies = await self.client.pipeline(
+            ("GET", f"{self.prefix}:v:{key}"),
+            *[("GET", f"{self.prefix}:t:{tag}") for tag in tags],
+            *[("GET", f"{self.prefix}:r:{tag}") for tag in tags]
+        )
+        raw = replies[0]
+        versions = [int(version or 0) for version in replies[1:len(tags) + 1]]
+        recent = any(flag is not None for flag in replies[len(tags) + 1:])
+        if raw is None:
+            return None, versions, recent
+        return CacheEntry(*json.loads(raw)), versions, recent
+
+    async def set(self, key, entry):
+        ttl_ms = max(int((entry.stale_until - time.time()) * 1000), 1)
+        await self.client.execute("SET", f"{self.prefix}:v:{key}", json.dumps(entry, separators=(",", ":")), "PX", ttl_ms)
+
+    async def invalidate(self, tags):
+        if tags:
+            lag_ms = max(int(self.replica_lag * 1000), 1)
+            await self.client.pipeline(*[
+                command
+                for tag in tags
+                for command in (("INCR", f"{self.prefix}:t:{tag}"), ("SET", f"{self.prefix}:r:{tag}", "1", "PX", lag_ms))
+            ])
+
+    async def close(self):
+        await self.client.close()
+
+
+def create_cache_backend(name: str | None = None) -> CacheBackend:
+    name = (name or os.getenv("CACHE_BACKEND", "memory")).lower()
+    if name == "memory":
+        return MemoryCacheBackend()
+    if name == "redis":
+        return RespCacheBackend(os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown cache backend: {name}")
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend | None = None):
+        self.backend = backend or create_cache_backend()
+        # per key, the in-flight computation concurrent misses wait on
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._refreshing: set[str] = set()
+        self.stats = defaultdict(lambda: defaultdict(int))
+        self.invalidations = defaultdict(int)
+
+    async def cached(self, name: str, key: str, tags: list[str], compute, db, ttl: float = CACHE_TTL, stale_ttl: float = CACHE_STALE_TTL):
+        # JSON-ready result of compute(db), served from the cache when the
+        # entry is fresh; a stale entry is returned while one background task
+        # recomputes it with its own read session. Right after one of the tags
+        # was invalidated, both run on the primary instead of db, which may be
+        # a replica that has not applied the write yet
+        key = f"{name}:{key}"
+        stats = self.stats[name]
+        try:
+            entry, versions, recent = await self.backend.get(key, tags)
+        except BACKEND_ERRORS:
+            stats["errors"] += 1
+            return jsonable_encoder(await compute(db))
+        now = time.time()
+        if entry is not None and entry.versions == versions:
+            if now < entry.fresh_until:
+                stats["hits"] += 1
+                return entry.value
+            if now < entry.stale_until:
+                stats["stale"] += 1
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    asyncio.create_task(self._refresh(name, key, tags, compute, versions, ttl, stale_ttl, recent))
+                return entry.value
+        stats["misses"] += 1
+        if recent:
+            from database import AsyncSessionLocal
+
+            stats["primary"] += 1
+            async with AsyncSessionLocal() as primary:
+                return await self._compute(name, key, tags, compute, primary, versions, ttl, stale_ttl)
+        return await self._compute(name, key, tags, compute, db, versions, ttl, stale_ttl)
+
+    async def _compute(self, name, key, tags, compute, db, versions, ttl, stale_ttl):
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats[name]["coalesced"] += 1
+            return await asyncio.shield(inflight)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = jsonable_encoder(await compute(db))
+            # versions read before computing: a write that lands meanwhile
+            # leaves this entry already outdated
+            now = time.time()
+            try:
+                await self.backend.set(key, CacheEntry(now + ttl, now + ttl + stale_ttl, versions, value))
+            except BACKEND_ERRORS:
+                self.stats[name]["errors"] += 1
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # mark retrieved so an error nobody waited on is not logged
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _refresh(self, name, key, tags, compute, versions, ttl, stale_ttl, recent=False):
+        from database import AsyncSessionLocal, read_session
+
+        try:
+            async with (AsyncSessionLocal() if recent else read_session()) as db:
+                await self._compute(name, key, tags, compute, db, versions, ttl, stale_ttl)
+            self.stats[name]["refreshes"] += 1
+        except Exception:
+            self.stats[name]["refresh_errors"] += 1
+        finally:
+            self._refreshing.discard(key)
+
+    async def invalidate(self, *tags: str):
+        # call after the write is committed
+        try:
+            await self.backend.invalidate(list(tags))
+        except BACKEND_ERRORS:
+            # entries age out after CACHE_TTL + CACHE_STALE_TTL at worst
+            self.invalidations["errors"] += 1
+            return
+        self.invalidations["tags"] += len(tags)
+
+    def metrics(self) -> dict:
+        # misses include the coalesced ones, which waited on another request's query
+        metrics = {}
+        for name, stats in self.stats.items():
+            metrics[name] = dict(stats)
+            served = stats.get("hits", 0) + stats.get("stale", 0)
+            lookups = served + stats.get("misses", 0)
+            if lookups:
+                metrics[name]["hit_ratio"] = round(served / lookups, 4)
+        return {"endpoints": metrics, "invalidations": dict(self.invalidations)}
+
+    async def close(self):
+        await self.backend.close()
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import html
+import math
+import re
+import threading
+from collections import defaultdict
+
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Posts, Comments, Users
+
+SEARCH_CONFIG = "english"
+# ts_headline marks matches with control characters; the text is escaped
+# before they become <b></b>, see safe_headline
+HEADLINE_START, HEADLINE_STOP = "\x02", "\x03"
+HEADLINE_OPTIONS = f"MaxFragments=2, MaxWords=20, MinWords=5, StartSel={HEADLINE_START}, StopSel={HEADLINE_STOP}"
+
+# what each searchable type indexes: (model, weighted text columns)
+SEARCH_TYPES = {
+    "posts": (Posts, (("title", 2.0), ("content", 1.0))),
+    "comments": (Comments, (("content", 1.0),)),
+}
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for if in into is it no not of on or such that the their then "
+    "there these they this to was will with".split()
+)
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+PUNCTUATION = ".,!?;:'\"()[]"
+
+
+def stem(token: str) -> str:
+    # light suffix stripping, close enough to match "posts"/"post", "running"/"run"
+    for suffix in ("ingly", "edly", "ing", "ies", "ed", "es", "ly", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = token[: -len(suffix)]
+            if suffix == "ies":
+                token += "y"
+            elif suffix == "ing" and len(token) > 3 and token[-1] == token[-2]:
+                token = token[:-1]
+            break
+    return token
+
+
+def tokenize(text: str | None) -> list[str]:
+    return [stem(token) for token in TOKEN_RE.findall((text or "").lower()) if token not in STOP_WORDS]
+
+
+def safe_headline(headline: str) -> str:
+    # post text is user input: escape it, then turn the markers into <b></b>
+    return html.escape(headline).replace(HEADLINE_START, "<b>").replace(HEADLINE_STOP, "</b>")
+
+
+def highlight(text: str | None, terms: set[str], width: int = 20) -> str:
+    # a window of `width` words around the first match, matches wrapped in
+    # <b>; the words themselves are HTML-escaped
+    words = (text or "").split()
+    matches = [stem(word.lower().strip(PUNCTUATION)) in terms for word in words]
+    first = matches.index(True) if True in matches else 0
+    start = max(first - width // 4, 0)
+    window = zip(words[start:start + width], matches[start:start + width])
+    snippet = " ".join(f"<b>{html.escape(word)}</b>" if matched else html.escape(word) for word, matched in window)
+    return ("... " if start else "") + snippet + (" ..." if start + width < len(words) else "")
+
+
+# In-process inverted index with BM25 ranking, for databases without tsvector
+# (SQLite, tests). Documents are (type, id); updates are incremental.
+class InvertedIndex:
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings: dict[str, dict[int, float]] = defaultdict(dict)
+        self.doc_terms: dict[int, dict[str, float]] = {}
+        self.doc_lengths: dict[int, float] = {}
+        self.total_length = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, doc_id: int, fields: list[tuple[str | None, float]]):
+        terms: dict[str, float] = defaultdict(float)
+        for text, weight in fields:
+            for token in tokenize(text):
+                terms[token] += weight
+        with self._lock:
+            self._remove(doc_id)
+            for term, frequency in terms.items():
+                self.postings[term][doc_id] = frequency
+            self.doc_terms[doc_id] = terms
+            self.doc_lengths[doc_id] = sum(terms.values())
+            self.total_length += self.doc_lengths[doc_id]
+
+    def remove(self, doc_id: int):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: int):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> list[tuple[int, float]]:
+        # every query term must match (AND), ranked by BM25
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            postings = [self.postings.get(term) for term in terms]
+            if not all(postings):
+                return []
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+                if not candidates:
+                    return []
+            total_docs = len(self.doc_lengths)
+            average_length = self.total_length / total_docs if total_docs else 0
+            scores = {}
+            for doc_id in candidates:
+                length_norm = self.K1 * (1 - self.B + self.B * self.doc_lengths[doc_id] / (average_length or 1))
+                score = 0.0
+                for posting in postings:
+                    frequency = posting[doc_id]
+                    idf = math.log(1 + (total_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                    score += idf * frequency * (self.K1 + 1) / (frequency + length_norm)
+                scores[doc_id] = score
+        ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return ranked[offset:]
+
+
+_local_indexes: dict[str, InvertedIndex] = {}
+_local_lock = asyncio.Lock()
+
+
+def uses_tsvector(db: AsyncSession) -> bool:
+    return db.bind.dialect.name == "postgresql"
+
+
+def _fields(row, columns):
+    return [(getattr(row, name), weight) for name, weight in columns]
+
+
+async def local_index(db: AsyncSession, search_type: str) -> InvertedIndex:
+    # built from the table on first use, then kept current by index_document
+    async with _local_lock:
+        index = _local_indexes.get(search_type)
+        if index is None:
+            model, columns = SEARCH_TYPES[search_type]
+            rows = (await db.execute(select(model.id, *[getattr(model, name) for name, _ in columns]))).all()
+
+            def build():
+                index = InvertedIndex()
+                for row in rows:
+                    index.add(row.id, _fields(row, columns))
+                return index
+
+            index = await asyncio.to_thread(build)
+            _local_indexes[search_type] = index
+    return index
+
+
+def index_document(db: AsyncSession, search_type: str, document):
+    # call after writing a post/comment; Postgres maintains its own tsvector
+    if uses_tsvector(db) or search_type not in _local_indexes:
+        return
+    _, columns = SEARCH_TYPES[search_type]
+    _local_indexes[search_type].add(document.id, _fields(document, columns))
+
+
+async def search(db: AsyncSession, search_type: str, query: str, limit: int = 20, offset: int = 0) -> list[dict]:
+    model, columns = SEARCH_TYPES[search_type]
+    text_column = getattr(model, columns[-1][0])
+    if uses_tsvector(db):
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+        vector = literal_column(f"{model.__tablename__}.search_vector")
+        rank = func.ts_rank_cd(vector, tsquery)
+        # rank and page first, build snippets only for the rows returned
+        page = (
+            select(model.id.label("id"), rank.label("rank"))
+            .where(vector.op("@@")(tsquery))
+            .order_by(rank.desc(), model.id.desc())
+            .offset(offset)
+            .limit(limit)
+            .subquery()
+        )
+        snippet = func.ts_headline(SEARCH_CONFIG, text_column, tsquery, HEADLINE_OPTIONS)
+        hits = {
+            row.id: (row.rank, safe_headline(row.snippet) if row.snippet is not None else None)
+            for row in await db.execute(
+                select(page.c.id, page.c.rank, snippet.label("snippet")).join(model, model.id == page.c.id)
+            )
+        }
+    else:
+        terms = set(tokenize(query))
+        ranked = (await local_index(db, search_type)).search(query, limit, offset)
+        hits = {doc_id: (score, None) for doc_id, score in ranked}
+    if not hits:
+        return []
+
+    extra = [model.title] if search_type == "posts" else [model.post_id]
+    rows = await db.execute(
+        select(model.id, model.created_at, text_column.label("text"), Users.id.label("author_id"), Users.username.label("author_username"), *extra)
+        .outerjoin(Users, Users.id == model.author_id)
+        .where(model.id.in_(hits))
+    )
+    results = []
+    for row in rows:
+        rank, snippet = hits[row.id]
+        result = {
+            "id": row.id,
+            "rank": round(float(rank), 6),
+            "snippet": snippet if snippet is not None else highlight(row.text, terms),
+            "created_at": row.created_at,
+            "author": {"id": row.author_id, "username": row.author_username},
+        }
+        if search_type == "posts":
+            result["title"] = row.title
+        else:
+            result["post_id"] = row.post_id
+        results.append(result)
+    results.sort(key=lambda result: (-result["rank"], -result["id"]))
+    return results
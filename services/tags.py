@@ -0,0 +1,67 @@
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Tags, PostTags
+
+DEFAULT_TAG = "Other"
+
+
+def normalize_tags(raw: str | None) -> dict[str, str]:
+    # "Health, culture,health" -> {"health": "Health", "culture": "culture"}
+    tags = {}
+    for name in (raw or "").split(","):
+        name = name.strip()
+        if name and name.lower() not in tags:
+            tags[name.lower()] = name
+    return tags or {DEFAULT_TAG.lower(): DEFAULT_TAG}
+
+
+async def get_or_create_tags(db: AsyncSession, tags: dict[str, str]) -> dict[str, int]:
+    # slug -> tag id, creating missing tags without racing on the unique slug
+    await db.execute(
+        insert(Tags)
+        .values([{"slug": slug, "name": name, "post_count": 0} for slug, name in tags.items()])
+        .on_conflict_do_nothing(index_elements=["slug"])
+    )
+    rows = (await db.execute(select(Tags.id, Tags.slug).where(Tags.slug.in_(tags)))).all()
+    return {row.slug: row.id for row in rows}
+
+
+async def attach_tags(db: AsyncSession, post_id: int, raw: str | None) -> str:
+    # link a post to its tags and bump the counters in the same transaction;
+    # returns the display string stored on the post
+    tags = normalize_tags(raw)
+    tag_ids = list((await get_or_create_tags(db, tags)).values())
+    await db.execute(
+        insert(PostTags)
+        .values([{"post_id": post_id, "tag_id": tag_id} for tag_id in tag_ids])
+        .on_conflict_do_nothing()
+    )
+    await db.execute(update(Tags).where(Tags.id.in_(tag_ids)).values(post_count=Tags.post_count + 1))
+    return ",".join(tags.values())
+
+
+def tag_filter(PostsModel, raw: str):
+    # EXISTS on post_tags for any of the given tags, served by (tag_id, post_id)
+    slugs = list(normalize_tags(raw))
+    return (
+        select(PostTags.post_id)
+        .join(Tags, Tags.id == PostTags.tag_id)
+        .where(Tags.slug.in_(slugs), PostTags.post_id == PostsModel.id)
+        .exists()
+    )
+
+
+async def reconcile_tag_counts(db: AsyncSession) -> int:
+    # repair post_count drift (e.g. posts removed by cascading user deletes);
+    # returns the number of tags that were corrected
+    actual = (
+        select(func.count())
+        .select_from(PostTags)
+        .where(PostTags.tag_id == Tags.id)
+        .scalar_subquery()
+    )
+    result = await db.execute(update(Tags).where(Tags.post_count != actual).values(post_count=actual))
+    await db.commit()
+    return result.rowcount
@@ -0,0 +1,162 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from middlewares.logger import send_log
+from models import Users, Posts, Follows
+from services.feed_store import create_feed_store, FEED_MAX_LEN
+from services.resp_client import RespError
+
+# authors with more followers than this are not fanned out on write; their
+# posts are merged into each reader's timeline at read time instead
+FEED_FANOUT_MAX_FOLLOWERS = int(os.getenv("FEED_FANOUT_MAX_FOLLOWERS", 10_000))
+# posts of a newly followed author copied into the follower's timeline
+FEED_BACKFILL = int(os.getenv("FEED_BACKFILL", 50))
+# followers loaded per query while fanning out
+FANOUT_BATCH = 1000
+
+# the store is a cache of what the database already has: when it fails,
+# reads are built from the database and writes are skipped, like the rate
+# limiter and the response cache
+FEED_STORE_ERRORS = (ConnectionError, OSError, RespError, asyncio.TimeoutError, asyncio.IncompleteReadError)
+
+feed_store = create_feed_store()
+stats = {"store_errors": 0}
+
+
+def _store_failed(operation: str, error: Exception):
+    stats["store_errors"] += 1
+    send_log({
+        "event": "FEED_STORE_ERROR",
+        "operation": operation,
+        "error": repr(error),
+        "timestamp": str(datetime.now(timezone.utc))
+    })
+
+
+def is_celebrity(follower_count: int | None) -> bool:
+    return (follower_count or 0) > FEED_FANOUT_MAX_FOLLOWERS
+
+
+async def fan_out(db: AsyncSession, author_id: int, post_id: int):
+    # push a new post into the timelines of the author's followers
+    follower_count = await db.scalar(select(Users.follower_count).where(Users.id == author_id))
+    if is_celebrity(follower_count):
+        return
+    last_id = 0
+    while True:
+        rows = (await db.execute(
+            select(Follows.id, Follows.follower_id)
+            .where(Follows.following_id == author_id, Follows.id > last_id)
+            .order_by(Follows.id)
+            .limit(FANOUT_BATCH)
+        )).all()
+        if not rows:
+            break
+        await feed_store.push([row.follower_id for row in rows], post_id, author_id)
+        last_id = rows[-1].id
+    # the author sees their own post too
+    await feed_store.push([author_id], post_id, author_id)
+
+
+async def build(db: AsyncSession, user_id: int, cache: bool = True) -> list[tuple[int, int]]:
+    # newest posts of every followed non-celebrity author (and the user's own)
+    followed = select(Follows.following_id).where(Follows.follower_id == user_id)
+    rows = (await db.execute(
+        select(Posts.id, Posts.author_id)
+        .join(Users, Users.id == Posts.author_id)
+        .where(
+            (Posts.author_id.in_(followed) & (Users.follower_count <= FEED_FANOUT_MAX_FOLLOWERS))
+            | (Posts.author_id == user_id)
+        )
+        .order_by(Posts.id.desc())
+        .limit(FEED_MAX_LEN)
+    )).all()
+    entries = [(row.id, row.author_id) for row in rows]
+    if cache:
+        try:
+            await feed_store.replace(user_id, entries)
+        except FEED_STORE_ERRORS as e:
+            _store_failed("replace", e)
+    return entries
+
+
+async def celebrity_posts(db: AsyncSession, user_id: int, before: int | None, limit: int) -> list[tuple[int, int]]:
+    # pull side of the hybrid: recent posts of followed high-follower authors
+    celebrities = (
+        select(Follows.following_id)
+        .join(Users, Users.id == Follows.following_id)
+        .where(Follows.follower_id == user_id, Users.follower_count > FEED_FANOUT_MAX_FOLLOWERS)
+    )
+    query = select(Posts.id, Posts.author_id).where(Posts.author_id.in_(celebrities))
+    if before is not None:
+        query = query.where(Posts.id < before)
+    rows = await db.execute(query.order_by(Posts.id.desc()).limit(limit))
+    return [(row.id, row.author_id) for row in rows]
+
+
+async def read(db: AsyncSession, user_id: int, before: int | None, limit: int) -> list[int]:
+    # post ids of one timeline page, newest first
+    try:
+        entries = await feed_store.read(user_id, before, limit)
+        cache = True
+    except FEED_STORE_ERRORS as e:
+        # served from the database without waiting on the store again
+        _store_failed("read", e)
+        entries, cache = None, False
+    if entries is None:
+        built = await build(db, user_id, cache)
+        entries = [entry for entry in built if before is None or entry[0] < before][:limit]
+    merged = set(entries) | set(await celebrity_posts(db, user_id, before, limit))
+    return [post_id for post_id, _ in sorted(merged, reverse=True)[:limit]]
+
+
+async def followed(db: AsyncSession, follower_id: int, following_id: int):
+    # backfill the new author's recent posts into the follower's timeline
+    follower_count = await db.scalar(select(Users.follower_count).where(Users.id == following_id))
+    if is_celebrity(follower_count):
+        return
+    rows = await db.execute(
+        select(Posts.id, Posts.author_id)
+        .where(Posts.author_id == following_id)
+        .order_by(Posts.id.desc())
+        .limit(FEED_BACKFILL)
+    )
+    await feed_store.extend(follower_id, [(row.id, row.author_id) for row in rows])
+
+
+async def unfollowed(follower_id: int, following_id: int):
+    await feed_store.remove_author(follower_id, following_id)
+
+
+# entry points for BackgroundTasks, which run after the response with their own
+# session; a store failure there is logged and counted, the follow or post
+# itself is already committed
+async def fan_out_task(author_id: int, post_id: int):
+    from database import AsyncSessionLocal
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await fan_out(db, author_id, post_id)
+    except FEED_STORE_ERRORS as e:
+        _store_failed("fan_out", e)
+
+
+async def followed_task(follower_id: int, following_id: int):
+    from database import AsyncSessionLocal
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await followed(db, follower_id, following_id)
+    except FEED_STORE_ERRORS as e:
+        _store_failed("followed", e)
+
+
+async def unfollowed_task(follower_id: int, following_id: int):
+    try:
+        await unfollowed(follower_id, following_id)
+    except FEED_STORE_ERRORS as e:
+        _store_failed("unfollowed", e)
@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# a throwaway SQLite database, set before anything imports database.py
+_tmp = tempfile.mkdtemp(prefix="blogsite-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ["LOG_SINK"] = "memory"
+os.environ["METRICS_DIR"] = os.path.join(_tmp, "metrics")
+os.environ["BLOB_ROOT"] = os.path.join(_tmp, "blobs")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from models import Users, Follows  # noqa: E402
+from services import auth_services  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def make_user():
+    # a user row plus the Authorization header for it
+    def make(username: str):
+        with SessionLocal() as db:
+            user = Users(username=username, email=f"{username}@example.com", fullname=username, role="user", password="x")
+            db.add(user)
+            db.commit()
+            token = auth_services.create_access_token(user.username, user.id, user.role)
+            return user.id, {"Authorization": f"Bearer {token}"}
+    return make
+
+
+@pytest.fixture
+def follow():
+    def make(follower_id: int, following_id: int):
+        with SessionLocal() as db:
+            db.add(Follows(follower_id=follower_id, following_id=following_id))
+            db.commit()
+    return make
+
+
+@pytest.fixture
+def make_post():
+    def make(author_id: int, title: str = "a post"):
+        from models import Posts
+
+        with SessionLocal() as db:
+            post = Posts(title=title, content="content", author_id=author_id)
+            db.add(post)
+            db.commit()
+            return post.id
+    return make
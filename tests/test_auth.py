@@ -0,0 +1,31 @@
+from database import SessionLocal
+from models import Users
+from services import auth_services
+
+
+def login(client, username: str):
+    with SessionLocal() as db:
+        db.add(Users(username=username, email=f"{username}@example.com", fullname=username, role="user",
+                     password=auth_services.bcrypt_context.hash("secret")))
+        db.commit()
+    response = client.post("/users/login", data={"username": username, "password": "secret"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_refresh_token_reuse_revokes_the_family_access_tokens(client):
+    first = login(client, "auth_frank")
+    rotated = client.post("/users/refresh", json={"refresh_token": first["refresh_token"]})
+    assert rotated.status_code == 200, rotated.text
+    second = rotated.json()
+    for tokens in (first, second):
+        me = client.get("/users/me", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+        assert me.status_code == 200, me.text
+
+    # the spent token comes back: the whole session ends, access tokens included
+    replay = client.post("/users/refresh", json={"refresh_token": first["refresh_token"]})
+    assert replay.status_code == 401
+    for tokens in (first, second):
+        me = client.get("/users/me", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+        assert me.status_code == 401, me.text
+    assert client.post("/users/refresh", json={"refresh_token": second["refresh_token"]}).status_code == 401
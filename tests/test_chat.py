@@ -0,0 +1,44 @@
+def test_send_message_on_sqlite(client, make_user, follow):
+    alice_id, alice = make_user("chat_alice")
+    bob_id, bob = make_user("chat_bob")
+    follow(alice_id, bob_id)
+    follow(bob_id, alice_id)
+
+    first = client.post("/chat/send", json={"receiver_id": bob_id, "message": "hi bob"}, headers=alice)
+    second = client.post("/chat/send", json={"receiver_id": bob_id, "message": "still there?"}, headers=alice)
+    assert first.status_code == 201, first.text
+    assert second.status_code == 201, second.text
+
+    inbox = client.get("/chat/inbox", headers=bob).json()["conversations"]
+    assert inbox[0]["last_message"]["id"] == second.json()["id"]
+    assert inbox[0]["unread_count"] == 2
+
+    marked = client.post(f"/chat/mark_read/{second.json()['id']}", headers=bob)
+    assert marked.status_code == 200, marked.text
+    assert marked.json()["marked"] == 2
+    inbox = client.get("/chat/inbox", headers=bob).json()["conversations"]
+    assert inbox[0]["unread_count"] == 0
+
+
+def test_stored_message_is_acked_when_the_bus_fails(client, make_user, follow, monkeypatch):
+    from services.chat_bus import chat_bus
+    from services.resp_client import RespError
+
+    carol_id, carol = make_user("chat_carol")
+    dan_id, _ = make_user("chat_dan")
+    follow(carol_id, dan_id)
+    follow(dan_id, carol_id)
+
+    async def failing_publish(user_id, payload):
+        raise RespError("READONLY You can't write against a read only replica.")
+
+    monkeypatch.setattr(chat_bus, "publish", failing_publish)
+    errors = chat_bus.stats["publish_errors"]
+    response = client.post("/chat/send", json={"receiver_id": dan_id, "message": "hello"}, headers=carol)
+    assert response.status_code == 201, response.text
+
+    with client.websocket_connect(f"/chat/ws/{carol_id}") as websocket:
+        websocket.send_json({"receiver_id": dan_id, "message": "again", "client_id": "c1"})
+        ack = websocket.receive_json()
+    assert ack["client_id"] == "c1" and ack["id"]
+    assert chat_bus.stats["publish_errors"] == errors + 2
@@ -0,0 +1,82 @@
+import asyncio
+
+from services.chat_bus import ConnectionRegistry, RespBus
+from services.resp_client import encode_command, read_reply
+
+
+class Socket:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.received = []
+
+    async def send_json(self, payload):
+        await asyncio.sleep(self.delay)
+        self.received.append(payload)
+
+
+def test_listener_survives_errors_and_slow_sockets():
+    async def run():
+        connections = []
+
+        async def handle(reader, writer):
+            connections.append(writer)
+            await read_reply(reader)  # SUBSCRIBE
+            if len(connections) == 1:
+                # first connection: an error reply, which used to end the listener
+                writer.write(b"-ERR something went wrong\r\n")
+                await writer.drain()
+                return
+            writer.write(encode_command("message", "chat:user:not-a-number", "{}"))
+            writer.write(encode_command("message", "chat:user:1", "not json"))
+            for n in range(3):
+                writer.write(encode_command("message", "chat:user:1", f'{{"n": {n}}}'))
+                writer.write(encode_command("message", "chat:user:2", f'{{"n": {n}}}'))
+            await writer.drain()
+            await asyncio.sleep(5)
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        registry = ConnectionRegistry()
+        slow, fast = Socket(delay=0.5), Socket()
+        registry.add(1, slow)
+        registry.add(2, fast)
+        bus = RespBus(registry, url=f"redis://127.0.0.1:{port}/0", reconnect_delay=0.01)
+        await bus.start()
+        for _ in range(100):
+            if len(fast.received) == 3:
+                break
+            await asyncio.sleep(0.01)
+        # user 2 got everything while user 1's socket was still on its first send
+        assert fast.received == [{"n": 0}, {"n": 1}, {"n": 2}]
+        assert slow.received == []
+        assert bus.stats["bad_messages"] == 2
+        assert bus.stats["listener_errors"] >= 1
+        await bus.close()
+        server.close()
+    asyncio.run(run())
+
+
+class StalledSocket:
+    async def send_json(self, payload):
+        await asyncio.sleep(60)
+
+
+def test_memory_bus_never_waits_on_the_receivers_sockets():
+    async def run():
+        from services.chat_bus import MemoryBus
+
+        registry = ConnectionRegistry(send_timeout=0.05)
+        stalled, tab = StalledSocket(), Socket()
+        registry.add(1, stalled)
+        registry.add(1, tab)
+        bus = MemoryBus(registry)
+        # the publisher (the sender's receive loop) returns at once
+        await asyncio.wait_for(bus.publish(1, {"n": 0}), 0.01)
+        for _ in range(50):
+            if tab.received:
+                break
+            await asyncio.sleep(0.01)
+        # the stalled tab is given up on after send_timeout, the other one still gets it
+        assert tab.received == [{"n": 0}]
+        await bus.close()
+    asyncio.run(run())
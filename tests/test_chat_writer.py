@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from services.chat_writer import ChatWriter
+
+DELETED_USER = 999
+
+
+class FlakyWriter(ChatWriter):
+    # stands in for a receiver deleted while their messages were queued
+    def __init__(self):
+        super().__init__(max_age=0.05)
+        self.next_id = 0
+        self.inserts = []
+
+    async def _insert(self, rows):
+        self.inserts.append(len(rows))
+        if any(row["receiver_id"] == DELETED_USER for row in rows):
+            raise ValueError("foreign key violation")
+        ids = list(range(self.next_id + 1, self.next_id + len(rows) + 1))
+        self.next_id += len(rows)
+        return ids
+
+
+def test_one_bad_row_only_fails_its_own_sender():
+    async def run():
+        writer = FlakyWriter()
+        writer.start()
+        results = await asyncio.gather(
+            writer.submit(1, 2, "a"), writer.submit(1, DELETED_USER, "b"), writer.submit(3, 4, "c"),
+            return_exceptions=True
+        )
+        await writer.stop()
+        return writer, results
+
+    writer, results = asyncio.run(run())
+    assert results[0]["message"] == "a" and results[2]["message"] == "c"
+    with pytest.raises(ValueError):
+        raise results[1]
+    assert writer.inserts == [3, 1, 1, 1]
+    assert writer.stats["written"] == 2 and writer.stats["failed"] == 1
@@ -0,0 +1,43 @@
+from services import timeline
+from services.resp_client import RespError
+from utils import encode_cursor
+
+
+def test_feed_is_served_from_the_database_when_the_store_fails(client, make_user, follow, make_post, monkeypatch):
+    reader_id, reader = make_user("feed_gina")
+    author_id, _ = make_user("feed_hank")
+    follow(reader_id, author_id)
+    post_id = make_post(author_id)
+
+    async def failing(*args):
+        raise ConnectionError("feed store is down")
+
+    monkeypatch.setattr(timeline.feed_store, "read", failing)
+    monkeypatch.setattr(timeline.feed_store, "replace", failing)
+    errors = timeline.stats["store_errors"]
+    response = client.get("/feed/", headers=reader)
+    assert response.status_code == 200, response.text
+    assert [post["id"] for post in response.json()["result"]] == [post_id]
+    # the failed read is not followed by a replace that would wait on the store again
+    assert timeline.stats["store_errors"] == errors + 1
+
+
+def test_unfollow_succeeds_when_the_store_fails(client, make_user, follow, monkeypatch):
+    follower_id, follower = make_user("feed_ida")
+    author_id, _ = make_user("feed_jack")
+    follow(follower_id, author_id)
+
+    async def failing(*args):
+        raise RespError("READONLY You can't write against a read only replica.")
+
+    monkeypatch.setattr(timeline.feed_store, "remove_author", failing)
+    response = client.delete(f"/follows/unfollow/{author_id}", headers=follower)
+    assert response.status_code == 200, response.text
+
+
+def test_feed_rejects_malformed_cursors(client, make_user):
+    _, headers = make_user("feed_kim")
+    for cursor in (encode_cursor(), encode_cursor("10"), encode_cursor(1, 2), encode_cursor(True)):
+        response = client.get("/feed/", params={"cursor": cursor}, headers=headers)
+        assert response.status_code == 400, (cursor, response.text)
+        assert response.json()["detail"] == "Invalid cursor"
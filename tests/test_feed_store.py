@@ -0,0 +1,23 @@
+import asyncio
+
+from services.feed_store import MemoryFeedStore
+
+
+def test_memory_timelines_expire_and_get_rebuilt(monkeypatch):
+    import services.feed_store as feed_store
+
+    now = [1000.0]
+    monkeypatch.setattr(feed_store.time, "monotonic", lambda: now[0])
+
+    async def run():
+        store = MemoryFeedStore(ttl=60)
+        await store.replace(1, [(10, 7)])
+        await store.push([1], 11, 7)
+        assert await store.read(1, None, 10) == [(11, 7), (10, 7)]
+        now[0] += 61
+        # a post fanned out on another worker never reached this copy: the
+        # timeline reads as missing so the caller rebuilds it
+        assert await store.read(1, None, 10) is None
+        await store.push([1], 12, 7)
+        assert await store.read(1, None, 10) is None
+    asyncio.run(run())
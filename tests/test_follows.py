@@ -0,0 +1,21 @@
+from utils import encode_cursor
+
+
+def test_follow_lists_reject_malformed_cursors(client, make_user):
+    _, headers = make_user("follows_lena")
+    for path in ("/follows/followers", "/follows/following"):
+        for cursor in (encode_cursor(), encode_cursor(1, 2), encode_cursor("1")):
+            response = client.get(path, params={"cursor": cursor}, headers=headers)
+            assert response.status_code == 400, (path, cursor, response.text)
+            assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_follow_lists_page_with_their_own_cursor(client, make_user, follow):
+    user_id, headers = make_user("follows_mia")
+    for n in range(3):
+        other_id, _ = make_user(f"follows_mia_fan{n}")
+        follow(other_id, user_id)
+    first = client.get("/follows/followers", params={"limit": 2}, headers=headers).json()
+    second = client.get("/follows/followers", params={"limit": 2, "cursor": first["nextCursor"]}, headers=headers)
+    assert second.status_code == 200, second.text
+    assert len(first["followers"]) + len(second.json()["followers"]) == 3
@@ -0,0 +1,58 @@
+import asyncio
+import io
+
+from PIL import Image
+from sqlalchemy import select, func
+
+from database import AsyncSessionLocal, SessionLocal, async_engine
+from models import ImageVariants, Users
+from services.blob_store import blob_store
+from services.images import process_image, shutdown_executor
+
+
+def test_variants_are_committed_separately_and_once(make_user):
+    user_id, _ = make_user("images_carol")
+    png = io.BytesIO()
+    Image.new("RGB", (300, 200), "red").save(png, format="PNG")
+    png.seek(0)
+    source_key = blob_store.put_stream(png).key
+
+    async def run():
+        async with AsyncSessionLocal() as first, AsyncSessionLocal() as second:
+            user = await first.get(Users, user_id)
+            user.fullname = "never committed"
+            # the same upload twice at once must not raise on the unique constraint
+            await asyncio.gather(process_image(first, source_key, "avatar"), process_image(second, source_key, "avatar"))
+            await first.rollback()
+        await async_engine.dispose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        shutdown_executor()
+    with SessionLocal() as db:
+        count = db.scalar(select(func.count()).select_from(ImageVariants).where(ImageVariants.source_key == source_key))
+        assert count == 2
+        assert db.get(Users, user_id).fullname == "images_carol"
+
+
+def test_undecodable_uploads_and_failures_are_told_apart(monkeypatch):
+    import services.images as images
+
+    not_an_image = blob_store.put_stream(io.BytesIO(b"definitely not an image")).key
+    assert images.render_variants(not_an_image, "post") is None
+
+    class BrokenPool:
+        def submit(self, *args, **kwargs):
+            raise RuntimeError("A process in the process pool was terminated abruptly")
+
+    monkeypatch.setattr(images, "get_executor", lambda: BrokenPool())
+    failed = images.stats["failed"]
+
+    async def run():
+        async with AsyncSessionLocal() as db:
+            await process_image(db, not_an_image, "post")
+        await async_engine.dispose()
+
+    asyncio.run(run())
+    assert images.stats["failed"] == failed + 1
@@ -0,0 +1,23 @@
+from sqlalchemy import select, func
+
+from database import SessionLocal
+from models import Likes, Posts
+
+
+def test_like_missing_post_is_404_without_orphan(client, make_user):
+    _, headers = make_user("likes_dave")
+    response = client.post("/likes/987654", headers=headers)
+    assert response.status_code == 404, response.text
+    with SessionLocal() as db:
+        assert db.scalar(select(func.count()).select_from(Likes).where(Likes.post_id == 987654)) == 0
+
+
+def test_like_is_idempotent(client, make_user, make_post):
+    user_id, headers = make_user("likes_erin")
+    post_id = make_post(user_id)
+    first = client.post(f"/likes/{post_id}", headers=headers)
+    second = client.post(f"/likes/{post_id}", headers=headers)
+    assert first.status_code == 201 and first.json()["created"] is True
+    assert second.status_code == 201 and second.json()["created"] is False
+    with SessionLocal() as db:
+        assert db.scalar(select(Posts.like_count).where(Posts.id == post_id)) == 1
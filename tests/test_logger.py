@@ -0,0 +1,37 @@
+import asyncio
+
+from middlewares.logger import CloudWatchSink, LogShipper
+
+
+class InvalidSequenceToken(Exception):
+    def __init__(self):
+        self.response = {"expectedSequenceToken": "next"}
+
+
+class DataAlreadyAccepted(Exception):
+    pass
+
+
+class RejectingClient:
+    # a stream whose sequence token keeps moving under us
+    class exceptions:
+        InvalidSequenceTokenException = InvalidSequenceToken
+        DataAlreadyAcceptedException = DataAlreadyAccepted
+        ResourceAlreadyExistsException = Exception
+
+    def create_log_stream(self, **kwargs):
+        pass
+
+    def put_log_events(self, **kwargs):
+        raise InvalidSequenceToken()
+
+
+def test_batch_rejected_after_retries_is_counted_as_failed():
+    sink = CloudWatchSink.__new__(CloudWatchSink)
+    sink.client, sink.log_group, sink.log_stream = RejectingClient(), "group", "stream"
+    sink.sequence_token, sink._stream_ready = None, False
+    shipper = LogShipper(sink=sink)
+
+    asyncio.run(shipper._ship([{"timestamp": 0, "message": "{}"}]))
+    assert shipper.stats["sent"] == 0
+    assert shipper.stats["failed"] == 1
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from middlewares.rate_limit import RateLimitMiddleware
+from middlewares.rate_limit_backends import RateLimiterBackend
+from services.resp_client import RespError
+
+
+class FailingBackend(RateLimiterBackend):
+    def __init__(self, error):
+        self.error = error
+
+    async def hit(self, key, limit, window):
+        raise self.error
+
+
+@pytest.mark.parametrize("error", [
+    RespError("ERR max clients"), asyncio.TimeoutError(), asyncio.IncompleteReadError(b"", 10), ConnectionError()
+])
+def test_fails_open_when_backend_errors(error):
+    app = Starlette(routes=[Route("/ok", lambda request: PlainTextResponse("ok"))])
+    app.add_middleware(RateLimitMiddleware, backend=FailingBackend(error))
+    response = TestClient(app).get("/ok")
+    assert response.status_code == 200
+    assert "RateLimit-Limit" not in response.headers
+
+
+def test_shared_memory_backend_waits_for_the_lock_without_blocking_the_loop():
+    import fcntl
+    import os
+    import uuid
+
+    from middlewares.rate_limit_backends import SharedMemoryBackend
+
+    name = f"blogsite_test_{uuid.uuid4().hex[:8]}"
+    backend = SharedMemoryBackend(name, slots=64)
+    # another worker holding the lock: a separate open file description
+    other = open(os.path.join("/tmp", f"{name}.lock"), "a+")
+    fcntl.flock(other, fcntl.LOCK_EX)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        ticking = asyncio.create_task(ticker())
+        asyncio.get_running_loop().call_later(0.05, fcntl.flock, other, fcntl.LOCK_UN)
+        result = await asyncio.wait_for(backend.hit("ip:1", 10, 60), 1)
+        ticking.cancel()
+        return result, ticks
+
+    try:
+        result, ticks = asyncio.run(run())
+        assert result.allowed and result.remaining == 9
+        # the loop kept running while the lock was held elsewhere
+        assert ticks >= 5
+    finally:
+        other.close()
+        asyncio.run(backend.close())
+        backend._shm.unlink()
+        os.remove(os.path.join("/tmp", f"{name}.lock"))
+
+
+def test_shared_memory_backend_rejects_platforms_without_fcntl(monkeypatch):
+    import middlewares.rate_limit_backends as backends
+
+    monkeypatch.setattr(backends, "fcntl", None)
+    with pytest.raises(RuntimeError):
+        backends.SharedMemoryBackend("blogsite_test_unsupported", slots=8)
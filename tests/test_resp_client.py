@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from services.resp_client import RespClient, read_reply
+
+
+async def fake_server(delays: dict):
+    # answers "ECHO x" with x, after delays.get(x, 0) seconds
+    async def handle(reader, writer):
+        try:
+            while True:
+                command = await read_reply(reader)
+                value = command[1]
+                await asyncio.sleep(delays.get(value.decode(), 0))
+                writer.write(b"$%d\r\n%s\r\n" % (len(value), value))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_timed_out_command_does_not_desync_the_connection():
+    async def run():
+        server, port = await fake_server({"slow": 0.2})
+        client = RespClient(f"redis://127.0.0.1:{port}/0", timeout=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await client.execute("ECHO", "slow")
+        # the late "slow" reply must not be read as the answer to this one
+        assert await client.execute("ECHO", "fast") == b"fast"
+        await client.close()
+        server.close()
+    asyncio.run(run())
+
+
+def test_cancelled_command_does_not_desync_the_connection():
+    async def run():
+        server, port = await fake_server({"slow": 0.1})
+        client = RespClient(f"redis://127.0.0.1:{port}/0")
+        task = asyncio.create_task(client.execute("ECHO", "slow"))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert await client.execute("ECHO", "fast") == b"fast"
+        await client.close()
+        server.close()
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+
+from services.response_cache import MemoryCacheBackend, ResponseCache
+
+
+def test_tag_versions_are_bounded_and_never_repeat():
+    async def run():
+        backend = MemoryCacheBackend(max_tags=2)
+        await backend.invalidate(["post:1"])
+        _, (before,), _ = await backend.get("k", ["post:1"])
+        await backend.invalidate(["post:2", "post:3"])
+        assert len(backend._versions) == 2
+        # post:1 was evicted: it reads as the highest evicted version, so an
+        # entry computed before the eviction still matches
+        assert (await backend.get("k", ["post:1"]))[1] == [before]
+        await backend.invalidate(["post:1"])
+        assert (await backend.get("k", ["post:1"]))[1][0] > before
+    asyncio.run(run())
+
+
+def test_recent_invalidation_recomputes_on_primary(monkeypatch):
+    import database
+
+    sessions = []
+
+    class Session:
+        def __init__(self, name):
+            self.name = name
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(database, "AsyncSessionLocal", lambda: Session("primary"))
+
+    async def compute(db):
+        sessions.append(db.name)
+        return {"from": db.name}
+
+    async def run():
+        cache = ResponseCache(MemoryCacheBackend(replica_lag=60))
+        replica = Session("replica")
+        assert await cache.cached("posts", "all", ["posts"], compute, replica) == {"from": "replica"}
+        await cache.invalidate("posts")
+        assert await cache.cached("posts", "all", ["posts"], compute, replica) == {"from": "primary"}
+    asyncio.run(run())
+    assert sessions == ["replica", "primary"]
+
+
+def test_error_replies_bypass_the_cache():
+    from services.resp_client import RespError
+
+    class FailingBackend(MemoryCacheBackend):
+        async def get(self, key, tags):
+            raise RespError("OOM command not allowed when used memory > 'maxmemory'")
+
+        async def invalidate(self, tags):
+            raise RespError("READONLY You can't write against a read only replica.")
+
+    async def compute(db):
+        return {"ok": True}
+
+    async def run():
+        cache = ResponseCache(FailingBackend())
+        assert await cache.cached("posts", "k", ["post:1"], compute, None) == {"ok": True}
+        await cache.invalidate("post:1")
+        assert cache.stats["posts"]["errors"] == 1
+        assert cache.invalidations["errors"] == 1
+    asyncio.run(run())
@@ -0,0 +1,13 @@
+from services.search import highlight, safe_headline, HEADLINE_START, HEADLINE_STOP
+
+
+def test_highlight_escapes_post_text():
+    snippet = highlight("posts <script>alert(1)</script> & more", {"post"})
+    assert snippet.startswith("<b>posts</b> ")
+    assert "<script>" not in snippet
+    assert "&lt;script&gt;" in snippet and "&amp;" in snippet
+
+
+def test_headline_markers_survive_escaping():
+    headline = f"see {HEADLINE_START}<img src=x onerror=alert(1)>{HEADLINE_STOP} here"
+    assert safe_headline(headline) == "see <b>&lt;img src=x onerror=alert(1)&gt;</b> here"
@@ -0,0 +1,142 @@
+import base64
+import json
+from datetime import datetime
+
+import anyio
+from fastapi import Request, HTTPException, status
+from fastapi.responses import Response
+
+from services.blob_store import blob_store, BlobNotFound, LocalBlobStore, CHUNK_SIZE
+
+# blobs are content addressed, so a URL that names the hash never changes
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# URLs that can point at different content after an update must revalidate
+REVALIDATE_CACHE = "private, no-cache"
+
+
+def _etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _parse_range(header: str, size: int):
+    # single "bytes=start-end" ranges only; anything else is served in full
+    if not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[6:].strip().partition("-")
+    try:
+        if start == "":
+            length = int(end)
+            if length == 0:
+                raise ValueError
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return False
+    if start >= size or start > end:
+        return False
+    return start, min(end, size - 1)
+
+
+class BlobResponse(Response):
+    # Streams [start, end] of a blob. Local blobs use the ASGI zero-copy send
+    # extension when the server offers it, otherwise chunks are read in a worker
+    # thread; remote blobs are fetched with a ranged GET.
+    def __init__(self, key: str, start: int, end: int, status_code: int, headers: dict, media_type: str, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.key = key
+        self.start = start
+        self.end = end
+        self.send_body = send_body
+        self.headers["content-length"] = str(end - start + 1 if end >= start else 0)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if not self.send_body or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if isinstance(blob_store, LocalBlobStore):
+            with open(blob_store.path(self.key), "rb") as body:
+                if "http.response.zerocopysend" in scope.get("extensions", {}):
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": body.fileno(),
+                        "offset": self.start,
+                        "count": count,
+                        "more_body": False,
+                    })
+                    return
+                await anyio.to_thread.run_sync(body.seek, self.start)
+                await self._send_chunks(body, count, send)
+        else:
+            blob = await anyio.to_thread.run_sync(
+                lambda: blob_store.get_object(self.key, Range=f"bytes={self.start}-{self.end}")
+            )
+            with blob["Body"] as body:
+                await self._send_chunks(body, count, send)
+
+    async def _send_chunks(self, body, count, send):
+        while count > 0:
+            chunk = await anyio.to_thread.run_sync(body.read, min(CHUNK_SIZE, count))
+            if not chunk:
+                break
+            count -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+        if count > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def blob_response(request: Request, key: str, content_type: str | None, cache_control: str) -> Response:
+    # conditional (If-None-Match / If-Range) and ranged responses for a stored blob
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    try:
+        head = await anyio.to_thread.run_sync(blob_store.head_object, key)
+    except BlobNotFound:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    size = head["ContentLength"]
+    media_type = content_type or "application/octet-stream"
+    send_body = request.method != "HEAD"
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is False:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            return BlobResponse(key, start, end, status.HTTP_206_PARTIAL_CONTENT, headers, media_type, send_body)
+    return BlobResponse(key, 0, size - 1, status.HTTP_200_OK, headers, media_type, send_body)
+
+
+# Opaque keyset-pagination cursors: the sort key of the last row, as urlsafe
+# base64 JSON. Datetimes round-trip through ISO format.
+def encode_cursor(*values) -> str:
+    payload = [{"dt": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    # with types given, the cursor must hold exactly one value of each, in order
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list):
+            raise ValueError
+        values = [datetime.fromisoformat(value["dt"]) if isinstance(value, dict) else value for value in payload]
+        if types and (len(values) != len(types) or not all(
+            isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(values, types)
+        )):
+            raise ValueError
+        return values
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")